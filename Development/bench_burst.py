@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+# Benchmark of the burst merges in lib/burst.py on synthetic noisy frames: a
+# clean scene (the sample photo scaled to --megapixels) plus Gaussian sensor
+# noise per frame. Reports the PSNR of a single frame and of the merge, the
+# throughput and the peak memory allocated by the merge alone (tracemalloc, the
+# stack is built beforehand), next to a whole-stack float32 np.mean/np.median
+# for comparison. Fusion merges an exposure bracket where the short frames clip
+# less and the long ones are less noisy. Then the real memory ceiling: the peak
+# of capture plus merge through BurstCapture, with RGBX frames as the main
+# stream delivers them, and the median burst that MAX_STACK_BYTES rejects.
+# Finally BurstCapture runs against the fake camera.
+# Run from the repository root: python3 Development/bench_burst.py [--megapixels 12 --frames 8]
+
+import argparse
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image
+
+from lib.burst import MAX_STACK_BYTES, BurstCapture, MeanAccumulator, fuse_exposures, merge_median, \
+    parse_burst_args
+from lib.camera_session import CameraSession
+from fake_camera import FakeCamera
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'image_dir', 'mountain-stream-in-forest.jpg')
+NOISE_SIGMA = 12
+
+
+def scene(megapixels):
+    photo = Image.open(IMAGE).convert('RGB')
+    width = int(math.sqrt(megapixels * 1e6 * photo.width / photo.height))
+    height = int(width * photo.height / photo.width)
+    # A dark scene, as at dusk
+    return (np.asarray(photo.resize((width, height))) * 0.4).astype(np.uint8)
+
+
+def noisy(clean, rng, gain=1.0):
+    frame = clean.astype(np.float32) * gain + rng.normal(0, NOISE_SIGMA / math.sqrt(gain), clean.shape)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def psnr(reference, image):
+    error = np.mean((reference.astype(np.float32) - image.astype(np.float32)) ** 2)
+    return 10 * math.log10(255 ** 2 / error)
+
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+class SyntheticSession:
+    """The CameraSession calls BurstCapture makes, every capture returns a new noisy RGBX frame."""
+    def __init__(self, clean, rng):
+        rgbx = np.dstack([clean, np.full(clean.shape[:2], 255, dtype=np.uint8)])
+        # A few noisy frames made beforehand, a capture copies one like capture_array() allocates a new frame
+        self.frames = [noisy(rgbx, rng) for _ in range(3)]
+        self.captures = 0
+
+    def capture_array(self, name='main'):
+        self.captures += 1
+        return self.frames[self.captures % len(self.frames)].copy()
+
+    def capture_metadata(self):
+        return {'ExposureTime': 10000, 'AnalogueGain': 1.0}
+
+    def capture_array_with_controls(self, controls, name='main'):
+        return self.capture_array(name)
+
+    def restore_auto_exposure(self):
+        pass
+
+
+def report(name, clean, result, elapsed, peak, pixels):
+    print(f"{name:32s} PSNR {psnr(clean, result):5.1f} dB  {pixels / elapsed / 1e6:6.1f} MP/s  "
+          f"peak {peak / 1e6:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--megapixels', type=float, default=12)
+    parser.add_argument('--frames', type=int, default=8)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    clean = scene(args.megapixels)
+    pixels = clean.shape[0] * clean.shape[1] * args.frames
+    stack = np.stack([noisy(clean, rng) for _ in range(args.frames)])
+    print(f"{clean.shape[1]}x{clean.shape[0]} x {args.frames} frames, stack {stack.nbytes / 1e6:.0f} MB, "
+          f"single frame PSNR {psnr(clean, stack[0]):.1f} dB")
+
+    def streaming_mean():
+        accumulator = MeanAccumulator(stack.shape[1:])
+        for frame in stack:
+            accumulator.add(frame)
+        return accumulator.result()
+
+    print("merge only, stack built beforehand:")
+    report("mean, running sum", clean, *measure(streaming_mean), pixels)
+    report("median, chunked", clean, *measure(lambda: merge_median(stack)), pixels)
+    report("whole stack np.mean float32", clean,
+           *measure(lambda: np.mean(stack.astype(np.float32), axis=0).round().astype(np.uint8)), pixels)
+    report("whole stack np.median", clean, *measure(lambda: np.median(stack, axis=0).astype(np.uint8)), pixels)
+
+    # Bracket -2, 0, +2 EV of a scene with bright highlights
+    bright = np.clip(clean.astype(np.float32) * 2.5, 0, 255).astype(np.uint8)
+    bracket = np.stack([noisy(bright, rng, gain) for gain in (0.25, 1.0, 4.0)])
+    fused, elapsed, peak = measure(lambda: fuse_exposures(bracket))
+    print(f"{'fusion -2,0,+2 EV':32s} {bracket.shape[0] * clean.size / 3 / elapsed / 1e6:6.1f} MP/s  "
+          f"peak {peak / 1e6:7.1f} MB  clipped pixels: 0 EV {np.mean(bracket[1] == 255) * 100:.1f}%, "
+          f"fused {np.mean(fused == 255) * 100:.1f}%")
+
+    del stack, bracket
+    session = SyntheticSession(clean, rng)
+    frame_bytes = session.frames[0].nbytes
+    fitting = MAX_STACK_BYTES // frame_bytes
+    print(f"capture + merge through BurstCapture, {frame_bytes / 1e6:.0f} MB RGBX frames, "
+          f"MAX_STACK_BYTES {MAX_STACK_BYTES / 1e6:.0f} MB:")
+    for mode, frames, ev in (('mean', args.frames, ()), ('median', fitting, ()), ('fusion', 0, (-2, 0, 2))):
+        merged, elapsed, peak = measure(lambda: BurstCapture(session).capture(frames, mode, ev))
+        frames = frames or len(ev)
+        print(f"  {mode} x {frames}: {elapsed:.2f} s, peak {peak / 1e6:.0f} MB "
+              f"({peak / frame_bytes:.1f} frames)")
+        assert peak < MAX_STACK_BYTES + 4 * frame_bytes, f"{mode} peak {peak / 1e6:.0f} MB"
+    try:
+        parse_burst_args({'frames': str(args.frames), 'mode': 'median'}, frame_bytes)
+        rejected = args.frames <= fitting
+    except ValueError as ex:
+        rejected = True
+        print(f"  median x {args.frames} rejected by parse_burst_args: {ex}")
+    assert rejected
+    try:
+        BurstCapture(session).capture(fitting + 1, 'median')
+        assert False, "stack over MAX_STACK_BYTES allocated"
+    except ValueError as ex:
+        print(f"  median x {fitting + 1} stopped by BurstCapture after one frame: {ex}")
+    del session
+
+    camera = FakeCamera(size=(640, 480), fps=120, converge_after=0.1)
+    session = CameraSession(camera, config=lambda cam: cam.create_still_configuration())
+    burst = BurstCapture(session)
+    for mode, ev in (('mean', ()), ('median', ()), ('fusion', (-2, 0, 2))):
+        merged = burst.capture(4, mode, ev)
+        assert merged.shape == (480, 640, 4) and merged.dtype == np.uint8, f"{mode}: {merged.shape} {merged.dtype}"
+    assert camera.controls.get('ExposureTime') == 0, "AE not restored after the bracket"
+    session.close()
+    print("OK: BurstCapture mean, median and fusion against the fake camera")
+
+
+if __name__ == '__main__':
+    main()
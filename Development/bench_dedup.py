@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+
+# Benchmark of lib/dedup.py on a day of synthetic scheduled captures of a
+# static scene (the sample photo with sensor noise and a slow brightness
+# drift), in which a car parks for a few captures and something passes once.
+# Reports the hash time of a 4608x2592 frame (RGBX array and PIL image) next to
+# the JPEG encode it saves, the Hamming distances of unchanged and changed
+# captures, and the uploads and bytes avoided. The arrival and the passing
+# object must be kept; the departure looks like the empty scene still in the
+# hash window and is skipped.
+# Run from the repository root: python3 Development/bench_dedup.py [--captures 144 --distance 4]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import simplejpeg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image
+
+from lib.dedup import CaptureDeduplicator, dhash
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'image_dir', 'mountain-stream-in-forest.jpg')
+CAPTURE_SIZE = (4608, 2592)
+ANALYSIS_SIZE = (1152, 648)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--captures', type=int, default=144)
+    parser.add_argument('--distance', type=int, default=4)
+    args = parser.parse_args()
+
+    photo = Image.open(IMAGE).convert('RGBX')
+    full = np.ascontiguousarray(np.asarray(photo.resize(CAPTURE_SIZE)))
+    start = time.perf_counter()
+    for _ in range(10):
+        dhash(full)
+    array_time = (time.perf_counter() - start) / 10
+    image = photo.convert('RGB').resize(CAPTURE_SIZE)
+    start = time.perf_counter()
+    dhash(image)
+    image_time = time.perf_counter() - start
+    start = time.perf_counter()
+    jpeg = simplejpeg.encode_jpeg(full, quality=85, colorspace='RGBX')
+    encode_time = time.perf_counter() - start
+    print(f"{CAPTURE_SIZE[0]}x{CAPTURE_SIZE[1]}: dHash {array_time * 1000:.2f} ms (array), "
+          f"{image_time * 1000:.0f} ms (PIL image), JPEG encode {encode_time * 1000:.0f} ms, {len(jpeg) // 1024} KB")
+
+    # The sequence at a quarter of the resolution, the hash only sees 72x64 pixels anyway
+    rng = np.random.default_rng(1)
+    scene = np.asarray(photo.resize(ANALYSIS_SIZE), dtype=np.float32)
+    parked = range(args.captures // 3, args.captures // 3 + 6)
+    passing = args.captures * 2 // 3
+    changes = {parked.start, passing}
+    with tempfile.TemporaryDirectory() as folder:
+        deduplicator = CaptureDeduplicator(args.distance, path=os.path.join(folder, 'dedup.json'))
+        same, changed, kept_changes = [], [], 0
+        for index in range(args.captures):
+            frame = scene * (0.9 + 0.1 * index / args.captures) + rng.normal(0, 6, scene.shape)
+            if index in parked:
+                frame[350:550, 200:600] = 230
+            if index == passing:
+                frame[100:400, 700:900] = 30
+            duplicate = deduplicator.check(np.clip(frame, 0, 255).astype(np.uint8))
+            if deduplicator.last_distance is not None:
+                (changed if index in changes else same).append(deduplicator.last_distance)
+            if not duplicate:
+                kept_changes += index in changes
+                # Capture and one derivative uploaded to one destination
+                deduplicator.kept(2, len(jpeg) + len(jpeg) // 8)
+        stats = deduplicator.stats()
+        print(f"distances: unchanged captures {min(same)}-{max(same)} bits, changed "
+              f"{min(changed)}-{max(changed)} bits (threshold {args.distance})")
+        print(f"{args.captures} captures, {stats['duplicates']} skipped, {stats['uploads_avoided']} uploads and "
+              f"{stats['bytes_avoided'] / 1e6:.0f} MB avoided, {kept_changes}/{len(changes)} changed captures kept")
+        assert kept_changes == len(changes), "a changed capture was skipped"
+        assert CaptureDeduplicator(args.distance, path=os.path.join(folder, 'dedup.json')).stats() == stats
+    print("OK: changed captures kept, state restored from dedup.json")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+# Benchmark of lib.derivatives.DerivativeEncoder on a full resolution (4608x2592)
+# RGBX frame: the derivative widths made on demand the way liveResize.php does
+# (decode the full JPEG, resample from full size per request), every width
+# resized from the full frame, and the pyramid (successive downscaling) with 1
+# and --workers encoder threads.
+# Run from the repository root: python3 Development/bench_derivatives.py [--widths 1920,1200,800,400]
+
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import simplejpeg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image
+
+from lib.derivatives import DerivativeEncoder, parse_widths
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'image_dir', 'mountain-stream-in-forest.jpg')
+CAPTURE_SIZE = (4608, 2592)
+RUNS = 5
+
+
+def timed(function):
+    function()
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        result = function()
+    return result, (time.perf_counter() - start) / RUNS
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--widths', default='1920,1200,800,400')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    widths = parse_widths(args.widths)
+
+    array = np.ascontiguousarray(np.asarray(Image.open(IMAGE).convert('RGBX').resize(CAPTURE_SIZE)))
+    jpeg = simplejpeg.encode_jpeg(array, quality=85, colorspace='RGBX')
+    height, width = array.shape[:2]
+
+    def on_demand():
+        sizes = {}
+        for target in widths:
+            image = Image.open(io.BytesIO(jpeg)).convert('RGB')
+            resized = image.resize((target, round(height * target / width)), Image.BILINEAR)
+            buffer = io.BytesIO()
+            resized.save(buffer, format='jpeg', quality=85)
+            sizes[target] = buffer.getvalue()
+        return sizes
+
+    def from_full():
+        image = Image.fromarray(array, 'RGBX')
+        return {target: simplejpeg.encode_jpeg(
+            np.asarray(image.resize((target, round(height * target / width)), Image.BILINEAR)),
+            quality=85, colorspace='RGBX') for target in widths}
+
+    print(f"{width}x{height} frame, widths {', '.join(map(str, widths))}")
+    _, elapsed = timed(on_demand)
+    print(f"{'decode + resize per request':34s} {elapsed * 1000:6.0f} ms")
+    _, elapsed = timed(from_full)
+    print(f"{'every width from the full frame':34s} {elapsed * 1000:6.0f} ms")
+    for workers in (1, args.workers):
+        encoder = DerivativeEncoder(widths, quality=85, workers=workers)
+        derivatives, elapsed = timed(lambda: encoder.render(array))
+        encoder.close()
+        print(f"{f'pyramid, {workers} encoder threads':34s} {elapsed * 1000:6.0f} ms  "
+              + ', '.join(f"{target}: {len(data) // 1024} KB" for target, data in derivatives.items()))
+    assert sorted(derivatives) == sorted(target for target in widths if target < width)
+    for target, data in derivatives.items():
+        assert Image.open(io.BytesIO(data)).size[0] == target
+
+
+if __name__ == '__main__':
+    main()
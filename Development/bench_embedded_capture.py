@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+# Benchmark of the embedded capture pipeline on a synthetic 4608x2592 RGBX frame
+# (the sample photo scaled up, as capture_array() of the XBGR8888 main stream).
+# The old path: the camera writes a JPEG (Picamera2 capture_file, PIL quality
+# 90), it's decoded, the overlay pasted, re-encoded at quality 100 for the
+# response and saved once more per ftp-destination. The new path:
+# lib.overlay.encode_with_overlay() blits the overlay into the frame and encodes
+# it once, the bytes are written to one file. Reports the time per capture.
+# Run from the repository root: python3 Development/bench_embedded_capture.py [--destinations 2 --runs 3]
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image
+
+from lib.overlay import encode_with_overlay, get_renderer
+from lib.target_size import TargetSizeEncoder
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'image_dir', 'mountain-stream-in-forest.jpg')
+FONT = os.path.join(os.path.dirname(__file__), '..', 'fonts', 'AmazeFont.otf')
+CAPTURE_SIZE = (4608, 2592)
+TIMESTAMP = 'Saturday, October 17, 2026 - 14:05:09'
+
+
+def old_capture(frame, renderer, folder, destinations):
+    """capture_file() to a buffer, decode, paste, encode for the response, save per destination."""
+    photo_buffer = io.BytesIO()
+    Image.fromarray(frame[:, :, :3]).save(photo_buffer, format='jpeg', quality=90)
+    photo_buffer.seek(0)
+    background = Image.open(photo_buffer)
+    renderer.paste(background, TIMESTAMP, (0, 0))
+    output_buffer = io.BytesIO()
+    background.save(output_buffer, format='jpeg', quality=100)
+    file_name = os.path.join(folder, 'old.jpg')
+    for _ in range(destinations):
+        background.save(file_name, format='jpeg')
+    return output_buffer.getvalue()
+
+
+def new_capture(frame, renderer, encoder, folder):
+    """capture_array() returns a new frame, the overlay is blitted into it and it's encoded once."""
+    array = frame.copy()
+    jpeg = encode_with_overlay(array, renderer, TIMESTAMP, encoder, 0, 100).data
+    with open(os.path.join(folder, 'new.jpg'), 'wb') as f:
+        f.write(jpeg)
+    return jpeg
+
+
+def timed(function, runs):
+    """:return (result, best seconds of runs)"""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--destinations', type=int, default=2)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    frame = np.ascontiguousarray(np.asarray(Image.open(IMAGE).convert('RGBX').resize(CAPTURE_SIZE)))
+    renderer = get_renderer(FONT, 48, 'silver', 'black', 'camera', True)
+    encoder = TargetSizeEncoder()
+    with tempfile.TemporaryDirectory() as folder:
+        old, old_time = timed(lambda: old_capture(frame, renderer, folder, args.destinations), args.runs)
+        new, new_time = timed(lambda: new_capture(frame, renderer, encoder, folder), args.runs)
+        overlay = np.asarray(Image.open(io.BytesIO(new)))[:renderer.pixels.shape[0], :renderer.pixels.shape[1]]
+    print(f"{CAPTURE_SIZE[0]}x{CAPTURE_SIZE[1]}, {args.destinations} destinations, best of {args.runs}:")
+    print(f"  decode, paste, re-encode, save per destination: {old_time * 1000:.0f} ms, {len(old) // 1024} KB")
+    print(f"  blit into the raw frame, encode once:           {new_time * 1000:.0f} ms, {len(new) // 1024} KB "
+          f"({old_time / new_time:.1f}x)")
+    # The overlay made it into the JPEG, close to the rendered pixels despite the compression
+    assert np.abs(overlay.astype(np.int16) - renderer.pixels).mean() < 8
+    assert new_time < old_time
+    print("OK: one encode per capture, overlay in the image")
+
+
+if __name__ == '__main__':
+    main()
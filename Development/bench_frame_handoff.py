@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+
+# Benchmark: frame hand-off from the encoder to a viewer in streamingServer2.py.
+# Compares the old shared BytesIO polled every 100 ms with the StreamingOutput
+# ring, fed by a synthetic 30 fps frame source. Reports delivered frame rate,
+# latency (publish to delivery), duplicate frames and torn frames.
+# Run from the repository root: python3 Development/bench_frame_handoff.py
+
+import io
+import os
+import statistics
+import struct
+import sys
+import time
+import zlib
+from threading import Thread, Event
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.streaming_output import StreamingOutput
+
+FPS = 30
+SECONDS = 5
+FRAME_SIZE = 256 * 1024
+HEADER = struct.Struct('!QdI')  # sequence, publish time, crc of the payload
+
+
+def make_frame(sequence, payload):
+    return HEADER.pack(sequence, time.monotonic(), zlib.crc32(payload)) + payload
+
+
+def check_frame(data):
+    sequence, published, crc = HEADER.unpack_from(data)
+    torn = zlib.crc32(data[HEADER.size:]) != crc
+    return sequence, published, torn
+
+
+def producer(write, stopped):
+    payloads = [os.urandom(FRAME_SIZE) for _ in range(4)]
+    sequence = 0
+    deadline = time.monotonic()
+    while not stopped.is_set():
+        sequence += 1
+        write(make_frame(sequence, payloads[sequence % len(payloads)]))
+        deadline += 1.0 / FPS
+        stopped.wait(max(deadline - time.monotonic(), 0))
+
+
+def polling():
+    """The old generate_frames(): MjpegOutput writes into a BytesIO without a lock."""
+    buffer = io.BytesIO()
+
+    def write(data):
+        buffer.write(data)
+        buffer.seek(0)
+
+    def frames(stopped):
+        while not stopped.is_set():
+            buffer.seek(0)
+            data = buffer.read()
+            if data:
+                yield data
+            time.sleep(0.1)
+
+    return write, frames
+
+
+def ring():
+    output = StreamingOutput()
+
+    def frames(stopped):
+        client = output.register()
+        try:
+            while not stopped.is_set():
+                frame = client.next_frame(timeout=0.5)
+                if frame is not None:
+                    yield frame.data
+        finally:
+            client.close()
+
+    return output.write, frames
+
+
+def run(name, setup):
+    write, frames = setup()
+    stopped = Event()
+    results = []
+
+    def consume():
+        for data in frames(stopped):
+            results.append((time.monotonic(), data))
+
+    consumer = Thread(target=consume)
+    consumer.start()
+    source = Thread(target=producer, args=(write, stopped))
+    source.start()
+    time.sleep(SECONDS)
+    stopped.set()
+    source.join()
+    consumer.join()
+
+    latencies = []
+    seen = set()
+    duplicates = 0
+    torn = 0
+    for received, data in results:
+        sequence, published, is_torn = check_frame(data)
+        if is_torn:
+            torn += 1
+            continue
+        if sequence in seen:
+            duplicates += 1
+            continue
+        seen.add(sequence)
+        latencies.append((received - published) * 1000)
+    latency = (f"latency median {statistics.median(latencies):6.2f} ms max {max(latencies):6.2f} ms"
+               if latencies else "latency n/a")
+    print(f"{name:>8}: {len(seen) / SECONDS:5.1f} fps delivered, {latency}, "
+          f"{duplicates} duplicates, {torn} torn")
+
+
+def main():
+    print(f"Synthetic source: {FPS} fps, {FRAME_SIZE // 1024} KB frames, {SECONDS} s")
+    run('polling', polling)
+    run('ring', ring)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+# Benchmark: cost of building the multipart MJPEG chunk per client (old gen_frames())
+# against sharing the chunk built once per frame by lib.streaming_output.StreamingOutput.
+# Reports allocated bytes and CPU time per frame for 1, 10 and 50 simulated clients.
+# Run from the repository root: python3 Development/bench_mjpeg_chunks.py
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.streaming_output import StreamingOutput, FRAME_TRAILER
+
+FRAME_SIZE = 4 * 1024 * 1024  # Full sensor resolution at q=100 is several MB
+FRAMES = 20
+CLIENTS = (1, 10, 50)
+
+
+def per_client_chunks(frame, clients):
+    """What gen_frames() used to do for every client and every frame."""
+    # Every client thread holds its chunk while it is being sent
+    in_flight = []
+    for _ in range(clients):
+        content_length = b'Content-Length: ' + str(len(frame)).encode('utf-8') + b'\r\n\r\n'
+        in_flight.append(b'--FRAME\r\n'
+                         b'Content-Type: image/jpeg\r\n'
+                         + content_length
+                         + frame + b'\r\n')
+
+
+def shared_chunks(output, frame, clients):
+    published = output.publish(frame)
+    in_flight = []
+    for _ in range(clients):
+        in_flight.append((published.header, published.data, FRAME_TRAILER))
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = time.process_time()
+    allocated = 0
+    for _ in range(FRAMES):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function(*args)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    cpu = time.process_time() - start
+    tracemalloc.stop()
+    return allocated / FRAMES, cpu / FRAMES
+
+
+def main():
+    frame = os.urandom(FRAME_SIZE)
+    output = StreamingOutput()
+    print(f"Frame size: {FRAME_SIZE / 1024 / 1024:.1f} MB, {FRAMES} frames per run")
+    print(f"{'clients':>8} {'mode':>10} {'alloc/frame':>14} {'cpu/frame':>12}")
+    for clients in CLIENTS:
+        for name, function, args in (
+                ('per-client', per_client_chunks, (frame, clients)),
+                ('shared', shared_chunks, (output, frame, clients))):
+            allocated, cpu = measure(function, *args)
+            print(f"{clients:>8} {name:>10} {allocated / 1024:>11.1f} KB {cpu * 1000:>9.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
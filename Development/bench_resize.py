@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+# Benchmark of lib/resize_service.py on a full resolution (4608x2592) JPEG: the
+# resize with a full decode (what liveResize.php does) against the draft-mode
+# decode at the usual web sizes, then a cache hit. Then checks: concurrent
+# requests for one size are resized once (coalesced), evicted sizes come back
+# from the disk spill, and a new source version is not served from the cache.
+# Run from the repository root: python3 Development/bench_resize.py [--threads 16]
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image
+
+from lib.resize_service import FileSource, ResizeCache, ResizeService, resize_jpeg
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'image_dir', 'mountain-stream-in-forest.jpg')
+CAPTURE_SIZE = (4608, 2592)
+SIZES = ((1920, 1080, 'fill'), (1200, 800, 'cover'), (800, 600, 'contain'), (400, 300, 'fill'))
+RUNS = 5
+
+
+def timed(function):
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        result = function()
+    return result, (time.perf_counter() - start) / RUNS
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    buffer = io.BytesIO()
+    Image.open(IMAGE).convert('RGB').resize(CAPTURE_SIZE).save(buffer, format='jpeg', quality=90)
+    jpeg = buffer.getvalue()
+    print(f"source {CAPTURE_SIZE[0]}x{CAPTURE_SIZE[1]}, {len(jpeg) // 1024} KB")
+    for width, height, fit in SIZES:
+        full, full_time = timed(lambda: resize_jpeg(jpeg, width, height, fit, draft=False))
+        draft, draft_time = timed(lambda: resize_jpeg(jpeg, width, height, fit))
+        assert Image.open(io.BytesIO(full)).size == Image.open(io.BytesIO(draft)).size
+        print(f"{width:5d}x{height:<5d}{fit:8s} full decode {full_time * 1000:5.0f} ms, "
+              f"draft mode {draft_time * 1000:5.0f} ms -> {Image.open(io.BytesIO(draft)).size}")
+
+    with tempfile.TemporaryDirectory() as folder:
+        live = os.path.join(folder, 'live.jpg')
+        with open(live, 'wb') as f:
+            f.write(jpeg)
+        # Room for about one resized copy in memory, the rest spills
+        cache = ResizeCache(max_bytes=300 * 1024, spill_dir=os.path.join(folder, 'cache'))
+        service = ResizeService(FileSource(live), cache)
+
+        with ThreadPoolExecutor(args.threads) as pool:
+            results = list(pool.map(lambda _: service.resize(800, 600, 'fill'), range(args.threads)))
+        assert len({data for _, data in results}) == 1
+        stats = service.stats()
+        assert stats['misses'] == 1, stats
+        print(f"{args.threads} concurrent requests: {stats['misses']} resize, {stats['coalesced']} coalesced, "
+              f"{stats['hits']} cache hits")
+
+        _, hit_time = timed(lambda: service.resize(800, 600, 'fill'))
+        print(f"cache hit {hit_time * 1e6:.0f} us")
+
+        for width, height, fit in SIZES:
+            service.resize(width, height, fit)
+        start = time.perf_counter()
+        service.resize(*SIZES[0])
+        stats = service.stats()
+        assert stats['disk_hits'] == 1, stats
+        print(f"evicted size from the disk spill in {(time.perf_counter() - start) * 1000:.1f} ms, "
+              f"{stats['spilled']} spilled entries")
+
+        os.utime(live, ns=(time.time_ns() + 10 ** 9,) * 2)
+        misses = stats['misses']
+        service.resize(*SIZES[0])
+        assert service.stats()['misses'] == misses + 1, "stale copy served after the source changed"
+    print("OK: coalesced, spilled and invalidated")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+# Benchmark of lib/scheduler.py. First a simulated day (fake clocks) of 30
+# second captures that take 2-8 s, with an occasional 70 s upload stall: the old
+# background_capture_task loop (sleep, then capture) against CaptureScheduler.
+# Reports the captures per day, how many are off the :00/:30 grid, the overruns
+# and the skipped instants. Then the scheduler on the real clocks, every second
+# for a few seconds: lateness and jitter.
+# Run from the repository root: python3 Development/bench_scheduler.py [--seconds 6]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.scheduler import CaptureScheduler, parse_schedule
+
+PERIOD = 30
+DAY = 24 * 3600
+
+
+class FakeClock:
+    """Wall and monotonic clock in one, wait() advances time."""
+    def __init__(self, start):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def wait(self, seconds):
+        self.now += seconds
+        return False
+
+
+def capture_time(rng):
+    return 70.0 if rng.random() < 0.002 else rng.uniform(2, 8)
+
+
+def old_loop(start, rng):
+    """background_capture_task(PERIOD): sleep the delay, then capture."""
+    now = start
+    captures = []
+    while now < start + DAY:
+        now += PERIOD
+        captures.append(now)
+        now += capture_time(rng)
+    return captures
+
+
+def scheduled(start, rng):
+    clock = FakeClock(start)
+    captures = []
+
+    def job(rule):
+        captures.append(clock.now)
+        clock.now += capture_time(rng)
+
+    scheduler = CaptureScheduler(parse_schedule('', PERIOD), job, wall=clock, monotonic=clock, wait=clock.wait)
+    while clock.now < start + DAY:
+        scheduler.run_once()
+    return captures, scheduler
+
+
+def off_grid(instant):
+    offset = instant % PERIOD
+    return min(offset, PERIOD - offset)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=int, default=6)
+    args = parser.parse_args()
+
+    # Midnight in UTC, whole minutes either way
+    start = time.time() // DAY * DAY
+    old = old_loop(start, random.Random(1))
+    new, scheduler = scheduled(start, random.Random(1))
+    stats = scheduler.stats()
+    print(f"simulated day, {PERIOD} s period, 2-8 s captures:")
+    print(f"  sleep loop: {len(old)} captures, {sum(off_grid(at) > 0.5 for at in old)} more than 0.5 s off the "
+          f":00/:30 grid, period grows to {(old[-1] - old[0]) / (len(old) - 1):.1f} s")
+    print(f"  scheduler:  {len(new)} captures, at most {max(off_grid(at) for at in new):.3f} s off the grid, "
+          f"{stats['overruns']} overruns, {stats['missed']} instants skipped")
+    assert max(off_grid(at) for at in new) < 1e-6 and stats['missed'] >= stats['overruns'] > 0
+
+    # Real clocks, every second, the job takes 0.2 s
+    scheduler = CaptureScheduler(parse_schedule('*/1 * * * * *'), lambda rule: time.sleep(0.2)).start()
+    time.sleep(args.seconds)
+    scheduler.stop()
+    stats = scheduler.stats()
+    print(f"real clock, every second for {args.seconds} s: {stats['fired']} captures, lateness mean "
+          f"{stats['lateness_ms']['mean']} ms max {stats['lateness_ms']['max']} ms, jitter {stats['jitter_ms']} ms")
+    assert stats['fired'] >= args.seconds - 1 and stats['overruns'] == 0
+    print("OK: aligned to the grid, overruns skipped instead of piling up")
+
+
+if __name__ == '__main__':
+    main()
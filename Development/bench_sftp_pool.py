@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+
+# Benchmark of lib/sftp_pool.py against a local paramiko SFTP server (password
+# login, files written to a temporary folder). Uploads --uploads stills of
+# --size-kb through FileTransfer: a new connection per upload (as before)
+# against a pooled connection, reported as uploads per second. Then the server
+# drops every connection, the next upload reconnects; and an idle connection is
+# closed after idle_timeout.
+# Run from the repository root: python3 Development/bench_sftp_pool.py [--uploads 30 --size-kb 500]
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+from threading import Thread
+
+import paramiko
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.file_transfer import FileTransfer
+from lib.sftp_pool import SftpPool
+
+USERNAME = 'camera'
+PASSWORD = 'secret'
+
+
+class StubServer(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        if (username, password) == (USERNAME, PASSWORD):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class StubHandle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.writefile.fileno()))
+
+
+class StubSFTPServer(paramiko.SFTPServerInterface):
+    """The login directory and / are root, enough for FileTransfer.sftp_put()."""
+    root = None
+
+    def local(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip('/'))
+
+    def canonicalize(self, path):
+        return os.path.normpath('/' + path).replace('//', '/')
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.local(path)))
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+
+    lstat = stat
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self.local(path))
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+        return paramiko.SFTP_OK
+
+    def open(self, path, flags, attr):
+        try:
+            handle = StubHandle(flags)
+            handle.writefile = handle.readfile = open(self.local(path), 'w+b')
+        except OSError as ex:
+            return paramiko.SFTPServer.convert_errno(ex.errno)
+        return handle
+
+
+class LocalServer:
+    def __init__(self, root):
+        StubSFTPServer.root = root
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        self.transports = []
+        Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            connection, _ = self.listener.accept()
+            transport = paramiko.Transport(connection)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, StubSFTPServer)
+            transport.start_server(server=StubServer())
+            self.transports.append(transport)
+
+    def drop_connections(self):
+        for transport in self.transports:
+            transport.close()
+        self.transports.clear()
+
+
+def upload(port, name, data, pool=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return FileTransfer('127.0.0.1', USERNAME, PASSWORD, 'SFTP', name, f'www/archive/{name}', port,
+                            data=data, pool=pool).success
+
+
+def run(port, count, data, pool=None):
+    """:return uploads per second"""
+    start = time.perf_counter()
+    for index in range(count):
+        assert upload(port, f'capture_{index:03d}.jpg', data, pool), "upload failed"
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uploads', type=int, default=30)
+    parser.add_argument('--size-kb', type=int, default=500)
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+    data = os.urandom(args.size_kb * 1024)
+
+    with tempfile.TemporaryDirectory() as folder:
+        server = LocalServer(folder)
+        single = run(server.port, args.uploads, data)
+        pool = SftpPool(keepalive=30, idle_timeout=300)
+        pooled = run(server.port, args.uploads, data, pool)
+        stats = pool.stats()
+        with open(os.path.join(folder, 'www', 'archive', f'capture_{args.uploads - 1:03d}.jpg'), 'rb') as file:
+            assert file.read() == data
+        print(f"{args.uploads} uploads of {args.size_kb} KB to 127.0.0.1: new connection {single:.1f} uploads/s, "
+              f"pooled {pooled:.1f} uploads/s ({pooled / single:.1f}x)")
+        print(f"  pool: {stats['connects']} connect, {stats['reuses']} reuses, "
+              f"{(1 / single - 1 / pooled) * 1000:.0f} ms saved per upload")
+        assert stats['connects'] == 1 and pooled > single
+
+        # Noticed while idle (failed check), then dropped right before the next upload (reconnect during use)
+        for wait in (0.2, 0):
+            server.drop_connections()
+            time.sleep(wait)
+            assert upload(server.port, 'after_drop.jpg', data, pool), "no reconnect after the server dropped the connection"
+        stats = pool.stats()
+        print(f"  server dropped the connection twice: both uploads succeeded, {stats['connects']} connects, "
+              f"{stats['failed_checks']} failed checks, {stats['reconnects']} reconnects during use")
+        assert stats['connects'] == 3 and stats['failed_checks'] + stats['reconnects'] == 2
+        pool.close()
+
+        pool = SftpPool(keepalive=1, idle_timeout=0.5)
+        assert upload(server.port, 'idle.jpg', data, pool)
+        time.sleep(1.5)
+        stats = pool.stats()
+        print(f"  idle_timeout 0.5 s: {stats['idle_closed']} closed, {stats['open']} open after 1.5 s")
+        assert stats['idle_closed'] == 1 and stats['open'] == 0
+        pool.close()
+    print("OK: one handshake for all uploads, reconnected after a drop, idle connection closed")
+
+
+if __name__ == '__main__':
+    main()
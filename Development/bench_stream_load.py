@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+
+# Load test for /stream.mjpg: opens many concurrent viewers and reports the frame
+# rate each of them receives. Point it at a running flaskServer.py (either
+# server_mode) with --url, or use --synthetic to start a local server fed by a
+# synthetic frame source:
+#   python3 Development/bench_stream_load.py --synthetic asyncio --clients 200
+#   python3 Development/bench_stream_load.py --synthetic threaded --clients 200
+#   python3 Development/bench_stream_load.py --url http://camera:8000/stream.mjpg --clients 50
+#   python3 Development/bench_stream_load.py --synthetic asyncio --query fps=2 --clients 200
+
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.streaming_output import StreamingOutput, StreamClient, BOUNDARY, FRAME_TRAILER, parse_rate_args
+from lib.async_server import AsyncStreamServer
+from synthetic_source import SyntheticFrameSource
+
+MARKER = f'--{BOUNDARY}\r\n'.encode('ascii')
+
+
+async def viewer(host, port, path, seconds, results):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('ascii'))
+    await writer.drain()
+    frames = 0
+    received = 0
+    tail = b''
+    deadline = time.monotonic() + seconds
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                data = await asyncio.wait_for(reader.read(256 * 1024), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                break
+            received += len(data)
+            frames += (tail + data).count(MARKER)
+            tail = data[-(len(MARKER) - 1):]
+    finally:
+        writer.close()
+    results.append((frames / seconds, received / seconds))
+
+
+async def run_viewers(url, clients, seconds):
+    parts = urlsplit(url)
+    results = []
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    await asyncio.gather(*(viewer(parts.hostname, parts.port or 80, path, seconds, results)
+                           for _ in range(clients)))
+    return results
+
+
+def threaded_server(output):
+    """Thread per viewer, the same way gen_frames() runs on Flask's threaded server."""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+            self.end_headers()
+            query = {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+            client = output.register(StreamClient(output, parse_rate_args(query)))
+            try:
+                while True:
+                    frame = client.next_frame()
+                    self.wfile.write(frame.header)
+                    self.wfile.write(frame.data)
+                    self.wfile.write(FRAME_TRAILER)
+            except (ConnectionError, ValueError):
+                pass
+            finally:
+                client.close()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+def asyncio_server(output):
+    started = threading.Event()
+    server = AsyncStreamServer(output, host='127.0.0.1', port=0)
+
+    async def serve():
+        await server.start()
+        started.set()
+        await server.server.serve_forever()
+
+    threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+    started.wait()
+    return server.port
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url')
+    parser.add_argument('--synthetic', choices=('asyncio', 'threaded'))
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--frame-kb', type=int, default=200)
+    parser.add_argument('--query', default='', help="query string for the viewers, e.g. fps=2&max_kbps=500")
+    args = parser.parse_args()
+
+    source = None
+    url = args.url
+    if args.synthetic:
+        output = StreamingOutput()
+        port = asyncio_server(output) if args.synthetic == 'asyncio' else threaded_server(output)
+        url = f'http://127.0.0.1:{port}/stream.mjpg'
+        source = SyntheticFrameSource(output, fps=args.fps, frame_size=args.frame_kb * 1024).start()
+    elif not url:
+        parser.error("--url or --synthetic is required")
+
+    if args.query:
+        url = f"{url}{'&' if '?' in url else '?'}{args.query}"
+
+    cpu_start = time.process_time()
+    results = asyncio.run(run_viewers(url, args.clients, args.seconds))
+    cpu = time.process_time() - cpu_start
+    if source is not None:
+        source.stop()
+
+    rates = sorted(fps for fps, _ in results)
+    print(f"{url} with {args.clients} viewers for {args.seconds:.0f} s")
+    print(f"fps per viewer: min {rates[0]:.1f} median {statistics.median(rates):.1f} max {rates[-1]:.1f}")
+    print(f"total egress: {sum(rate for _, rate in results) * 8 / 1e6:.1f} Mbit/s")
+    if source is not None:
+        # Server and viewers share this process when --synthetic is used
+        print(f"process cpu: {cpu / args.seconds * 100:.0f}%, "
+              f"threads: {threading.active_count()}, "
+              f"max rss: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
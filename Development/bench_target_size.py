@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+# Benchmark: meeting a JPEG file size budget. The old webcam.image_file_size()
+# stepped the quality down from 100 one encode at a time (here in memory, the
+# old code also wrote every attempt to disk); lib.target_size.TargetSizeEncoder
+# bisects the quality and seeds the search with the qualities of recent frames.
+# Every sample image is encoded as a steady sequence of SEQUENCE frames with a
+# little sensor noise, per target size the encode count and wall time per frame
+# are reported, and the scale when the image had to be downscaled to fit.
+# Run from the repository root: python3 Development/bench_target_size.py
+
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image
+
+from lib.target_size import TargetSizeEncoder, encode_jpeg
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'image_dir', 'mountain-stream-in-forest.jpg')
+TARGETS_KB = (100, 250, 500, 1000)
+SEQUENCE = 10
+
+
+def sample_images():
+    """The sample photo at two sizes, a detailed crop and a flat gradient, as RGB arrays."""
+    photo = Image.open(IMAGE).convert('RGB')
+    gradient = np.zeros((1280, 1920, 3), dtype=np.uint8)
+    gradient[:, :, 0] = np.linspace(0, 255, 1920, dtype=np.uint8)
+    gradient[:, :, 1] = np.linspace(0, 255, 1280, dtype=np.uint8)[:, None]
+    return {
+        'photo 1920x1280': np.asarray(photo),
+        'photo 960x640': np.asarray(photo.resize((960, 640))),
+        'detail 1280x853': np.asarray(photo.crop((0, 0, 640, 427)).resize((1280, 853))),
+        'gradient 1920x1280': gradient,
+    }
+
+
+def noisy_frames(image, count, rng):
+    """A steady scene: the same image with a little noise per frame."""
+    for _ in range(count):
+        noise = rng.integers(-2, 3, size=image.shape, dtype=np.int16)
+        yield np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def linear_search(image, max_bytes):
+    """What image_file_size() did: quality 100, 99, 98... until it fits."""
+    encodes = 0
+    for quality in range(100, 0, -1):
+        data = encode_jpeg(image, quality)
+        encodes += 1
+        if len(data) <= max_bytes:
+            return quality, encodes
+    return None, encodes
+
+
+def main():
+    logging.getLogger().setLevel(logging.ERROR)
+    rng = np.random.default_rng(1)
+    print(f"{'image':20s} {'target':>7s} {'linear':>17s} {'bisection, cold':>20s} {'seeded (steady)':>20s}")
+    for name, image in sample_images().items():
+        for target_kb in TARGETS_KB:
+            max_bytes = target_kb * 1024
+            frames = list(noisy_frames(image, SEQUENCE, rng))
+
+            start = time.perf_counter()
+            quality, linear_encodes = linear_search(frames[0], max_bytes)
+            linear_time = time.perf_counter() - start
+
+            encoder = TargetSizeEncoder()
+            start = time.perf_counter()
+            cold = encoder.encode(frames[0], max_bytes)
+            cold_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            seeded = [encoder.encode(frame, max_bytes) for frame in frames[1:]]
+            seeded_time = (time.perf_counter() - start) / len(seeded)
+            seeded_encodes = sum(result.encodes for result in seeded) / len(seeded)
+
+            print(f"{name:20s} {target_kb:5d}KB "
+                  f"{linear_encodes:4d} x {linear_time * 1000:7.0f} ms "
+                  f"{cold.encodes:4d} x {cold_time * 1000:7.0f} ms q{cold.quality:<3d} "
+                  f"{seeded_encodes:4.1f} x {seeded_time * 1000:7.0f} ms q{seeded[-1].quality:<3d}"
+                  f"{'' if seeded[-1].scale == 1.0 else f'  scale {seeded[-1].scale:.2f}'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+# Benchmark of lib.timelapse.DailyTimelapse on a CPU-only machine: frames per
+# second appended from full resolution (4608x2592) captures, and the decode time
+# with and without JPEG draft mode. Then a resume check: a child process appends
+# part of the captures and is killed in the middle of a segment, a new timelapse
+# cuts the file back to the last committed segment, catches up from the capture
+# files and the committed bytes must be unchanged and no frame missing.
+# Run from the repository root: python3 Development/bench_timelapse.py [--captures 60 --width 1280]
+
+import argparse
+import hashlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import av
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image
+
+from lib.timelapse import DailyTimelapse, decode_scaled, timelapse_size
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'image_dir', 'mountain-stream-in-forest.jpg')
+CAPTURE_SIZE = (4608, 2592)
+VARIANTS = 6
+SEGMENT_FRAMES = 30
+
+
+def write_captures(folder, count, interval=10):
+    """count full resolution captures, modification times interval seconds apart ending now."""
+    photo = Image.open(IMAGE).convert('RGB').resize(CAPTURE_SIZE)
+    variants = []
+    for index in range(VARIANTS):
+        # Slightly brighter every capture, like the morning
+        buffer = io.BytesIO()
+        Image.fromarray(np.clip(np.asarray(photo) * (0.7 + 0.1 * index), 0, 255).astype(np.uint8)).save(
+            buffer, format='jpeg', quality=90)
+        variants.append(buffer.getvalue())
+    now = time.time()
+    paths = []
+    for index in range(count):
+        path = os.path.join(folder, f'capture_{index:05d}.jpg')
+        with open(path, 'wb') as f:
+            f.write(variants[index % VARIANTS])
+        mtime = now - (count - index) * interval
+        os.utime(path, (mtime, mtime))
+        paths.append(path)
+    return paths
+
+
+def frame_count(video):
+    with av.open(video) as container:
+        return sum(1 for _ in container.decode(video=0))
+
+
+def digest(path, length):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read(length)).hexdigest()
+
+
+def crash_child(folder, count, width):
+    """Child process: append the first count captures of the parent folder, then die without committing."""
+    source = os.path.dirname(folder)
+    captures = sorted(os.path.join(source, name) for name in os.listdir(source) if name.endswith('.jpg'))
+    timelapse = DailyTimelapse(folder, 'bench', width=width, segment_frames=SEGMENT_FRAMES)
+    for path in captures[:count]:
+        timelapse.append(path, os.path.getmtime(path))
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--captures', type=int, default=60)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--crash-child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.crash_child:
+        crash_child(args.crash_child[0], int(args.crash_child[1]), args.width)
+
+    with tempfile.TemporaryDirectory() as folder:
+        captures = write_captures(folder, args.captures)
+        size = timelapse_size(CAPTURE_SIZE, args.width)
+        jpeg = open(captures[0], 'rb').read()
+
+        start = time.perf_counter()
+        for _ in range(5):
+            Image.open(io.BytesIO(jpeg)).convert('RGB').resize(size, Image.BILINEAR)
+        full = (time.perf_counter() - start) / 5
+        start = time.perf_counter()
+        for _ in range(5):
+            decode_scaled(jpeg, size)
+        draft = (time.perf_counter() - start) / 5
+        print(f"decode {CAPTURE_SIZE[0]}x{CAPTURE_SIZE[1]} -> {size[0]}x{size[1]}: full {full * 1000:.0f} ms, "
+              f"draft mode {draft * 1000:.0f} ms")
+
+        videos = os.path.join(folder, 'video')
+        timelapse = DailyTimelapse(videos, 'bench', width=args.width, segment_frames=SEGMENT_FRAMES)
+        start = time.perf_counter()
+        for path in captures:
+            timelapse.append(path, os.path.getmtime(path))
+        timelapse.close()
+        elapsed = time.perf_counter() - start
+        video, _ = timelapse.paths(timelapse.day)
+        print(f"appended {args.captures} captures: {args.captures / elapsed:.1f} fps, "
+              f"{os.path.getsize(video) / 1024:.0f} KB video, {frame_count(video)} frames decoded")
+
+        # Resume after a crash in the middle of the second segment
+        resumed = os.path.join(folder, 'resumed')
+        crashed_after = min(SEGMENT_FRAMES + SEGMENT_FRAMES // 2, args.captures - 1)
+        subprocess.run([sys.executable, __file__, '--width', str(args.width),
+                        '--crash-child', resumed, str(crashed_after)], check=True)
+        timelapse = DailyTimelapse(resumed, 'bench', width=args.width, segment_frames=SEGMENT_FRAMES)
+        video, _ = timelapse.paths(time.strftime('%Y%m%d'))
+        crashed_size = os.path.getsize(video)
+        timelapse._open_day(time.strftime('%Y%m%d'))
+        committed = timelapse.state['bytes']
+        committed_digest = digest(video, committed)
+        start = time.perf_counter()
+        caught_up = timelapse.catch_up(captures)
+        timelapse.close()
+        assert digest(video, committed) == committed_digest, "committed segments were rewritten"
+        assert frame_count(video) == args.captures, f"{frame_count(video)} frames instead of {args.captures}"
+        print(f"OK: resumed after a crash at frame {crashed_after} ({crashed_size - committed} uncommitted bytes "
+              f"dropped), {caught_up} captures caught up in {time.perf_counter() - start:.1f} s, "
+              f"committed {committed} bytes unchanged, {args.captures} frames in the video")
+
+
+if __name__ == '__main__':
+    main()
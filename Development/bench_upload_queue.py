@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+# Benchmark of lib/upload_queue.py against a simulated SFTP server (each upload
+# sleeps --upload-ms). Captures every --interval-ms to two destinations, a fixed
+# live.jpg and an archive folder: the time a capture spends uploading inline (as
+# capture_embedded_jpeg did) against handing the bytes to the queue. Then the
+# server goes down for a while: with drop_oldest the oldest uploads are dropped,
+# with newest_per_destination the waiting live.jpg upload is replaced by the
+# newest one, and after the outage the newest captures arrive.
+# Run from the repository root: python3 Development/bench_upload_queue.py [--upload-ms 300]
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.upload_queue import UploadJob, UploadQueue
+
+DESTINATIONS = ('www/live.jpg', 'www/archive/')
+CAPTURES = 20
+JPEG = b'\xff\xd8' + bytes(300 * 1024) + b'\xff\xd9'
+
+
+class FakeServer:
+    def __init__(self, delay):
+        self.delay = delay
+        self.down = False
+        self.received = []
+
+    def upload(self, job):
+        time.sleep(self.delay)
+        if self.down:
+            return False
+        self.received.append(job.destination)
+        return True
+
+
+def destination(dest, index):
+    return f'{dest}capture_{index:03d}.jpg' if dest.endswith('/') else dest
+
+
+def run(server, interval, policy=None):
+    """:return (seconds per capture spent on the uploads, the UploadQueue or None when inline)"""
+    queue = None if policy is None else UploadQueue(server.upload, workers=2, max_jobs=8, policy=policy,
+                                                    attempts=2, retry_delay=0.05)
+    spent = 0.0
+    for index in range(CAPTURES):
+        start = time.perf_counter()
+        for dest in DESTINATIONS:
+            if queue is None:
+                server.upload(UploadJob(destination(dest, index), destination(dest, index),
+                                        f'capture_{index:03d}.jpg', JPEG, start))
+            else:
+                queue.submit(destination(dest, index), destination(dest, index), f'capture_{index:03d}.jpg', JPEG)
+        spent += time.perf_counter() - start
+        time.sleep(max(interval - (time.perf_counter() - start), 0))
+    if queue is not None:
+        queue.join()
+        queue.close()
+    return spent / CAPTURES, queue
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--upload-ms', type=int, default=300)
+    parser.add_argument('--interval-ms', type=int, default=400)
+    args = parser.parse_args()
+    interval = args.interval_ms / 1000
+    # The drops are counted in the stats
+    logging.disable(logging.WARNING)
+
+    inline, _ = run(FakeServer(args.upload_ms / 1000), interval)
+    queued, queue = run(FakeServer(args.upload_ms / 1000), interval, 'drop_oldest')
+    print(f"{len(DESTINATIONS)} uploads of {args.upload_ms} ms per capture: inline {inline * 1000:.0f} ms per "
+          f"capture, queued {queued * 1000:.2f} ms per capture")
+    print(f"  drop_oldest keeping up: {queue.stats()}")
+
+    for policy in ('drop_oldest', 'newest_per_destination'):
+        server = FakeServer(args.upload_ms / 1000)
+        server.down = True
+        queue = UploadQueue(server.upload, workers=2, max_jobs=8, policy=policy, attempts=2, retry_delay=0.05)
+        for index in range(CAPTURES):
+            if index == CAPTURES - 4:
+                server.down = False
+            for dest in DESTINATIONS:
+                queue.submit(destination(dest, index), destination(dest, index), f'capture_{index:03d}.jpg', JPEG)
+            time.sleep(interval)
+        queue.join()
+        queue.close()
+        stats = queue.stats()
+        print(f"  {policy} through an outage: uploaded {stats['uploaded']}, failed {stats['failed']}, "
+              f"dropped {stats['dropped']}, replaced {stats['replaced']}")
+        assert destination(DESTINATIONS[1], CAPTURES - 1) in server.received, "newest capture not uploaded"
+        assert 'www/live.jpg' in server.received
+        if policy == 'newest_per_destination':
+            # Only the fixed live.jpg, the archive files have their own names
+            assert 0 < stats['replaced'] < CAPTURES
+    assert queued < inline / 10
+    print("OK: captures don't wait for uploads, the newest captures arrive after an outage")
+
+
+if __name__ == '__main__':
+    main()
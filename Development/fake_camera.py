@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+
+# Fake Picamera2 backend for lib.camera_session.CameraSession. After start() the
+# fake's exposure and colour gains approach their targets over converge_after
+# seconds, like AE/AWB after sensor start-up, and AeLocked/AwbLocked are only
+# reported when report_locks is set.
+# Running it checks that the session waits for convergence once, serves later
+# captures immediately and releases the camera on close:
+# Run from the repository root: python3 Development/fake_camera.py
+
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image
+
+from lib.camera_session import CameraSession
+
+
+class FakeCamera:
+    """
+    The part of the Picamera2 API used by CameraSession.
+
+    :param size - main stream size
+    :param fps - frame rate, capture_metadata() returns once per frame
+    :param converge_after - seconds until AE/AWB settle
+    :param report_locks - report AeLocked/AwbLocked in the metadata
+    """
+    def __init__(self, size=(640, 480), fps=30, converge_after=1.0, report_locks=False):
+        self.size = size
+        self.fps = fps
+        self.converge_after = converge_after
+        self.report_locks = report_locks
+        self.started_at = None
+        self.starts = 0
+        self.closed = False
+        self.configured = None
+        # Manual controls take effect two frames after set_controls(), like a real pipeline
+        self.frame = 0
+        self.controls = {}
+        self.controls_frame = 0
+
+    def create_still_configuration(self, main=None):
+        return {'main': dict(main or {'size': self.size})}
+
+    def configure(self, config):
+        self.configured = config
+        self.size = tuple(config['main']['size'])
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.starts += 1
+
+    def stop(self):
+        self.started_at = None
+
+    def close(self):
+        self.closed = True
+
+    def _progress(self):
+        return min((time.monotonic() - self.started_at) / self.converge_after, 1.0)
+
+    def set_controls(self, controls):
+        self.controls = dict(controls)
+        self.controls_frame = self.frame
+
+    def _auto_exposure(self):
+        return int(33000 * (0.2 + 0.8 * self._progress()))
+
+    def capture_metadata(self):
+        if self.started_at is None:
+            raise RuntimeError("Camera not started")
+        time.sleep(1 / self.fps)
+        self.frame += 1
+        progress = self._progress()
+        metadata = {
+            'ExposureTime': self._auto_exposure(),
+            'AnalogueGain': 1.0 + 3.0 * progress,
+            'ColourGains': (1.0 + 1.2 * progress, 1.0 + 0.8 * progress),
+        }
+        if self.controls.get('ExposureTime') and self.frame - self.controls_frame >= 2:
+            # The sensor can't expose longer than a frame
+            metadata['ExposureTime'] = min(self.controls['ExposureTime'], int(1e6 / self.fps))
+        if self.report_locks:
+            metadata['AeLocked'] = metadata['AwbLocked'] = progress >= 1.0
+        return metadata
+
+    def capture_array(self, name='main', exposure=None):
+        width, height = self.size
+        array = np.zeros((height, width, 4), dtype=np.uint8)
+        array[:, :, 0] = np.linspace(0, 255, width, dtype=np.uint8)
+        array[:, :, 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+        array[:, :, 2] = int(255 * self._progress())
+        if exposure is not None:
+            # Brightness follows the exposure relative to the auto exposure
+            array[:, :, :3] = np.clip(array[:, :, :3] * (exposure / self._auto_exposure()), 0, 255)
+        array[:, :, 3] = 255
+        return array
+
+    def capture_arrays(self, names):
+        metadata = self.capture_metadata()
+        return [self.capture_array(name, metadata['ExposureTime']) for name in names], metadata
+
+    def capture_image(self, name='main'):
+        return Image.fromarray(self.capture_array(name)[:, :, :3])
+
+    def capture_file(self, target, name='main', format=None):
+        self.capture_image(name).save(target, format=format or 'jpeg')
+
+
+def check(report_locks):
+    camera = FakeCamera(converge_after=1.0, report_locks=report_locks)
+    session = CameraSession(camera, config=lambda cam: cam.create_still_configuration(main={'size': (320, 240)}))
+
+    start = time.monotonic()
+    first = io.BytesIO()
+    session.capture_file(first, format='jpeg')
+    first_latency = time.monotonic() - start
+    assert camera._progress() >= 1.0, "captured before AE/AWB converged"
+
+    start = time.monotonic()
+    for _ in range(5):
+        session.capture_array()
+    warm_latency = (time.monotonic() - start) / 5
+
+    session.close()
+    session.close()
+    assert camera.closed and camera.starts == 1, "camera wasn't started once and released"
+    assert camera.size == (320, 240)
+    print(f"OK ({'AeLocked/AwbLocked' if report_locks else 'metadata stability'}): first capture "
+          f"{first_latency:.2f} s (converged in {session.converge_time:.2f} s), "
+          f"warm capture {warm_latency * 1000:.1f} ms, camera released")
+
+
+def main():
+    check(report_locks=True)
+    check(report_locks=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+
+# Loopback test of the relay mode on one machine: a synthetic camera publishes
+# frames with lib.relay.RelayPublisher to a relay (RelayIngest + AsyncStreamServer
+# as in relayServer.py) and viewers read /latest.jpg and /stream.mjpg from the
+# relay. Exits non-zero if the relay doesn't serve the camera's frames.
+# Run from the repository root: python3 Development/relay_loopback.py
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib.async_server import AsyncStreamServer
+from lib.relay import RelayIngest, RelayPublisher
+from lib.streaming_output import StreamingOutput, BOUNDARY
+from synthetic_source import SyntheticFrameSource
+
+TOKEN = 'loopback'
+VIEWERS = 20
+
+
+def start_relay():
+    """Relay side, the same wiring as relayServer.py on ephemeral ports."""
+    output = StreamingOutput()
+    ingest = RelayIngest(output, host='127.0.0.1', port=0, token=TOKEN)
+    server = AsyncStreamServer(output, host='127.0.0.1', port=0)
+    started = threading.Event()
+
+    async def serve():
+        await ingest.start()
+        await server.start()
+        started.set()
+        await asyncio.gather(ingest.server.serve_forever(), server.server.serve_forever())
+
+    threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+    started.wait()
+    return ingest, server
+
+
+def read_stream_frames(url, count):
+    marker = f'--{BOUNDARY}\r\n'.encode('ascii')
+    with urllib.request.urlopen(url, timeout=10) as response:
+        data = b''
+        while data.count(marker) < count + 1:
+            chunk = response.read1(64 * 1024)
+            if not chunk:
+                break
+            data += chunk
+    return data.count(marker)
+
+
+def main():
+    ingest, server = start_relay()
+
+    # Camera side
+    camera_output = StreamingOutput()
+    source = SyntheticFrameSource(camera_output, fps=30, frame_size=100 * 1024).start()
+    publisher = RelayPublisher(camera_output, '127.0.0.1', ingest.port, token=TOKEN).start()
+
+    base = f'http://127.0.0.1:{server.port}'
+    deadline = time.monotonic() + 10
+    while ingest.received == 0 and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert ingest.received > 0, "relay received no frames"
+
+    latest = urllib.request.urlopen(f'{base}/latest.jpg', timeout=10).read()
+    assert latest in source.frames, "/latest.jpg isn't a frame published by the camera"
+
+    results = []
+    start = time.monotonic()
+    threads = [threading.Thread(target=lambda: results.append(read_stream_frames(f'{base}/stream.mjpg', 30)))
+               for _ in range(VIEWERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    source.stop()
+    publisher.stop()
+    assert len(results) == VIEWERS and min(results) >= 30, f"viewers received {results}"
+    print(f"OK: camera sent {publisher.sent} frames over one connection, relay received {ingest.received}, "
+          f"{VIEWERS} viewers received {sum(results)} frames in {elapsed:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+
+# Synthetic frame source for running the streaming code without a camera.
+# Publishes fake JPEG frames (SOI marker + random payload + EOI marker) to a
+# lib.streaming_output.StreamingOutput at a fixed frame rate.
+
+import os
+import time
+from threading import Thread, Event
+
+
+def fake_jpeg(size):
+    return b'\xff\xd8' + os.urandom(max(size - 4, 0)) + b'\xff\xd9'
+
+
+class SyntheticFrameSource:
+    """
+    :param output - StreamingOutput the frames are written to
+    :param fps - frames per second
+    :param frame_size - bytes per frame
+    :param variants - number of distinct frames that are cycled through
+    """
+    def __init__(self, output, fps=30, frame_size=200 * 1024, variants=8):
+        self.output = output
+        self.fps = fps
+        self.frames = [fake_jpeg(frame_size) for _ in range(variants)]
+        self.published = 0
+        self.stopped = Event()
+        self.thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        interval = 1.0 / self.fps
+        deadline = time.monotonic()
+        while not self.stopped.is_set():
+            self.output.write(self.frames[self.published % len(self.frames)])
+            self.published += 1
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self.stopped.wait(delay)
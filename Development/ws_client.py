@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+# WebSocket client for /ws/stream. Prints the sequence number, latency and size of
+# the frames it receives and how many frames the server skipped in between.
+#   python3 Development/ws_client.py --url ws://camera:8000/ws/stream
+#   python3 Development/ws_client.py --synthetic --read-delay 0.2
+# With --synthetic a local asyncio server fed by a synthetic 30 fps frame source
+# is started, --read-delay simulates a slow client so that the backpressure
+# (dropped intermediate frames) can be seen.
+
+import argparse
+import asyncio
+import base64
+import os
+import socket
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lib import websocket
+from lib.async_server import AsyncStreamServer
+from lib.streaming_output import StreamingOutput
+from synthetic_source import SyntheticFrameSource
+
+
+async def receive(url, frames, read_delay):
+    parts = urlsplit(url)
+    if read_delay:
+        # A small receive window so the slow reader pushes back on the server
+        # instead of buffering megabytes in the kernel
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 32 * 1024)
+        sock.connect((parts.hostname, parts.port or 80))
+        reader, writer = await asyncio.open_connection(sock=sock, limit=32 * 1024)
+    else:
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    writer.write((f'GET {path} HTTP/1.1\r\n'
+                  f'Host: {parts.netloc}\r\n'
+                  'Upgrade: websocket\r\n'
+                  'Connection: Upgrade\r\n'
+                  f'Sec-WebSocket-Key: {key}\r\n'
+                  'Sec-WebSocket-Version: 13\r\n\r\n').encode('ascii'))
+    response = await reader.readuntil(b'\r\n\r\n')
+    if not response.startswith(b'HTTP/1.1 101') or websocket.accept_key(key).encode('ascii') not in response:
+        raise RuntimeError(f"Handshake failed: {response.decode('latin-1')}")
+
+    previous = None
+    skipped = 0
+    for _ in range(frames):
+        opcode, payload = await websocket.read_frame(reader, max_payload=64 * 1024 * 1024)
+        if opcode != websocket.OP_BINARY:
+            continue
+        sequence, timestamp = websocket.STREAM_HEADER.unpack_from(payload)
+        jpeg = payload[websocket.STREAM_HEADER.size:]
+        if previous is not None:
+            skipped += sequence - previous - 1
+        previous = sequence
+        print(f"seq {sequence:6d}  latency {(time.time() - timestamp) * 1000:7.1f} ms  "
+              f"{len(jpeg) / 1024:8.1f} KB  skipped so far {skipped}")
+        if read_delay:
+            await asyncio.sleep(read_delay)
+    writer.write(websocket.client_frame(websocket.close_payload(), websocket.OP_CLOSE))
+    await writer.drain()
+    writer.close()
+
+
+def synthetic_server():
+    output = StreamingOutput()
+    server = AsyncStreamServer(output, host='127.0.0.1', port=0)
+    started = threading.Event()
+
+    async def serve():
+        await server.start()
+        started.set()
+        await server.server.serve_forever()
+
+    threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+    started.wait()
+    SyntheticFrameSource(output, fps=30, frame_size=300 * 1024).start()
+    return f'ws://127.0.0.1:{server.port}/ws/stream'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url')
+    parser.add_argument('--synthetic', action='store_true')
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--read-delay', type=float, default=0.0, help="seconds to sleep after every frame")
+    args = parser.parse_args()
+    url = synthetic_server() if args.synthetic else args.url
+    if not url:
+        parser.error("--url or --synthetic is required")
+    asyncio.run(receive(url, args.frames, args.read_delay))
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,12 @@
 
     <!-- As background image in CSS -->
     <div style="background-image: url('liveResize.php?width=1920&height=1080');"></div>
+
+    With derivative_widths set on the camera (e.g. 1920,1200,800,400) the
+    resized copies are uploaded next to live.jpg as live_<width>.jpg, link to
+    those directly, e.g.:
+    <img src="live_400.jpg" srcset="live_800.jpg 2x" alt="Live Image">
+    This script serves them when the requested size matches one.
 */
 // Check if parameters are provided via URL
 if (
@@ -46,6 +52,19 @@ if (
         die('Input file does not exist.');
     }
 
+    // Precomputed derivative of the requested size, uploaded by the camera
+    $derivativeFile = "./live_" . $targetWidth . ".jpg";
+    if (file_exists($derivativeFile) && filemtime($derivativeFile) >= filemtime($inputFile)) {
+        $derivativeInfo = getimagesize($derivativeFile);
+        if ($derivativeInfo !== false && $derivativeInfo[1] == $targetHeight) {
+            header('Content-Type: image/jpeg');
+            header('Cache-Control: public, max-age=86400');
+            header('Last-Modified: ' . gmdate('D, d M Y H:i:s', filemtime($derivativeFile)) . ' GMT');
+            readfile($derivativeFile);
+            exit;
+        }
+    }
+
     // Cache configuration
     $cacheDir = __DIR__ . '/cache/';
     if (!is_dir($cacheDir)) {
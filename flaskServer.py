@@ -7,21 +7,62 @@
 # Capture photo button on index page; fetches /capture.jpg and displays below stream.
 # Routes: / (redirect to /index.html), /index.html (HTML page with capture button), /full.html (fullscreen stream page), /stream.mjpg (multipart stream), /capture.jpg (single JPEG capture), /config.html (config form), /save_config (POST to save rotation).
 # Supports rotation via libcamera Transform.
+# Added: server_mode config option, 'asyncio' serves the same routes from lib/async_server.py on one event loop instead of one thread per viewer.
+# Added: stream_profiles config option, extra reduced resolution streams selectable with /stream.mjpg?profile=<name> (lib/stream_profiles.py).
+# Added: /stream.mjpg?fps=<n>&max_kbps=<n> limits the frame rate of a single viewer without changing the camera frame rate.
+# Added: /latest.jpg returns the newest stream frame with an ETag (304 on If-None-Match), ?after=<seq> waits for a newer frame.
+# Added: /ws/stream pushes every frame as a binary WebSocket message (server_mode = asyncio only), selectable on the index page.
+# Added: relay_url config option, the stream is pushed over one connection to relayServer.py which serves the viewers.
+# Added: adaptive_qualities config option, /stream.mjpg?profile=<name>&adaptive=1 moves a slow viewer down a ladder of lower JPEG qualities and back up (lib/quality_ladder.py); /stream_stats.json reports rung occupancy.
+# Overlay: the camera name/timestamp text is rendered by a cached lib/overlay.py OverlayRenderer, only changed timestamp characters are redrawn per capture.
+# Added: stream_overlay config option, the camera name/timestamp is drawn into the raw frames before the stream encoder (Picamera2 pre_callback).
+# Captures: stills come from a lib/camera_session.py CameraSession on the running camera, ready once AE/AWB converged instead of a fixed sleep.
+# Added: output_max_filesize_kb, embedded captures are encoded at the highest quality (bisection, lib/target_size.py) that fits the budget.
+# Added: /capture_burst.jpg?frames=<n>&mode=mean|median|fusion merges a burst into one low noise still (lib/burst.py), fusion brackets the exposure with ?ev=-2,0,2.
+# Added: timelapse config option, every embedded capture is appended to a daily MPEG-TS video in output_folder/timelapse (lib/timelapse.py), resumed after a restart.
+# Added: /resize.jpg?width=&height=&fit=fill|contain|cover resizes the latest embedded capture (draft-mode decode, LRU cache, lib/resize_service.py), the Python alternative of liveResize.php; resizeServer.py serves it standalone.
+# Added: motion config option, captures are triggered by frame differencing on a 320 pixel wide luma copy of the stream (lib/motion.py), motion_min_interval apart and at least every time_before_image seconds.
+# Added: dedup config option, a capture whose dHash is within dedup_distance bits of a recent one is neither encoded nor uploaded (lib/dedup.py), output_folder/last_unchanged.txt records when.
+# Added: capture_schedule config option, background captures fire at wall-clock aligned instants (every time_before_image seconds from midnight, or cron rules) from lib/scheduler.py, one at a time; /stream_stats.json reports their lateness and overruns.
+# Added: uploads run on upload_workers threads from a bounded queue (lib/upload_queue.py, upload_queue_size, upload_policy), a capture returns once it's encoded and saved.
+# Added: uploads reuse open SFTP connections per server/port/user (lib/sftp_pool.py) with keepalives, closed after sftp_idle_timeout seconds unused.
+# Added: derivative_widths config option, downscaled copies of every embedded capture are built from the raw frame (lib/derivatives.py) and uploaded next to it as <name>_<width>.jpg.
+# Embedded capture: the overlay is drawn on the raw capture_array() frame and encoded once (lib/overlay.py encode_with_overlay), the same bytes are returned, saved and uploaded.
+# Streaming: frames are kept in a sequence-numbered ring (lib/streaming_output.py); a viewer that falls behind skips to the newest frame and its dropped frames are counted.
 # Fix: Simplified get_max_video_size() to handle SensorMode dict structure; removed format description access to avoid AttributeError (format is str, not dict with 'description').
 
-import io
+import json
 import logging
 import configparser
+import glob
 import os
 import time
-from threading import Condition, Thread
+from threading import RLock
 from flask import Flask, Response, redirect, request, render_template_string
 from io import BytesIO
 import netifaces as ni
 import lib.file_transfer as ft
-
-from PIL import Image, ImageDraw, ImageFont
-from picamera2 import Picamera2
+from lib.streaming_output import StreamClient, BOUNDARY, FRAME_TRAILER, parse_rate_args
+from lib.streaming_output import etag_matches, parse_after, snapshot_headers
+from lib.stream_profiles import Simulcast, parse_stream_profiles
+from lib.quality_ladder import parse_qualities
+from lib.async_server import AsyncStreamServer, Reply
+from lib.relay import RelayPublisher, parse_relay_url
+from lib.overlay import encode_with_overlay, get_renderer, load_font, StreamOverlay
+from lib.camera_session import CameraSession
+from lib.target_size import TargetSizeEncoder
+from lib.burst import BurstCapture, parse_burst_args
+from lib.timelapse import DailyTimelapse
+from lib.derivatives import DerivativeEncoder, derivative_name, parse_widths
+from lib.resize_service import LatestJpeg, ResizeService, parse_resize_args
+from lib.motion import MotionDetector, MotionTrigger, decimate_luma, parse_zones
+from lib.dedup import CaptureDeduplicator
+from lib.scheduler import CaptureScheduler, parse_schedule
+from lib.sftp_pool import SftpPool
+from lib.upload_queue import POLICIES as UPLOAD_POLICIES, UploadQueue
+from lib.async_server import redirect as async_redirect
+
+from picamera2 import Picamera2, MappedArray
 from picamera2.encoders import JpegEncoder
 from picamera2.outputs import FileOutput
 from libcamera import Transform  # Requires python3-libcamera; install if missing
@@ -54,7 +95,29 @@ default_config = {
     'camera_timezone': 'camera_timezone',
     'camera_daylight_savings': 'camera_daylight_savings',
     'camera_port': '8000',
-    'camera_url': 'camera_urls'
+    'camera_url': 'camera_urls',
+    'server_mode': 'flask',
+    'stream_profiles': 'full:full:100',
+    'adaptive_qualities': '',
+    'stream_overlay': 'false',
+    'timelapse': 'false',
+    'timelapse_width': '1280',
+    'derivative_widths': '',
+    'motion': 'false',
+    'motion_threshold': '25',
+    'motion_area': '1.0',
+    'motion_min_interval': '5',
+    'motion_mask': '',
+    'dedup': 'false',
+    'dedup_distance': '4',
+    'capture_schedule': '',
+    'upload_workers': '2',
+    'upload_queue_size': '32',
+    'upload_policy': 'drop_oldest',
+    'sftp_keepalive': '30',
+    'sftp_idle_timeout': '300',
+    'relay_url': '',
+    'relay_token': ''
 }
 
 def load_config():
@@ -188,8 +251,9 @@ PAGE = f"""\
 </head>
 <body>
 <h1>Picamera2 MJPEG Streaming Demo (Rotated {ROTATION}°)</h1>
-<img src="/stream.mjpg" width="{WIDTH/8}" height="{HEIGHT/8}" />
+<img id="stream" src="/stream.mjpg" width="{WIDTH/8}" height="{HEIGHT/8}" />
 <p><a href="/full.html">Go to Fullscreen View</a> | <a href="/config.html">Configure Settings</a></p>
+<label><input type="checkbox" id="useWebSocket" /> Use WebSocket stream (server_mode = asyncio)</label>
 <button id="captureBtn">Capture Photo</button>
 <button id="captureEmbeddedBtn">Capture Photo with Embedded Text</button>
 
@@ -207,6 +271,35 @@ document.getElementById('captureEmbeddedBtn').onclick = function() {{
     photoImg.style.display = 'block';
 }};
 
+// WebSocket stream: every message is a 16 byte header (sequence, capture time)
+// followed by the JPEG. Each frame gets its own object URL which is revoked as
+// soon as the image switches to the next one so long running kiosks don't leak.
+let socket = null;
+let currentUrl = null;
+document.getElementById('useWebSocket').onchange = function() {{
+    const streamImg = document.getElementById('stream');
+    if (this.checked) {{
+        const scheme = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+        socket = new WebSocket(scheme + window.location.host + '/ws/stream');
+        socket.binaryType = 'arraybuffer';
+        streamImg.src = '';
+        socket.onmessage = function(event) {{
+            const previousUrl = currentUrl;
+            currentUrl = URL.createObjectURL(new Blob([event.data.slice(16)], {{type: 'image/jpeg'}}));
+            streamImg.src = currentUrl;
+            if (previousUrl) {{
+                URL.revokeObjectURL(previousUrl);
+            }}
+        }};
+    }} else {{
+        if (socket) {{
+            socket.close();
+            socket = null;
+        }}
+        streamImg.src = '/stream.mjpg';
+    }}
+}};
+
 if (window.location.search.includes('saved=1')) {{
     alert('Configuration saved!');
 }}
@@ -303,6 +396,10 @@ def generate_config_page():
             <td>time_before_image (seconds):</td>
             <td><input type="text" name="time_before_image" value="{globals()['time_before_image']}"></td>
         </tr>
+        <tr>
+            <td>capture_schedule (cron rules, e.g. day=*/30 * 6-20 * * *; night=0 */10 21-23,0-5 * * *, empty for every time_before_image seconds):</td>
+            <td><input type="text" name="capture_schedule" value="{globals()['capture_schedule']}"></td>
+        </tr>
         <tr>
             <td>output_width:</td>
             <td><input type="text" name="output_width" value="{globals()['output_width']}"></td>
@@ -315,6 +412,14 @@ def generate_config_page():
             <td>output_extension:</td>
             <td><input type="text" name="output_extension" value="{globals()['output_extension']}"></td>
         </tr>
+        <tr>
+            <td>output_quality (1-100):</td>
+            <td><input type="text" name="output_quality" value="{globals()['output_quality']}"></td>
+        </tr>
+        <tr>
+            <td>output_max_filesize_kb (0 for no limit):</td>
+            <td><input type="text" name="output_max_filesize_kb" value="{globals()['output_max_filesize_kb']}"></td>
+        </tr>
         <tr>
             <td>embed_timestamp:</td>
             <td><input type="text" name="embed_timestamp" value="{globals()['embed_timestamp']}"></td>
@@ -351,6 +456,90 @@ def generate_config_page():
             <td>camera_url:</td>
             <td><input type="text" name="camera_url" value="{globals()['camera_url']}"></td>       
         </tr>
+        <tr>
+            <td>server_mode (flask/asyncio):</td>
+            <td><input type="text" name="server_mode" value="{globals()['server_mode']}"></td>
+        </tr>
+        <tr>
+            <td>stream_profiles (name:WIDTHxHEIGHT:quality,...):</td>
+            <td><input type="text" name="stream_profiles" value="{globals()['stream_profiles']}"></td>
+        </tr>
+        <tr>
+            <td>stream_overlay (true/false):</td>
+            <td><input type="text" name="stream_overlay" value="{globals()['stream_overlay']}"></td>
+        </tr>
+        <tr>
+            <td>timelapse (true/false):</td>
+            <td><input type="text" name="timelapse" value="{globals()['timelapse']}"></td>
+        </tr>
+        <tr>
+            <td>timelapse_width:</td>
+            <td><input type="text" name="timelapse_width" value="{globals()['timelapse_width']}"></td>
+        </tr>
+        <tr>
+            <td>derivative_widths (e.g. 1920,1200,800,400, empty to disable):</td>
+            <td><input type="text" name="derivative_widths" value="{globals()['derivative_widths']}"></td>
+        </tr>
+        <tr>
+            <td>motion (true/false, captures on motion instead of every time_before_image seconds):</td>
+            <td><input type="text" name="motion" value="{globals()['motion']}"></td>
+        </tr>
+        <tr>
+            <td>motion_threshold (luma difference, 1-255):</td>
+            <td><input type="text" name="motion_threshold" value="{globals()['motion_threshold']}"></td>
+        </tr>
+        <tr>
+            <td>motion_area (% of the frame):</td>
+            <td><input type="text" name="motion_area" value="{globals()['motion_area']}"></td>
+        </tr>
+        <tr>
+            <td>motion_min_interval (seconds):</td>
+            <td><input type="text" name="motion_min_interval" value="{globals()['motion_min_interval']}"></td>
+        </tr>
+        <tr>
+            <td>motion_mask (ignored zones left,top,right,bottom as fractions, ; separated):</td>
+            <td><input type="text" name="motion_mask" value="{globals()['motion_mask']}"></td>
+        </tr>
+        <tr>
+            <td>dedup (true/false, skip captures that look like a recent one):</td>
+            <td><input type="text" name="dedup" value="{globals()['dedup']}"></td>
+        </tr>
+        <tr>
+            <td>dedup_distance (differing hash bits of 64):</td>
+            <td><input type="text" name="dedup_distance" value="{globals()['dedup_distance']}"></td>
+        </tr>
+        <tr>
+            <td>upload_workers:</td>
+            <td><input type="text" name="upload_workers" value="{globals()['upload_workers']}"></td>
+        </tr>
+        <tr>
+            <td>upload_queue_size:</td>
+            <td><input type="text" name="upload_queue_size" value="{globals()['upload_queue_size']}"></td>
+        </tr>
+        <tr>
+            <td>upload_policy (drop_oldest/newest_per_destination, when the queue is full):</td>
+            <td><input type="text" name="upload_policy" value="{globals()['upload_policy']}"></td>
+        </tr>
+        <tr>
+            <td>sftp_keepalive (seconds, 0 to disable):</td>
+            <td><input type="text" name="sftp_keepalive" value="{globals()['sftp_keepalive']}"></td>
+        </tr>
+        <tr>
+            <td>sftp_idle_timeout (seconds an unused connection stays open, 0 for a new one per upload):</td>
+            <td><input type="text" name="sftp_idle_timeout" value="{globals()['sftp_idle_timeout']}"></td>
+        </tr>
+        <tr>
+            <td>adaptive_qualities (e.g. 60,40,25, empty to disable):</td>
+            <td><input type="text" name="adaptive_qualities" value="{globals()['adaptive_qualities']}"></td>
+        </tr>
+        <tr>
+            <td>relay_url (host:port, empty to disable):</td>
+            <td><input type="text" name="relay_url" value="{globals()['relay_url']}"></td>
+        </tr>
+        <tr>
+            <td>relay_token:</td>
+            <td><input type="password" name="relay_token" value="{globals()['relay_token']}"></td>
+        </tr>
         <tr>
             <td colspan=2><input type="submit" value="Save Configuration"></td>       
         </tr>
@@ -393,17 +582,6 @@ def connection_check(interface):
         # to the next adapter.
     return False
 
-class StreamingOutput(io.BufferedIOBase):
-    def __init__(self):
-        self.frame = None
-        self.condition = Condition()
-
-    def write(self, buf):
-        with self.condition:
-            self.frame = buf
-            logging.debug(f"New frame written: {len(buf)} bytes")
-            self.condition.notify_all()
-
 def update_rtc_time():
     """
     Update the time from the internet and then set the hardware
@@ -456,8 +634,72 @@ def update_rtc_time():
 # Flask app setup
 app = Flask(__name__)
 
-# Global output instance
-output = StreamingOutput()
+# Stream profiles, sizes follow the output dimensions (swapped for 90/270)
+STREAM_PROFILES = parse_stream_profiles(globals()['stream_profiles'])
+if ROTATION in (90, 270):
+    STREAM_PROFILES = [profile._replace(size=profile.size[::-1]) if profile.size else profile
+                       for profile in STREAM_PROFILES]
+simulcast = Simulcast(STREAM_PROFILES, parse_qualities(globals()['adaptive_qualities']))
+
+# Daily timelapse the embedded captures are appended to, None if timelapse is off
+timelapse = None
+
+# Stills are encoded to output_max_filesize_kb, the quality of recent captures seeds the search
+target_encoder = TargetSizeEncoder()
+
+# Latest embedded capture, resized on request by /resize.jpg
+resize_source = LatestJpeg()
+resize_service = ResizeService(resize_source)
+
+# Captures that look like a recent one are skipped, None if dedup is off
+deduplicator = None
+if globals()['dedup'] == 'true':
+    deduplicator = CaptureDeduplicator(int(globals()['dedup_distance']),
+                                       path=os.path.join(globals()['output_folder'], 'dedup.json'))
+
+# Scheduled background captures, None until started (not with motion)
+scheduler = None
+
+# Captures run one at a time, they share the camera, the encoders and the uploads;
+# reentrant so a burst holds it from its first frame to the stored capture
+capture_lock = RLock()
+
+# Open SFTP connections shared by the upload workers, None opens a new one per upload
+sftp_pool = None
+if int(globals()['sftp_idle_timeout']) > 0:
+    sftp_pool = SftpPool(keepalive=int(globals()['sftp_keepalive']), idle_timeout=int(globals()['sftp_idle_timeout']),
+                         max_idle=int(globals()['upload_workers']))
+
+# Finished images waiting for upload, the capture doesn't wait for the server
+upload_queue = UploadQueue(lambda job: transfer_file(job), workers=int(globals()['upload_workers']),
+                           max_jobs=int(globals()['upload_queue_size']), policy=globals()['upload_policy'])
+
+# Added: downscaled copies of every embedded capture, written and uploaded next to it
+# as <name>_<width>.jpg so the web pages can serve them without resizing
+derivative_encoder = None
+if globals()['derivative_widths'] != '':
+    derivative_encoder = DerivativeEncoder(parse_widths(globals()['derivative_widths']),
+                                           quality=int(globals()['output_quality']))
+
+# Global output instance, the full resolution stream
+output = simulcast.full_output
+
+# Overlay drawn on the full resolution stream, None if stream_overlay is off
+live_overlay = None
+if globals()['stream_overlay'] == 'true':
+    live_overlay = StreamOverlay(lambda: overlay_renderer(), lambda: cam_time() if overlay_timestamp() else '')
+
+# Motion triggered captures, replaces the background capture thread, None if motion is off
+motion_trigger = None
+if globals()['motion'] == 'true':
+    motion_trigger = MotionTrigger(
+        MotionDetector(int(globals()['motion_threshold']), float(globals()['motion_area']) / 100,
+                       parse_zones(globals()['motion_mask'])),
+        # A motion capture is kept even if it hashes like the last one, a small change can be the point
+        lambda reason: capture_embedded_jpeg(dedup=reason == 'interval'),
+        min_interval=int(globals()['motion_min_interval']),
+        max_interval=int(globals()['time_before_image']),
+    )
 
 
 @app.route('/')
@@ -493,6 +735,32 @@ def save_config_route():
     #     print(e)
     #     return "Invalid rotation", 400
 
+    error_text = validate_config(config_key_value)
+
+    if len(error_text) > 0:
+        return error_text, 400
+    else:
+        save_config(config_key_value)
+        return redirect('/config.html?saved=1')
+
+    # print(config_key_value)
+    # for key, value in config_key_value.items():
+    #     print(key, value)
+    # exit(0)
+    # if rotation in (0, 90, 180, 270):
+    #     save_config(rotation)
+    #     return redirect('/config.html?saved=1')
+    # else:
+    #     return "Invalid rotation", 400
+    return config_key_value
+
+
+def validate_config(config_key_value):
+    """
+    Check the values posted from the configuration page.
+
+    :return str - one line per invalid value, empty if everything is valid
+    """
     error_text = """"""
     for key, value in config_key_value.items():
         if key == "rotation":
@@ -509,60 +777,241 @@ def save_config_route():
         elif key == "output_height":
             if not value.isnumeric():
                 error_text += f"Invalid output_height: {value}\n"
+        elif key == "output_quality":
+            if not value.isnumeric() or not 1 <= int(value) <= 100:
+                error_text += f"Invalid output_quality: {value}\n"
+        elif key == "output_max_filesize_kb":
+            if not value.isnumeric():
+                error_text += f"Invalid output_max_filesize_kb: {value}\n"
         elif key == "output_extension":
             if not value in ("jpg", "jpeg", "png"):
                 error_text += f"Invalid output_extension: {value}\n"
         elif key == "camera_name":
             if ' ' in value:
                 error_text += f"Invalid camera_name please use '_' (underscore) instead of spaces.\n"
+        elif key == "stream_profiles":
+            try:
+                parse_stream_profiles(value)
+            except Exception:
+                error_text += f"Invalid stream_profiles: {value}\n"
+        elif key == "adaptive_qualities":
+            try:
+                parse_qualities(value)
+            except ValueError:
+                error_text += f"Invalid adaptive_qualities: {value}\n"
+        elif key == "relay_url":
+            if value != "":
+                try:
+                    parse_relay_url(value)
+                except ValueError as ex:
+                    error_text += f"{ex}\n"
+        elif key == "stream_overlay":
+            if not value in ("true", "false"):
+                error_text += f"Invalid stream_overlay: {value}\n"
+        elif key == "timelapse":
+            if not value in ("true", "false"):
+                error_text += f"Invalid timelapse: {value}\n"
+        elif key == "timelapse_width":
+            if not value.isnumeric() or int(value) < 2:
+                error_text += f"Invalid timelapse_width: {value}\n"
+        elif key == "derivative_widths":
+            try:
+                parse_widths(value)
+            except ValueError:
+                error_text += f"Invalid derivative_widths: {value}\n"
+        elif key == "motion":
+            if not value in ("true", "false"):
+                error_text += f"Invalid motion: {value}\n"
+        elif key == "motion_threshold":
+            if not value.isnumeric() or not 1 <= int(value) <= 255:
+                error_text += f"Invalid motion_threshold: {value}\n"
+        elif key == "motion_area":
+            try:
+                if not 0 < float(value) <= 100:
+                    error_text += f"Invalid motion_area: {value}\n"
+            except ValueError:
+                error_text += f"Invalid motion_area: {value}\n"
+        elif key == "motion_min_interval":
+            if not value.isnumeric():
+                error_text += f"Invalid motion_min_interval: {value}\n"
+        elif key == "motion_mask":
+            try:
+                parse_zones(value)
+            except ValueError as ex:
+                error_text += f"{ex}\n"
+        elif key == "capture_schedule":
+            try:
+                for rule in parse_schedule(value):
+                    rule.next_after(time.time())
+            except ValueError as ex:
+                error_text += f"Invalid capture_schedule: {ex}\n"
+        elif key == "upload_workers":
+            if not value.isnumeric() or not 1 <= int(value) <= 16:
+                error_text += f"Invalid upload_workers: {value}\n"
+        elif key == "upload_queue_size":
+            if not value.isnumeric() or int(value) < 1:
+                error_text += f"Invalid upload_queue_size: {value}\n"
+        elif key == "upload_policy":
+            if not value in UPLOAD_POLICIES:
+                error_text += f"Invalid upload_policy: {value}\n"
+        elif key == "sftp_keepalive":
+            if not value.isnumeric():
+                error_text += f"Invalid sftp_keepalive: {value}\n"
+        elif key == "sftp_idle_timeout":
+            if not value.isnumeric():
+                error_text += f"Invalid sftp_idle_timeout: {value}\n"
+        elif key == "dedup":
+            if not value in ("true", "false"):
+                error_text += f"Invalid dedup: {value}\n"
+        elif key == "dedup_distance":
+            if not value.isnumeric() or int(value) > 64:
+                error_text += f"Invalid dedup_distance: {value}\n"
+        elif key == "server_mode":
+            if not value in ("flask", "asyncio"):
+                error_text += f"Invalid server_mode: {value}\n"
+    return error_text
+
+
+def gen_frames(output, pacer=None, controller=None):
+    """
+    Generator for streaming frames as multipart/x-mixed-replace.
 
-    if len(error_text) > 0:
-        return error_text, 400
-    else:
-        save_config(config_key_value)
-        return redirect('/config.html?saved=1')
-
-    # print(config_key_value)
-    # for key, value in config_key_value.items():
-    #     print(key, value)
-    # exit(0)
-    # if rotation in (0, 90, 180, 270):
-    #     save_config(rotation)
-    #     return redirect('/config.html?saved=1')
-    # else:
-    #     return "Invalid rotation", 400
-    return config_key_value
-
+    The part header is built once per frame by StreamingOutput, the header, the
+    frame and the trailer are yielded as they are so no per client copy of the
+    frame is made.
 
-def gen_frames():
-    """Generator for streaming frames as multipart/x-mixed-replace."""
-    while True:
-        with output.condition:
-            output.condition.wait()
-            frame = output.frame
-        content_length = b'Content-Length: ' + str(len(frame)).encode('utf-8') + b'\r\n\r\n'
-        yield (b'--FRAME\r\n'
-               b'Content-Type: image/jpeg\r\n'
-               + content_length
-               + frame + b'\r\n')
+    :param output - StreamingOutput of the requested profile
+    :param pacer - optional FramePacer for the fps and max_kbps parameters
+    :param controller - optional AdaptiveController, the time the server takes to
+                        send a frame decides the quality rung of the next one
+    """
+    client = output.register(StreamClient(output, pacer))
+    sent = dropped = decimated = 0
+    try:
+        while True:
+            frame = client.next_frame()
+            yield frame.header
+            started = time.monotonic()
+            yield frame.data
+            yield FRAME_TRAILER
+            if controller is not None:
+                rung = controller.observe_latency(time.monotonic() - started)
+                if rung is not client.output:
+                    sent, dropped, decimated = sent + client.sent, dropped + client.dropped, decimated + client.decimated
+                    client.close()
+                    client = rung.register(StreamClient(rung, client.pacer))
+    finally:
+        client.close()
+        logging.info(f"Removed streaming client: {sent + client.sent} frames sent, "
+                     f"{dropped + client.dropped} frames dropped, {decimated + client.decimated} frames decimated")
 
 
 @app.route('/stream.mjpg')
 def stream():
-    return Response(gen_frames(),
-                    mimetype='multipart/x-mixed-replace; boundary=FRAME',
+    profile = request.args.get('profile', simulcast.full.name)
+    if profile not in simulcast.outputs:
+        return f"Unknown profile: {profile}", 404
+    try:
+        pacer = parse_rate_args(request.args)
+    except ValueError as ex:
+        return str(ex), 400
+    profile_output = simulcast.outputs[profile]
+    controller = None
+    if request.args.get('adaptive') == '1' and profile in simulcast.ladders:
+        controller = simulcast.ladders[profile].controller()
+        profile_output = controller.output
+    return Response(gen_frames(profile_output, pacer, controller),
+                    mimetype=f'multipart/x-mixed-replace; boundary={BOUNDARY}',
                     headers={'Age': 0,
                              'Cache-Control': 'no-cache, private',
                              'Pragma': 'no-cache'})
 
+@app.route('/ws/stream')
+def websocket_stream():
+    """The WebSocket stream needs the asyncio server, the Flask development server can't upgrade connections."""
+    return "WebSocket streaming requires server_mode = asyncio", 400
+
+@app.route('/stream_stats.json')
+def stream_stats():
+    """Viewers per profile and quality rung, encoder counters."""
+    return Response(stream_stats_json(), mimetype='application/json')
+
+def stream_stats_json():
+    stats = simulcast.stats()
+    if live_overlay is not None:
+        stats['stream_overlay'] = live_overlay.stats()
+    stats['resize_cache'] = resize_service.stats()
+    if motion_trigger is not None:
+        stats['motion'] = motion_trigger.stats()
+    if deduplicator is not None:
+        stats['dedup'] = deduplicator.stats()
+    if scheduler is not None:
+        stats['scheduler'] = scheduler.stats()
+    stats['uploads'] = upload_queue.stats()
+    if sftp_pool is not None:
+        stats['sftp_pool'] = sftp_pool.stats()
+    return json.dumps(stats)
+
+@app.route('/latest.jpg')
+def latest_photo():
+    """
+    The newest frame of the live stream, no camera capture is made.
+
+    ETag is derived from the frame sequence number, If-None-Match returns 304.
+    With ?after=<seq> the request waits until a frame newer than seq exists.
+    """
+    profile = request.args.get('profile', simulcast.full.name)
+    if profile not in simulcast.outputs:
+        return f"Unknown profile: {profile}", 404
+    profile_output = simulcast.outputs[profile]
+    try:
+        after = parse_after(request.args)
+    except ValueError as ex:
+        return str(ex), 400
+
+    frame = None
+    if after is not None:
+        frame = profile_output.wait_for_frame(after)
+    if frame is None:
+        frame = profile_output.latest()
+    if frame is None:
+        return "No frame available yet", 503
+
+    headers = snapshot_headers(profile_output, frame)
+    if etag_matches(request.headers.get('If-None-Match'), headers['ETag']):
+        return Response(status=304, headers=headers)
+    return Response(frame.data, mimetype='image/jpeg', headers=headers)
+
+@app.route('/resize.jpg')
+def resize_photo():
+    """
+    The latest embedded capture resized, ?width=<n>&height=<n>&fit=fill|contain|cover.
+    No camera capture is made, the resized copies are cached per capture.
+    """
+    try:
+        width, height, fit = parse_resize_args(request.args)
+        etag, data = resize_service.resize(width, height, fit)
+    except ValueError as ex:
+        return str(ex), 400
+    except LookupError as ex:
+        return str(ex), 503
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=headers)
+    return Response(data, mimetype='image/jpeg', headers=headers)
+
 @app.route('/capture.jpg')
 def capture_photo():
+    """Capture a single high-quality JPEG still from the camera."""
+    return Response(capture_jpeg(), mimetype='image/jpeg')
+
+def capture_jpeg():
     """Capture a single high-quality JPEG still from the camera."""
     print("""Capture a single high-quality JPEG still from the camera.""")
     photo_buffer = BytesIO()
-    picam2.capture_file(photo_buffer, name="main", format="jpeg")
+    camera_session.capture_file(photo_buffer, name="main", format="jpeg")
     photo_buffer.seek(0)
-    return Response(photo_buffer.getvalue(), mimetype='image/jpeg')
+    return photo_buffer.getvalue()
 
 def file_date_string():
     string = time.strftime('%Y%m%d_%H%M%S', current_time())
@@ -571,133 +1020,252 @@ def file_date_string():
 @app.route('/capture_embedded.jpg')
 def capture_embedded_photo():
     """Capture a single high-quality JPEG still from the camera, with embedded text."""
-    print("""Capture a single high-quality JPEG still from the camera, with embedded text.""")
-    photo_buffer = BytesIO()
-    picam2.capture_file(photo_buffer, name="main", format="jpeg")
-    photo_buffer.seek(0)
+    return Response(capture_embedded_jpeg(), mimetype='image/jpeg')
 
-    background = Image.open(photo_buffer)
-    img_text = create_embed_text()
-    background.paste(img_text, (0, 0))
-
-    output_buffer = BytesIO()
-    background.save(output_buffer, format="jpeg", quality=100)
-    output_buffer.seek(0)
-    destination = ""
-    file_name = f"{globals()['output_folder']}/{globals()['camera_name']}_{file_date_string()}.jpg"
-    for dest in globals()['ftp-destination'].split(','):
-        if dest.endswith('/'):
-            destination = dest[:-1]
-            destination = f"{destination}/{globals()['camera_name']}_{file_date_string()}.jpg"
-        else:
-            destination = f"{dest}"
+@app.route('/capture_burst.jpg')
+def capture_burst_photo():
+    """
+    Burst capture merged into one low noise still, with embedded text.
+    ?frames=<2-16>&mode=mean|median|fusion, fusion takes ?ev=-2,0,2 and one
+    frame per offset instead of frames. median and fusion hold every frame, a
+    burst larger than lib/burst.py MAX_STACK_BYTES is rejected.
+    """
+    try:
+        frames, mode, ev = parse_burst_args(request.args, burst_frame_bytes())
+    except ValueError as ex:
+        return str(ex), 400
+    return Response(capture_burst_jpeg(frames, mode, ev), mimetype='image/jpeg')
+
+def burst_frame_bytes():
+    """Size of a main stream frame, XBGR8888 at the native size."""
+    return NATIVE_SIZE[0] * NATIVE_SIZE[1] * 4
+
+def capture_burst_jpeg(frames=8, mode='mean', ev=()):
+    """Merge a burst (lib/burst.py) and store it like capture_embedded_jpeg()."""
+    print(f"Burst capture: {frames} frames, {mode}{' ' + ','.join(map(str, ev)) if ev else ''}")
+    # The bracketed exposures and their reset mustn't interleave with a scheduled or motion capture
+    with capture_lock:
+        return capture_embedded_jpeg(BurstCapture(camera_session, "main").capture(frames, mode, ev), dedup=False)
+
+def capture_embedded_jpeg(array=None, dedup=True):
+    """
+    Capture a single high-quality JPEG still from the camera, with embedded text.
+    The image is saved to the output folder and transferred to every ftp-destination.
+
+    The overlay is drawn on the raw frame and the frame is JPEG encoded once, the
+    same bytes are returned, written to the file and queued for upload. With
+    derivative_widths the downscaled copies are made from the same frame, saved
+    in the derivatives folder and uploaded beside the capture as <name>_<width>.jpg.
+    The uploads run on the upload_queue workers, this returns before they're done.
+
+    With the dedup option a capture that looks like a recent one is skipped:
+    nothing is encoded, written or uploaded, last_unchanged.txt gets the time
+    and the previous capture is returned.
 
-        print(f"Transfering: {file_name}")
-        print(f"Destination: {destination}")
+    :param array - frame to use instead of a new capture, e.g. a merged burst
+    :param dedup - False keeps the capture even if it's a duplicate
 
-        background.save(file_name, format="jpeg")
-        if destination != "":
+    :return bytes - the JPEG
+    """
+    with capture_lock:
+        print("""Capture a single high-quality JPEG still from the camera, with embedded text.""")
+        if array is None:
+            # XBGR8888 main stream, the bytes of every pixel are R, G, B, X
+            array = camera_session.capture_array("main")
+        # Hashed before the overlay is drawn, the timestamp always differs
+        if deduplicator is not None:
             try:
-                trasfer = ft.FileTransfer(
-                    globals()['ftp-server'],
-                    globals()['ftp-username'],
-                    globals()['ftp-password'],
-                    'SFTP',
-                    file_name,
-                    # globals()['ftp-destination'],
-                    destination,
-                    globals()['ftp-port'],
-                )
-            except Exception as ex:
-                print("Couldn't transfer file to FTP server.")
-                print(ex)
-
-    return Response(output_buffer.getvalue(), mimetype='image/jpeg')
-
-def background_capture_task(delay):
-    while True:
-        try:
-            if delay > 0:
-                total_delayed = 0
-                print(f"Background thread sleeping for {delay} seconds...")
-                # Every 10 seconds in the delay we're going to print something so that
-                # we can see the logs as they're delaying
-                while total_delayed < delay:
-                    time.sleep(1)
-                    total_delayed += 1
-                    if total_delayed % 10 == 0:
-                        print(f"Background thread sleeping for {delay} seconds... {total_delayed} seconds elapsed.")
-            capture_embedded_photo()
-        except Exception as ex:
-            print("Error in background thread.")
-            print(ex)
-            time.sleep(30)
+                previous = resize_source()[1]
+            except LookupError:
+                # Hashes from dedup.json but no kept capture to return, this one is kept
+                previous = None
+            if deduplicator.check(array, skip=dedup and previous is not None):
+                print(f"Capture unchanged ({deduplicator.last_distance} bits differ), not uploaded")
+                with open(f"{globals()['output_folder']}/last_unchanged.txt", 'w') as f:
+                    f.write(file_date_string())
+                return previous
+        jpeg = embed_overlay_jpeg(array)
+
+        destination = ""
+        file_name = f"{globals()['output_folder']}/{globals()['camera_name']}_{file_date_string()}.jpg"
+        with open(file_name, 'wb') as f:
+            f.write(jpeg)
+        resize_source.publish(jpeg)
+        derivatives = {}
+        if derivative_encoder is not None:
+            # Kept out of output_folder itself, the timelapse catches up from the *.jpg there
+            os.makedirs(f"{globals()['output_folder']}/derivatives", exist_ok=True)
+            for width, data in derivative_encoder.render(array).items():
+                derivatives[width] = (derivative_name(
+                    f"{globals()['output_folder']}/derivatives/{os.path.basename(file_name)}", width), data)
+                with open(derivatives[width][0], 'wb') as f:
+                    f.write(data)
+        if timelapse is not None:
+            timelapse.submit(jpeg)
+        uploads = 0
+        uploaded_bytes = 0
+        for dest in globals()['ftp-destination'].split(','):
+            if dest.endswith('/'):
+                destination = dest[:-1]
+                destination = f"{destination}/{globals()['camera_name']}_{file_date_string()}.jpg"
+            else:
+                destination = f"{dest}"
+
+            print(f"Transfering: {file_name}")
+            print(f"Destination: {destination}")
+
+            if destination != "":
+                # Keyed by the remote file, only a fixed name like live.jpg is replaced by a newer capture
+                upload_queue.submit(destination, destination, file_name, jpeg)
+                for width, (derivative, data) in derivatives.items():
+                    upload_queue.submit(derivative_name(destination, width), derivative_name(destination, width),
+                                        derivative, data)
+                uploads += 1 + len(derivatives)
+                uploaded_bytes += len(jpeg) + sum(len(data) for _, data in derivatives.values())
+        if deduplicator is not None:
+            deduplicator.kept(uploads, uploaded_bytes)
+
+        return jpeg
+
+def transfer_file(job):
+    """Upload of an upload_queue worker, :return True if the transfer succeeded"""
+    try:
+        transfer = ft.FileTransfer(
+            globals()['ftp-server'],
+            globals()['ftp-username'],
+            globals()['ftp-password'],
+            'SFTP',
+            job.name,
+            job.destination,
+            globals()['ftp-port'],
+            data=job.data,
+            pool=sftp_pool,
+        )
+    except Exception as ex:
+        print("Couldn't transfer file to FTP server.")
+        print(ex)
+        return False
+    return transfer.success
+
+def embed_overlay_jpeg(array):
+    """
+    Draw the camera name/timestamp overlay into a raw frame and encode it at
+    output_quality, or the highest quality that fits output_max_filesize_kb.
+
+    :param array - RGBX (or RGB) frame, modified in place
+
+    :return bytes - the JPEG
+    """
+    result = encode_with_overlay(array, overlay_renderer(), cam_time() if overlay_timestamp() else '',
+                                 target_encoder, int(globals()['output_max_filesize_kb']) * 1024,
+                                 int(globals()['output_quality']))
+    if result.scale != 1.0 or result.quality != int(globals()['output_quality']):
+        print(f"Encoded at quality {result.quality}, scale {result.scale:.2f} to fit "
+              f"{globals()['output_max_filesize_kb']} KB ({result.encodes} encodes)")
+    return result.data
 
 def create_embed_text():
     """
     This method is going to create the text that is going to be put onto the
     photo ONLY. When the text is created it will then be embedded into the image.
 
-    Enhance with the path that the file should be saved to so that images aren't in the
-    root folder.
+    The renderer is cached per configuration (lib/overlay.py), only the changed
+    timestamp characters are drawn for each capture.
     """
-    camera_name = globals()['camera_name']
-    script_dir = os.path.dirname(__file__)
-    if len(globals()['embed_timestamp']) > 2:
-        camera_name = globals()['camera_name'] + ' - ' + cam_time()
+    return overlay_renderer().render(cam_time() if overlay_timestamp() else '')
 
-    # sample text and font
-    unicode_text = camera_name
-    # font_path = f'{self.script_dir}/fonts/AmazeFont.otf'
-    font_path = f'{script_dir}/fonts/AmazeFont.otf'
+def overlay_timestamp():
+    return len(globals()['embed_timestamp']) > 2
 
+def overlay_renderer():
+    """OverlayRenderer for the current camera_name, text_size and colors."""
+    font_path = f'{os.path.dirname(__file__)}/fonts/AmazeFont.otf'
     try:
-        font = ImageFont.truetype(font=font_path, size=int(globals()['text_size']))
+        size = int(globals()['text_size'])
+        load_font(font_path, size)
     except Exception as ex:
         print("Couldn't load font size: ", globals()['text_size'], " using default size: 18")
         print(ex)
-        font = ImageFont.truetype(font=font_path, size=18)
-    left, top, right, bottom = font.getbbox(text=unicode_text, mode='string')
-    text_width = right - left
-    text_height = bottom - top
-
-    # create a blank canvas with extra space between lines
-    try:
-        canvas = Image.new('RGB', (text_width + 10, text_height + 10), globals()['text_background'])
-    except Exception as ex:
-        # For if the background color isn't able to be loaded.'
-        canvas = Image.new('RGB', (text_width + 10, text_height + 10), 'black')
-
-    # draw the text onto the text canvas, and use black as the text color
-    draw = ImageDraw.Draw(canvas)
-    try:
-        draw.text((5,5), camera_name, globals()['text_color'], font)
-    except Exception as ex:
-        # For if the font color isn't able to be loaded.
-        draw.text((5,5), camera_name, 'silver', font)
-
-    # save the blank canvas to a file
-    # output_dir = f"{globals()['output_dir']}/text.{globals()['output_ext']}"
-    # try:
-    #     os.remove(output_dir)
-    # except Exception as ex:
-    #     pass
-    # canvas.save(output_dir)
-
-    return canvas
+        size = 18
+    return get_renderer(font_path, size, globals()['text_color'], globals()['text_background'],
+                        globals()['camera_name'], overlay_timestamp())
+
+def async_routes():
+    """Routes of the Flask app for server_mode = asyncio, /stream.mjpg is served by AsyncStreamServer itself."""
+    def save(request):
+        error_text = validate_config(request.form)
+        if len(error_text) > 0:
+            return Reply(400, 'text/plain', error_text)
+        save_config(request.form)
+        return async_redirect('/config.html?saved=1')
+
+    def resize(request):
+        try:
+            width, height, fit = parse_resize_args(request.query)
+            etag, data = resize_service.resize(width, height, fit)
+        except ValueError as ex:
+            return Reply(400, 'text/plain', str(ex))
+        except LookupError as ex:
+            return Reply(503, 'text/plain', str(ex))
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Reply(304, 'image/jpeg', b'', headers)
+        return Reply(200, 'image/jpeg', data, headers)
+
+    def burst(request):
+        try:
+            frames, mode, ev = parse_burst_args(request.query, burst_frame_bytes())
+        except ValueError as ex:
+            return Reply(400, 'text/plain', str(ex))
+        return Reply(200, 'image/jpeg', capture_burst_jpeg(frames, mode, ev))
+
+    return {
+        '/': (lambda request: async_redirect('/index.html', 301), False),
+        '/index.html': (lambda request: Reply(200, 'text/html', PAGE), False),
+        '/full.html': (lambda request: Reply(200, 'text/html', FULL_PAGE), False),
+        '/config.html': (lambda request: Reply(200, 'text/html', generate_config_page()), False),
+        '/save_config': (save, False),
+        '/stream_stats.json': (lambda request: Reply(200, 'application/json', stream_stats_json()), False),
+        '/capture.jpg': (lambda request: Reply(200, 'image/jpeg', capture_jpeg()), True),
+        '/capture_embedded.jpg': (lambda request: Reply(200, 'image/jpeg', capture_embedded_jpeg()), True),
+        '/capture_burst.jpg': (burst, True),
+        '/resize.jpg': (resize, True),
+    }
 
 if __name__ == '__main__':
     # Configure camera with detected max size
     picam2 = Picamera2()
-    config = picam2.create_video_configuration(
-        main={"size": (WIDTH, HEIGHT)},
-        transform=transform
-    )
+    lores_size = simulcast.lores_size()
+    if lores_size is not None:
+        # Reduced stream profiles are scaled from the lores stream
+        config = picam2.create_video_configuration(
+            main={"size": (WIDTH, HEIGHT)},
+            lores={"size": lores_size, "format": "YUV420"},
+            transform=transform
+        )
+        picam2.post_callback = simulcast.on_request
+    else:
+        config = picam2.create_video_configuration(
+            main={"size": (WIDTH, HEIGHT)},
+            transform=transform
+        )
     picam2.configure(config)
+    if live_overlay is not None or motion_trigger is not None:
+        # Runs on every main stream frame before it reaches the JpegEncoder
+        def on_main_frame(request):
+            with MappedArray(request, "main") as m:
+                # Motion is analysed before the overlay is drawn, the changing timestamp isn't motion
+                if motion_trigger is not None and motion_trigger.due():
+                    motion_trigger.submit(decimate_luma(m.array))
+                if live_overlay is not None:
+                    live_overlay.apply(m.array)
+        picam2.pre_callback = on_main_frame
 
     # Start recording to output
     # picam2.start_recording(JpegEncoder(q=85), FileOutput(output))
-    picam2.start_recording(JpegEncoder(q=100), FileOutput(output))
+    picam2.start_recording(JpegEncoder(q=simulcast.full.quality), FileOutput(output))
+    # Stills are taken from the running camera, the first one waits for AE/AWB to converge
+    camera_session = CameraSession(picam2)
 
     # logging.basicConfig(level=logging.DEBUG)
 
@@ -705,13 +1273,50 @@ if __name__ == '__main__':
     print(f"Detected max native size: {NATIVE_SIZE}")
     print(f"Server starting on http://0.0.0.0:8000 (local: http://localhost:8000)")
     print(f"Streaming rotated {ROTATION}° video at {WIDTH}x{HEIGHT}")
+    print(f"Stream profiles: {', '.join(profile.name for profile in STREAM_PROFILES)} (/stream.mjpg?profile=<name>)")
     print("New: Fullscreen view at /full.html")
     print("Capture: Button on index page saves/displays latest photo")
     print("Config: Set rotation at /config.html (restart server to apply)")
 
-    thread = Thread(target=background_capture_task, args=(int(globals()['time_before_image']),), daemon=True)
-    thread.start()
+    if globals()['relay_url'] != '':
+        relay_host, relay_port = parse_relay_url(globals()['relay_url'])
+        RelayPublisher(output, relay_host, relay_port, token=globals()['relay_token']).start()
+
+    captures = glob.glob(os.path.join(globals()['output_folder'], '*.jpg'))
+    if captures:
+        # /resize.jpg serves the newest capture of an earlier run until the next one
+        with open(max(captures, key=os.path.getmtime), 'rb') as f:
+            resize_source.publish(f.read())
+
+    if globals()['timelapse'] == 'true':
+        timelapse = DailyTimelapse(os.path.join(globals()['output_folder'], 'timelapse'), globals()['camera_name'],
+                                   width=int(globals()['timelapse_width'])).start()
+        # Captures taken since the last committed segment, e.g. before a restart
+        timelapse.submit_catch_up(glob.glob(os.path.join(globals()['output_folder'], '*.jpg')))
+
+    if motion_trigger is not None:
+        motion_trigger.start()
+    else:
+        scheduler = CaptureScheduler(parse_schedule(globals()['capture_schedule'], int(globals()['time_before_image'])),
+                                     lambda rule: capture_embedded_jpeg()).start()
+        print(f"Capture schedule: {', '.join(rule.name for rule in scheduler.rules)}")
     try:
-        app.run(host='0.0.0.0', port=8000, threaded=True, use_reloader=False)
+        if globals()['server_mode'] == 'asyncio':
+            print("Server mode: asyncio")
+            AsyncStreamServer(output, async_routes(), host='0.0.0.0', port=8000,
+                              profiles=simulcast.outputs, ladders=simulcast.ladders).serve_forever()
+        else:
+            app.run(host='0.0.0.0', port=8000, threaded=True, use_reloader=False)
     finally:
         picam2.stop_recording()
+        camera_session.close()
+        if timelapse is not None:
+            timelapse.close()
+        if derivative_encoder is not None:
+            derivative_encoder.close()
+        if scheduler is not None:
+            scheduler.stop()
+        # Whatever is still queued gets a last chance
+        upload_queue.close(timeout=30)
+        if sftp_pool is not None:
+            sftp_pool.close()
@@ -0,0 +1,442 @@
+import asyncio
+import logging
+import socket
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit, parse_qs
+
+from lib.streaming_output import BOUNDARY, FRAME_TRAILER, LONG_POLL_TIMEOUT, FramePacer, parse_rate_args
+from lib.streaming_output import etag_matches, parse_after, snapshot_headers
+from lib import websocket
+
+# Request as seen by a route handler, query and form are dicts of first values.
+Request = namedtuple('Request', ['method', 'path', 'query', 'form', 'headers'])
+# Reply returned by a route handler, body may be str or bytes.
+Reply = namedtuple('Reply', ['status', 'content_type', 'body', 'headers'], defaults=('text/html', b'', None))
+
+REASONS = {
+    200: 'OK',
+    101: 'Switching Protocols',
+    301: 'Moved Permanently',
+    302: 'Found',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+
+def redirect(location, status=302):
+    return Reply(status, 'text/html', b'', {'Location': location})
+
+
+class StreamConnection:
+    """
+    A /stream.mjpg viewer, frames are written straight to its transport by the fan-out.
+
+    :param writer - asyncio StreamWriter of the connection
+    :param pacer - optional FramePacer limiting the frame rate
+    :param controller - optional lib.quality_ladder.AdaptiveController, the
+                        viewer is moved to the fan-out of the rung it picks
+    """
+    def __init__(self, writer, pacer=None, controller=None):
+        self.writer = writer
+        self.transport = writer.transport
+        self.pacer = pacer if pacer is not None else FramePacer()
+        self.controller = controller
+        self.fan_out = None
+        self.sent = 0
+        self.dropped = 0
+        self.decimated = 0
+
+
+class WebSocketViewer:
+    """
+    A /ws/stream viewer. Every frame is pushed as one binary message, a
+    STREAM_HEADER followed by the JPEG.
+
+    The socket's write buffer limits are zero, so a frame is only written when
+    the previous one has been handed to the kernel, and TCP_NOTSENT_LOWAT keeps
+    the kernel from queueing more than one frame that hasn't been sent yet.
+    While the send queue isn't empty only the newest frame is kept as pending
+    and the frames it replaces are dropped.
+    """
+    def __init__(self, reader, writer, pacer=None, not_sent_low_water=64 * 1024):
+        self.reader = reader
+        self.writer = writer
+        self.transport = writer.transport
+        self.transport.set_write_buffer_limits(high=0)
+        sock = self.transport.get_extra_info('socket')
+        if sock is not None and hasattr(socket, 'TCP_NOTSENT_LOWAT'):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NOTSENT_LOWAT, not_sent_low_water)
+            except OSError as ex:
+                logging.debug(f"Couldn't set TCP_NOTSENT_LOWAT: {ex}")
+        self.pacer = pacer if pacer is not None else FramePacer()
+        self.pending = None
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+        self.decimated = 0
+
+    def offer(self, frame, now):
+        if not self.pacer.due(now):
+            self.decimated += 1
+            return
+        if self.transport.get_write_buffer_size() > 0 or self.pending is not None:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = frame
+            self.ready.set()
+            return
+        self._send(frame, now)
+
+    def _send(self, frame, now):
+        message_header = websocket.stream_message_header(frame)
+        self.transport.write(websocket.frame_header(len(message_header) + len(frame.data)))
+        self.transport.write(message_header)
+        self.transport.write(frame.data)
+        self.sent += 1
+        if self.pacer.limited:
+            self.pacer.sent(len(frame.data), now)
+
+    async def send_pending(self):
+        """Writes the pending frame once the send queue is empty."""
+        while not self.transport.is_closing():
+            await self.ready.wait()
+            self.ready.clear()
+            await self.writer.drain()
+            frame, self.pending = self.pending, None
+            if frame is not None and not self.transport.is_closing():
+                self._send(frame, time.monotonic())
+
+    async def receive(self):
+        """Answers pings and returns when the client closes the connection."""
+        while True:
+            opcode, payload = await websocket.read_frame(self.reader, websocket.MAX_CONTROL_PAYLOAD)
+            if opcode == websocket.OP_CLOSE:
+                if not self.transport.is_closing():
+                    self.transport.write(websocket.frame_header(len(payload), websocket.OP_CLOSE) + payload)
+                return
+            if opcode == websocket.OP_PING:
+                self.transport.write(websocket.frame_header(len(payload), websocket.OP_PONG) + payload)
+
+
+class FanOut:
+    """
+    Registered with one StreamingOutput, hands its frames to the viewers on the loop.
+
+    The encoder thread only schedules a fan-out on the loop (thread-safe) and the
+    fan-out writes the newest frame to every viewer whose socket has drained,
+    viewers that are still busy with an older frame skip the frame.
+
+    :param fan_outs - the server's fan-outs by id(output), adaptive viewers are
+                      moved between them
+    """
+    def __init__(self, output, loop, high_water, fan_outs):
+        self.output = output
+        self.loop = loop
+        self.high_water = high_water
+        self.fan_outs = fan_outs
+        self.connections = set()
+        self.websockets = set()
+        # Futures of /latest.jpg?after= requests waiting for the next frame
+        self.waiters = set()
+        self._pending = False
+
+    @property
+    def viewers(self):
+        return len(self.connections) + len(self.websockets) + len(self.waiters)
+
+    def add(self, viewer):
+        viewer.fan_out = self
+        self.connections.add(viewer)
+
+    # Called by StreamingOutput.publish() in the encoder thread
+    def notify(self, frame):
+        if self._pending or not (self.connections or self.websockets or self.waiters):
+            return
+        self._pending = True
+        try:
+            self.loop.call_soon_threadsafe(self._fan_out)
+        except RuntimeError:
+            # Loop already closed while shutting down
+            pass
+
+    def _fan_out(self):
+        self._pending = False
+        frame = self.output.latest()
+        if frame is None:
+            return
+        for waiter in tuple(self.waiters):
+            if not waiter.done():
+                waiter.set_result(frame)
+        now = time.monotonic()
+        for viewer in tuple(self.connections):
+            if viewer.transport.is_closing():
+                continue
+            if not viewer.pacer.due(now):
+                viewer.decimated += 1
+                continue
+            queued = viewer.transport.get_write_buffer_size()
+            if viewer.controller is not None:
+                rung = viewer.controller.observe_backlog(queued, self.high_water // 2)
+                if rung is not self.output:
+                    # The next frame comes from the other rung
+                    self.connections.discard(viewer)
+                    self.fan_outs[id(rung)].add(viewer)
+                    continue
+            if queued > self.high_water:
+                viewer.dropped += 1
+                continue
+            viewer.transport.write(frame.header)
+            viewer.transport.write(frame.data)
+            viewer.transport.write(FRAME_TRAILER)
+            viewer.sent += 1
+            if viewer.pacer.limited:
+                viewer.pacer.sent(len(frame.data), now)
+        for viewer in tuple(self.websockets):
+            if not viewer.transport.is_closing():
+                viewer.offer(frame, now)
+
+    async def wait_for_frame(self, after, timeout=LONG_POLL_TIMEOUT):
+        """Same as StreamingOutput.wait_for_frame() without blocking the loop."""
+        frame = self.output.latest()
+        # An after newer than our frames is from before a restart
+        if frame is not None and frame.sequence != after:
+            return frame
+        waiter = self.loop.create_future()
+        self.waiters.add(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.waiters.discard(waiter)
+
+
+class AsyncStreamServer:
+    """
+    asyncio alternative to the Flask development server.
+
+    A single event loop serves every connection, see FanOut for how frames
+    reach the viewers.
+
+    :param output - StreamingOutput that is served on /stream.mjpg
+    :param routes - dict of path -> (handler, blocking), handler(Request) returns
+                    a Reply, blocking handlers (camera captures) run in the
+                    default executor so they never stall the loop
+    :param host - address to listen on
+    :param port - port to listen on
+    :param high_water - bytes queued on a viewer's socket before frames are skipped
+    :param profiles - dict of profile name -> StreamingOutput selectable with
+                      /stream.mjpg?profile=<name>
+    :param ladders - dict of profile name -> lib.quality_ladder.QualityLadder
+                     used with /stream.mjpg?profile=<name>&adaptive=1
+    """
+    def __init__(self, output, routes=None, host='0.0.0.0', port=8000, high_water=256 * 1024, profiles=None,
+                 ladders=None):
+        self.output = output
+        self.profiles = profiles or {}
+        self.ladders = ladders or {}
+        self.routes = routes or {}
+        self.host = host
+        self.port = port
+        self.high_water = high_water
+        self.fan_outs = {}
+        self.loop = None
+        self.server = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        outputs = [self.output] + list(self.profiles.values())
+        for ladder in self.ladders.values():
+            outputs.extend(ladder.outputs)
+        for output in outputs:
+            if id(output) not in self.fan_outs:
+                fan_out = FanOut(output, self.loop, self.high_water, self.fan_outs)
+                self.fan_outs[id(output)] = fan_out
+                output.register(fan_out)
+        if self.port == 0:
+            self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    def _unregister(self):
+        for fan_out in self.fan_outs.values():
+            fan_out.output.unregister(fan_out)
+        self.fan_outs.clear()
+
+    async def stop(self):
+        connections = [c for fan_out in self.fan_outs.values() for c in fan_out.connections]
+        self._unregister()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for viewer in connections:
+            viewer.transport.close()
+
+    async def serve(self):
+        await self.start()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            self._unregister()
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    async def _read_request(self, reader):
+        head = await reader.readuntil(b'\r\n\r\n')
+        if len(head) > MAX_HEADER_BYTES:
+            raise ValueError("Request header too large")
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, _ = lines[0].split(' ', 2)
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        form = {}
+        length = int(headers.get('content-length', 0) or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        if length:
+            body = await reader.readexactly(length)
+            if headers.get('content-type', '').startswith('application/x-www-form-urlencoded'):
+                form = {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+        return Request(method.upper(), url.path, query, form, headers)
+
+    def _send_reply(self, writer, reply):
+        body = reply.body
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        head = [f"HTTP/1.1 {reply.status} {REASONS.get(reply.status, '')}",
+                f"Content-Type: {reply.content_type}",
+                f"Content-Length: {len(body)}",
+                "Connection: close"]
+        for key, value in (reply.headers or {}).items():
+            head.append(f"{key}: {value}")
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        if body:
+            writer.write(body)
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                request = await self._read_request(reader)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as ex:
+                self._send_reply(writer, Reply(400, 'text/plain', str(ex)))
+                return
+
+            if request.path in ('/stream.mjpg', '/latest.jpg', '/ws/stream'):
+                output = self.output
+                if 'profile' in request.query:
+                    output = self.profiles.get(request.query['profile'])
+                    if output is None:
+                        self._send_reply(writer, Reply(404, 'text/plain', f"Unknown profile: {request.query['profile']}"))
+                        return
+                if request.path == '/latest.jpg':
+                    self._send_reply(writer, await self._latest(request, self.fan_outs[id(output)]))
+                    await writer.drain()
+                    return
+                try:
+                    pacer = parse_rate_args(request.query)
+                except ValueError as ex:
+                    self._send_reply(writer, Reply(400, 'text/plain', str(ex)))
+                    return
+                if request.path == '/ws/stream':
+                    if not websocket.is_upgrade(request.headers):
+                        self._send_reply(writer, Reply(400, 'text/plain', 'WebSocket upgrade required'))
+                        return
+                    await self._websocket(reader, writer, request, self.fan_outs[id(output)], pacer)
+                else:
+                    controller = None
+                    ladder = self.ladders.get(request.query.get('profile'))
+                    if request.query.get('adaptive') == '1' and ladder is not None:
+                        controller = ladder.controller()
+                        output = controller.output
+                    await self._stream(reader, writer, self.fan_outs[id(output)], pacer, controller)
+                return
+
+            route = self.routes.get(request.path)
+            if route is None:
+                self._send_reply(writer, Reply(404, 'text/plain', 'Not Found'))
+            else:
+                handler, blocking = route
+                try:
+                    if blocking:
+                        reply = await self.loop.run_in_executor(None, handler, request)
+                    else:
+                        reply = handler(request)
+                except Exception as ex:
+                    print(f"Error handling {request.path}")
+                    print(ex)
+                    reply = Reply(500, 'text/plain', 'Internal Server Error')
+                self._send_reply(writer, reply)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _latest(self, request, fan_out):
+        """/latest.jpg, see flaskServer.latest_photo()"""
+        try:
+            after = parse_after(request.query)
+        except ValueError as ex:
+            return Reply(400, 'text/plain', str(ex))
+        frame = None
+        if after is not None:
+            frame = await fan_out.wait_for_frame(after)
+        if frame is None:
+            frame = fan_out.output.latest()
+        if frame is None:
+            return Reply(503, 'text/plain', 'No frame available yet')
+        headers = snapshot_headers(fan_out.output, frame)
+        if etag_matches(request.headers.get('if-none-match'), headers['ETag']):
+            return Reply(304, 'image/jpeg', b'', headers)
+        return Reply(200, 'image/jpeg', frame.data, headers)
+
+    async def _websocket(self, reader, writer, request, fan_out, pacer=None):
+        writer.write(websocket.handshake_response(request.headers['sec-websocket-key']))
+        viewer = WebSocketViewer(reader, writer, pacer)
+        fan_out.websockets.add(viewer)
+        sender = asyncio.ensure_future(viewer.send_pending())
+        try:
+            await viewer.receive()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            fan_out.websockets.discard(viewer)
+            sender.cancel()
+            logging.info(f"Removed WebSocket client: {viewer.sent} frames sent, {viewer.dropped} frames dropped, "
+                         f"{viewer.decimated} frames decimated")
+
+    async def _stream(self, reader, writer, fan_out, pacer=None, controller=None):
+        writer.write(('HTTP/1.1 200 OK\r\n'
+                      'Age: 0\r\n'
+                      'Cache-Control: no-cache, private\r\n'
+                      'Pragma: no-cache\r\n'
+                      f'Content-Type: multipart/x-mixed-replace; boundary={BOUNDARY}\r\n'
+                      'Connection: close\r\n\r\n').encode('latin-1'))
+        viewer = StreamConnection(writer, pacer, controller)
+        fan_out.add(viewer)
+        try:
+            # The viewer never sends anything else, EOF means it went away
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            viewer.fan_out.connections.discard(viewer)
+            logging.info(f"Removed streaming client: {viewer.sent} frames sent, {viewer.dropped} frames dropped, "
+                         f"{viewer.decimated} frames decimated")
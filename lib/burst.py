@@ -0,0 +1,199 @@
+import logging
+
+import numpy as np
+
+MODES = ('mean', 'median', 'fusion')
+MAX_FRAMES = 16
+# Frames median and fusion hold at once, 4 RGBX frames of 12 MP
+MAX_STACK_BYTES = 192 * 1024 * 1024
+# Rows merged at a time, the float/sort temporaries stay a few MB at 12 MP
+CHUNK_ROWS = 64
+
+
+def parse_burst_args(args, frame_bytes=0, max_stack_bytes=MAX_STACK_BYTES):
+    """
+    :param args - request arguments: frames (2-16), mode (mean, median or fusion)
+                  and for fusion ev, comma separated EV offsets, e.g. -2,0,2; the
+                  bracket sets the number of frames, frames is rejected
+    :param frame_bytes - size of one captured frame, median and fusion bursts
+                         that don't fit max_stack_bytes are rejected
+
+    :return (frames, mode, ev) - ev is a list of floats, empty unless fusion
+    """
+    mode = args.get('mode', 'mean')
+    if mode not in MODES:
+        raise ValueError(f"Invalid mode: {mode}")
+    if mode == 'fusion' and 'frames' in args:
+        raise ValueError("frames doesn't apply to fusion, the number of ev offsets is the number of frames")
+    frames = args.get('frames', '8')
+    if not frames.isnumeric() or not 2 <= int(frames) <= MAX_FRAMES:
+        raise ValueError(f"Invalid frames: {frames}")
+    frames = int(frames)
+    ev = []
+    if mode == 'fusion':
+        try:
+            ev = [float(value) for value in args.get('ev', '-2,0,2').split(',')]
+        except ValueError:
+            raise ValueError(f"Invalid ev: {args.get('ev')}")
+        if not 2 <= len(ev) <= MAX_FRAMES or any(abs(value) > 4 for value in ev):
+            raise ValueError(f"Invalid ev: {args.get('ev')}")
+        frames = len(ev)
+    if mode != 'mean' and frames * frame_bytes > max_stack_bytes:
+        raise ValueError(f"Too many frames for {mode}: at most {max(max_stack_bytes // frame_bytes, 1)} "
+                         f"frames of {frame_bytes / 1e6:.0f} MB fit in {max_stack_bytes / 1e6:.0f} MB")
+    return frames, mode, ev
+
+
+class MeanAccumulator:
+    """
+    Running sum of frames, the frames don't have to be kept for a mean merge.
+
+    :param shape - frame shape
+    """
+    def __init__(self, shape):
+        # uint16 holds the sum of up to 257 uint8 frames
+        self.sum = np.zeros(shape, dtype=np.uint16)
+        self.count = 0
+
+    def add(self, frame):
+        self.sum += frame
+        self.count += 1
+
+    def result(self, rows=CHUNK_ROWS):
+        out = np.empty(self.sum.shape, dtype=np.uint8)
+        for start in range(0, out.shape[0], rows):
+            chunk = self.sum[start:start + rows]
+            # Rounded integer division without a float copy of the chunk
+            out[start:start + rows] = (chunk + self.count // 2) // self.count
+        return out
+
+
+def merge_mean(frames, rows=CHUNK_ROWS):
+    """
+    :param frames - sequence of equally shaped uint8 frames, or an N x H x W x C stack
+
+    :return uint8 frame
+    """
+    height = frames[0].shape[0]
+    out = np.empty(frames[0].shape, dtype=np.uint8)
+    count = len(frames)
+    for start in range(0, height, rows):
+        total = np.zeros(out[start:start + rows].shape, dtype=np.uint16)
+        for frame in frames:
+            total += frame[start:start + rows]
+        out[start:start + rows] = (total + count // 2) // count
+    return out
+
+
+def merge_median(frames, rows=CHUNK_ROWS):
+    """
+    Per pixel median, removes noise spikes and anything that only shows in a
+    minority of the frames (e.g. a passing bird).
+
+    :param frames - N x H x W x C uint8 stack
+
+    :return uint8 frame
+    """
+    count = len(frames)
+    height = frames.shape[1]
+    out = np.empty(frames.shape[1:], dtype=np.uint8)
+    middle = count // 2
+    for start in range(0, height, rows):
+        chunk = frames[:, start:start + rows]
+        if count % 2:
+            out[start:start + rows] = np.partition(chunk, middle, axis=0)[middle]
+        else:
+            ordered = np.partition(chunk, (middle - 1, middle), axis=0)
+            out[start:start + rows] = (ordered[middle - 1].astype(np.uint16) + ordered[middle] + 1) // 2
+    return out
+
+
+def fuse_exposures(frames, rows=CHUNK_ROWS, sigma=0.2):
+    """
+    Exposure fusion of a bracketed stack: every pixel is the average of the
+    frames weighted by how well exposed (close to mid grey) the pixel is in each
+    frame, so shadows come from the long and highlights from the short exposures.
+    Single scale, without the Laplacian pyramid blending of Mertens et al.
+
+    :param frames - N x H x W x C uint8 stack, RGB(X)
+    :param sigma - width of the well-exposedness curve
+
+    :return uint8 frame
+    """
+    height = frames.shape[1]
+    out = np.empty(frames.shape[1:], dtype=np.uint8)
+    luma_weights = np.array([0.299, 0.587, 0.114], dtype=np.float32) / 255
+    for start in range(0, height, rows):
+        chunk = frames[:, start:start + rows].astype(np.float32)
+        luma = chunk[..., :3] @ luma_weights
+        weights = np.exp(-((luma - 0.5) ** 2) / (2 * sigma * sigma)) + 1e-6
+        weights /= weights.sum(axis=0)
+        out[start:start + rows] = np.clip((chunk * weights[..., None]).sum(axis=0) + 0.5, 0, 255)
+    return out
+
+
+class BurstCapture:
+    """
+    Captures a burst of frames from a lib.camera_session.CameraSession and merges
+    them into one low noise frame.
+
+    mean keeps a running sum, only one frame is held at a time. median and fusion
+    capture into one preallocated stack, a burst whose stack would exceed
+    max_stack_bytes raises ValueError after the first frame. For fusion every
+    frame is taken at the session's current exposure shifted by an EV offset,
+    AE is handed back to the camera afterwards.
+
+    :param session - CameraSession
+    :param name - stream to capture
+    :param max_stack_bytes - largest stack median and fusion allocate
+    """
+    def __init__(self, session, name='main', max_stack_bytes=MAX_STACK_BYTES):
+        self.session = session
+        self.name = name
+        self.max_stack_bytes = max_stack_bytes
+
+    def capture(self, frames=8, mode='mean', ev=()):
+        """
+        :param frames - ignored for fusion, one frame per ev offset
+
+        :return uint8 frame, the shape of the camera's arrays
+        """
+        if mode == 'mean':
+            accumulator = None
+            for _ in range(frames):
+                frame = self.session.capture_array(self.name)
+                if accumulator is None:
+                    accumulator = MeanAccumulator(frame.shape)
+                accumulator.add(frame)
+            return accumulator.result()
+        if mode == 'median':
+            return merge_median(self._stack([self.session.capture_array] * frames))
+        if mode == 'fusion':
+            return fuse_exposures(self._bracket(ev))
+        raise ValueError(f"Invalid mode: {mode}")
+
+    def _stack(self, captures):
+        stack = None
+        for index, capture in enumerate(captures):
+            frame = capture(self.name)
+            if stack is None:
+                if len(captures) * frame.nbytes > self.max_stack_bytes:
+                    raise ValueError(f"{len(captures)} frames of {frame.nbytes / 1e6:.0f} MB exceed "
+                                     f"{self.max_stack_bytes / 1e6:.0f} MB")
+                stack = np.empty((len(captures),) + frame.shape, dtype=np.uint8)
+            stack[index] = frame
+        return stack
+
+    def _bracket(self, ev):
+        metadata = self.session.capture_metadata()
+        exposure = metadata.get('ExposureTime', 10000)
+        gain = metadata.get('AnalogueGain', 1.0)
+        captures = []
+        for offset in ev:
+            controls = {'ExposureTime': max(int(exposure * 2 ** offset), 1), 'AnalogueGain': gain}
+            captures.append(lambda name, controls=controls: self.session.capture_array_with_controls(controls, name))
+        try:
+            return self._stack(captures)
+        finally:
+            logging.info("Bracket done, returning exposure control to AE")
+            self.session.restore_auto_exposure()
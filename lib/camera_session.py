@@ -0,0 +1,186 @@
+import logging
+import time
+from threading import Lock
+
+
+def relative_change(previous, current):
+    if previous is None or current is None:
+        return None
+    if isinstance(current, (tuple, list)):
+        return max(relative_change(p, c) for p, c in zip(previous, current))
+    return abs(current - previous) / max(abs(previous), 1e-6)
+
+
+class CameraSession:
+    """
+    A camera that is kept open, configured and converged between captures.
+
+    The camera is started once. Before the first capture the session waits until
+    auto exposure and auto white balance have converged, going by the frame
+    metadata instead of a fixed sleep: AeLocked/AwbLocked when the pipeline
+    reports them, otherwise exposure x gain and the colour gains staying within
+    tolerance for stable_frames frames in a row.
+
+    :param camera - Picamera2 (or compatible) object, a new Picamera2 if None
+    :param config - callable(camera) returning the configuration to apply on
+                    start(), None if the camera is already configured and started
+    :param converge_timeout - seconds to wait for convergence before capturing anyway
+    :param stable_frames - consecutive converged frames required
+    :param tolerance - relative change between frames that still counts as converged
+    """
+    def __init__(self, camera=None, config=None, converge_timeout=5.0, stable_frames=3, tolerance=0.02):
+        self.camera = camera
+        self.config = config
+        self.converge_timeout = converge_timeout
+        self.stable_frames = stable_frames
+        self.tolerance = tolerance
+        self.lock = Lock()
+        self.started = config is None and camera is not None
+        self.ready = False
+        self.converge_time = None
+        self.captures = 0
+
+    def start(self):
+        with self.lock:
+            self._start()
+        return self
+
+    def _start(self):
+        if self.started:
+            return
+        if self.camera is None:
+            from picamera2 import Picamera2
+            self.camera = Picamera2()
+        if self.config is not None:
+            self.camera.configure(self.config(self.camera))
+        self.camera.start()
+        self.started = True
+        self.ready = False
+
+    def converged(self, previous, metadata):
+        """Whether AE and AWB have settled between two consecutive frames' metadata."""
+        if 'AeLocked' in metadata:
+            ae = metadata['AeLocked']
+        else:
+            exposure = None
+            if previous is not None and 'ExposureTime' in metadata:
+                exposure = relative_change(previous.get('ExposureTime', 0) * previous.get('AnalogueGain', 1),
+                                           metadata['ExposureTime'] * metadata.get('AnalogueGain', 1))
+            ae = exposure is not None and exposure <= self.tolerance
+        if 'AwbLocked' in metadata:
+            awb = metadata['AwbLocked']
+        else:
+            gains = None
+            if previous is not None and 'ColourGains' in metadata:
+                gains = relative_change(previous.get('ColourGains'), metadata['ColourGains'])
+            awb = gains is not None and gains <= self.tolerance
+        return ae and awb
+
+    def wait_ready(self):
+        """Block until AE/AWB converged or converge_timeout passed, the camera must be started."""
+        start = time.monotonic()
+        deadline = start + self.converge_timeout
+        previous = None
+        stable = 0
+        while stable < self.stable_frames:
+            if time.monotonic() > deadline:
+                logging.warning(f"Camera didn't converge within {self.converge_timeout} s, capturing anyway")
+                break
+            metadata = self.camera.capture_metadata()
+            stable = stable + 1 if self.converged(previous, metadata) else 0
+            previous = metadata
+        self.converge_time = time.monotonic() - start
+        self.ready = True
+
+    def _prepare(self):
+        self._start()
+        if not self.ready:
+            self.wait_ready()
+        self.captures += 1
+
+    def capture_file(self, target, name='main', format=None):
+        """
+        :param target - file name or file like object
+        :param name - stream to capture
+        :param format - image format, taken from the file name if None
+        """
+        with self.lock:
+            self._prepare()
+            self.camera.capture_file(target, name=name, format=format)
+
+    def capture_array(self, name='main'):
+        with self.lock:
+            self._prepare()
+            return self.camera.capture_array(name)
+
+    def capture_metadata(self):
+        with self.lock:
+            self._prepare()
+            return self.camera.capture_metadata()
+
+    def capture_array_with_controls(self, controls, name='main', max_frames=12, settle_frames=4, tolerance=0.05):
+        """
+        Apply manual controls and capture the first frame taken with them.
+
+        The frame is recognised by its ExposureTime metadata, or, when the sensor
+        clamps the exposure, by the exposure not changing anymore after
+        settle_frames frames.
+
+        :param controls - Picamera2 controls, e.g. {'ExposureTime': 20000, 'AnalogueGain': 1.0}
+        """
+        with self.lock:
+            self._prepare()
+            self.camera.set_controls(controls)
+            wanted = controls.get('ExposureTime')
+            previous = None
+            for frame in range(max_frames):
+                arrays, metadata = self.camera.capture_arrays([name])
+                exposure = metadata.get('ExposureTime')
+                # No ExposureTime in the metadata counts as not applied yet
+                change = relative_change(wanted, exposure)
+                if wanted is None or (change is not None and change <= tolerance):
+                    return arrays[0]
+                if frame >= settle_frames and exposure == previous:
+                    logging.info(f"Exposure {wanted} us clamped to {exposure} us")
+                    return arrays[0]
+                previous = exposure
+            logging.warning(f"Controls {controls} not applied within {max_frames} frames")
+            return arrays[0]
+
+    def restore_auto_exposure(self):
+        """Hand exposure back to AE/AGC after manual controls, the next capture waits for convergence."""
+        with self.lock:
+            if self.camera is None:
+                return
+            # 0 returns ExposureTime and AnalogueGain to the AE/AGC algorithm
+            self.camera.set_controls({'AeEnable': True, 'ExposureTime': 0, 'AnalogueGain': 0})
+            self.ready = False
+
+    def capture_image(self, name='main'):
+        """:return PIL Image of the stream"""
+        with self.lock:
+            self._prepare()
+            return self.camera.capture_image(name)
+
+    def close(self):
+        """Stop and release the camera, safe to call more than once."""
+        with self.lock:
+            if self.camera is None:
+                return
+            try:
+                self.camera.stop()
+            except Exception as ex:
+                logging.info(f"Error stopping camera: {ex}")
+            try:
+                self.camera.close()
+            except Exception as ex:
+                logging.info(f"Error closing camera: {ex}")
+            self.camera = None
+            self.started = False
+            self.ready = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,115 @@
+import json
+import os
+import time
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+from lib.motion import decimate_luma
+
+HASH_SIZE = 8
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """
+    Difference hash: the frame shrunk to (hash_size + 1) x hash_size luma, one
+    bit per horizontally adjacent pair, set when the left pixel is brighter.
+
+    :param image - RGB(X) or 2D luma array, or PIL Image
+
+    :return int of hash_size * hash_size bits
+    """
+    size = (hash_size + 1, hash_size)
+    if isinstance(image, Image.Image):
+        # reducing_gap shrinks by an integer factor first, a fraction of a full resample
+        small = image.resize(size, Image.BOX, reducing_gap=2.0).convert('L')
+    else:
+        # A strided copy a few times the hash size, then averaged down
+        small = Image.fromarray(decimate_luma(image, size[0] * 8)).resize(size, Image.BOX)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, :-1] > pixels[:, 1:]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class CaptureDeduplicator:
+    """
+    Detects captures that look the same as a recent one, so their encode and
+    upload can be skipped.
+
+    The dHash of every kept capture goes into a window of the last window
+    hashes; a capture within distance bits of any of them is a duplicate and
+    isn't added, so a slow change (dusk) still produces a capture once it adds
+    up to more than distance.
+
+    :param distance - largest Hamming distance of a duplicate, of 64 bits
+    :param window - kept hashes compared against
+    :param path - JSON file the hashes and counters are kept in between runs, None for memory only
+    """
+    def __init__(self, distance=4, window=8, path=None):
+        self.distance = distance
+        self.path = path
+        self.hashes = deque(maxlen=window)
+        self.checked = 0
+        self.duplicates = 0
+        self.uploads_avoided = 0
+        self.bytes_avoided = 0
+        self.last_uploads = 0
+        self.last_bytes = 0
+        self.last_distance = None
+        self.last_unchanged = None
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.hashes.extend(state['hashes'])
+            for key in ('checked', 'duplicates', 'uploads_avoided', 'bytes_avoided', 'last_uploads', 'last_bytes',
+                        'last_distance', 'last_unchanged'):
+                setattr(self, key, state.get(key, getattr(self, key)))
+
+    def save(self):
+        if self.path is None:
+            return
+        state = dict(self.stats(), hashes=list(self.hashes), last_uploads=self.last_uploads,
+                     last_bytes=self.last_bytes)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def check(self, image, skip=True):
+        """
+        :param image - the raw capture, before the overlay is drawn
+        :param skip - False keeps the capture whatever it looks like, e.g. on request
+
+        :return True if it's a duplicate to skip
+        """
+        value = dhash(image)
+        self.checked += 1
+        self.last_distance = min((hamming(value, old) for old in self.hashes), default=None)
+        if skip and self.last_distance is not None and self.last_distance <= self.distance:
+            self.duplicates += 1
+            # Estimated with what the last kept capture uploaded
+            self.uploads_avoided += self.last_uploads
+            self.bytes_avoided += self.last_bytes
+            self.last_unchanged = time.time()
+            self.save()
+            return True
+        self.hashes.append(value)
+        return False
+
+    def kept(self, uploads, size):
+        """
+        :param uploads - files uploaded for the kept capture
+        :param size - bytes uploaded for it
+        """
+        self.last_uploads = uploads
+        self.last_bytes = size
+        self.save()
+
+    def stats(self):
+        return {'checked': self.checked, 'duplicates': self.duplicates, 'uploads_avoided': self.uploads_avoided,
+                'bytes_avoided': self.bytes_avoided, 'last_distance': self.last_distance,
+                'last_unchanged': self.last_unchanged}
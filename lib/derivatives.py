@@ -0,0 +1,67 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import simplejpeg
+from PIL import Image
+
+
+def parse_widths(spec):
+    """
+    :param spec - comma separated widths, e.g. 1920,1200,800,400
+
+    :return list of int, largest first
+    """
+    widths = sorted({int(value) for value in spec.split(',') if value.strip() != ''}, reverse=True)
+    for width in widths:
+        if width < 16:
+            raise ValueError(f"Invalid width: {width}")
+    return widths
+
+
+def derivative_name(path, width):
+    """Predictable name of a derivative next to path: live.jpg -> live_800.jpg"""
+    stem, extension = os.path.splitext(path)
+    return f'{stem}_{width}{extension or ".jpg"}'
+
+
+class DerivativeEncoder:
+    """
+    Builds the downscaled copies of a capture the web pages show.
+
+    The sizes are made by successive downscaling, every size is resized from the
+    next larger one instead of from the full frame. Each size is JPEG encoded on
+    a thread pool as soon as it's resized, so encoding overlaps the next resize;
+    Pillow and simplejpeg release the GIL.
+
+    :param widths - derivative widths, widths not smaller than the frame are skipped
+    :param quality - JPEG quality
+    :param workers - encoder threads
+    """
+    def __init__(self, widths, quality=85, workers=2):
+        self.widths = sorted(widths, reverse=True)
+        self.quality = quality
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='derivative')
+
+    def _encode(self, image):
+        array = np.asarray(image)
+        return simplejpeg.encode_jpeg(array, quality=self.quality, colorspace='RGBX' if array.shape[2] == 4 else 'RGB')
+
+    def render(self, array):
+        """
+        :param array - RGB or RGBX uint8 frame, e.g. with the overlay drawn in
+
+        :return dict of width -> JPEG bytes
+        """
+        height, width = array.shape[:2]
+        image = Image.fromarray(array, 'RGBX' if array.shape[2] == 4 else 'RGB')
+        futures = {}
+        for target in self.widths:
+            if target >= width:
+                continue
+            image = image.resize((target, max(round(height * target / width), 1)), Image.BILINEAR)
+            futures[target] = self.pool.submit(self._encode, image)
+        return {target: future.result() for target, future in futures.items()}
+
+    def close(self):
+        self.pool.shutdown()
@@ -1,3 +1,4 @@
+import io
 import os
 import time
 
@@ -8,7 +9,14 @@ import ftplib
 import sys
 
 class FileTransfer:
-    def __init__(self, ftpserver, username, password, ftmode, file, destination, ftpport=None):
+    def __init__(self, ftpserver, username, password, ftmode, file, destination, ftpport=None, data=None,
+                 pool=None):
+        """
+        Transfers file to destination on construction, self.success tells if it worked.
+
+        :param data - bytes to upload instead of reading file, file only names them
+        :param pool - lib.sftp_pool.SftpPool to reuse an open SFTP connection from, a new one per transfer if None
+        """
         print(file)
         self.ftpserver = ftpserver
 
@@ -19,6 +27,9 @@ class FileTransfer:
         self.password = password
         self.ftmode = ftmode.lower()
         self.file = file
+        self.data = data
+        self.pool = pool
+        self.success = False
         self.destination = destination
         if self.destination.endswith("/"):
             self.destination = self.destination[:-1]
@@ -27,7 +38,7 @@ class FileTransfer:
 
         print(f"self.destination: {self.destination}")
 
-        self.file_size_bytes = os.path.getsize(file)
+        self.file_size_bytes = len(data) if data is not None else os.path.getsize(file)
         self.starttime = time.mktime(time.localtime())
         if ftpport == None and self.ftmode == "sftp":
             self.ftpport = 22
@@ -38,10 +49,10 @@ class FileTransfer:
 
         if self.ftmode == "sftp":
             print("SFTP")
-            self.scp_file()
+            self.success = self.scp_file()
         else:
             print("FTP")
-            self.ftp_file()
+            self.success = self.ftp_file()
         pass
     
     def transfer(self, ftp, file):
@@ -147,6 +158,16 @@ class FileTransfer:
             f"""pass: {self.password}\n"""
             f"""dest: {self.destination}\n"""
         )
+        if self.pool is not None:
+            try:
+                self.pool.call(self.ftpserver, self.ftpport, self.username, self.password, self.sftp_put)
+            except Exception as ex:
+                print("Transfer unsuccessful.")
+                print("self.file: ", self.file)
+                print("destination: ", self.destination)
+                print(ex)
+                return False
+            return True
         try:
             ssh_ob = SSHClient()
             # ssh_ob.load_system_host_keys()
@@ -162,42 +183,14 @@ class FileTransfer:
             print("Couldn't connect to SCP site.")
             print(ex)
             return False
-        print("Unsplit self.destination: ", self.destination)
         try:
-            if self.destination != ".":
-                try:
-                    dest_list = self.destination.split("/")
-                except Exception as ex:
-                    dest_list = self.destination
-                    print('small destination: ', dest_list[0])
-                    # print('small destination: ', dest_list[:-1])
-                for d in dest_list[:-1]:
-                    print(f"d: {d}")
-                    if d == "" or d == "/":
-                        d = '/'
-                    try:
-                        ftp_client.chdir(d)
-                        print("Directory change: ", d)
-                    except IOError:
-                        print("Creating directory: " + d)
-                        ftp_client.mkdir(d)
-                        ftp_client.chdir(d)
-
-                # destination = (f'{self.destination}/{self.file.split("/")[-1]}')
-                destination = self.destination.split("/")[-1]
-            else:
-                destination = self.file.split("/")[-1]
-
-            # Move the file now that the folder exists
-            try:
-                ftp_client.put(self.file, destination)
-            except Exception as ex:
-                print("Transfer unsuccessful.")
-                print("self.file: ", self.file)
-                print("destination: ", destination)
-                print(ex)
-                return False
+            self.sftp_put(ftp_client)
         except Exception as ex:
+            print("Transfer unsuccessful.")
+            print("self.file: ", self.file)
+            print("destination: ", self.destination)
+            print(ex)
+            ssh_ob.close()
             return False
         # try:
         #     ftp_client.put(self.file, self.destination)
@@ -206,5 +199,40 @@ class FileTransfer:
         #     print(ex)
         #     return False
         ftp_client.close()
+        ssh_ob.close()
+
+        return True
 
-        return True
\ No newline at end of file
+    def sftp_put(self, ftp_client):
+        """
+        Creates the folders of self.destination below the current directory of
+        ftp_client and uploads into them, raises if the transfer fails.
+
+        :param ftp_client - paramiko SFTPClient
+        """
+        print("Unsplit self.destination: ", self.destination)
+        if self.destination != ".":
+            dest_list = self.destination.split("/")
+            for d in dest_list[:-1]:
+                print(f"d: {d}")
+                if d == "" or d == "/":
+                    d = '/'
+                try:
+                    ftp_client.chdir(d)
+                    print("Directory change: ", d)
+                except IOError:
+                    print("Creating directory: " + d)
+                    ftp_client.mkdir(d)
+                    ftp_client.chdir(d)
+
+            # destination = (f'{self.destination}/{self.file.split("/")[-1]}')
+            destination = dest_list[-1]
+        else:
+            destination = self.file.split("/")[-1]
+
+        # Move the file now that the folder exists
+        if self.data is not None:
+            # Straight from memory, no temporary file
+            ftp_client.putfo(io.BytesIO(self.data), destination)
+        else:
+            ftp_client.put(self.file, destination)
\ No newline at end of file
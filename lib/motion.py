@@ -0,0 +1,203 @@
+import logging
+import time
+from threading import Event, Thread
+
+import numpy as np
+
+ANALYSIS_WIDTH = 320
+
+
+def parse_zones(spec):
+    """
+    :param spec - semicolon separated rectangles left,top,right,bottom as
+                  fractions of the frame, e.g. 0,0,1,0.2;0.8,0.5,1,1
+
+    :return list of (left, top, right, bottom) tuples
+    """
+    zones = []
+    for rectangle in spec.split(';'):
+        if rectangle.strip() == '':
+            continue
+        try:
+            left, top, right, bottom = (float(value) for value in rectangle.split(','))
+        except ValueError:
+            raise ValueError(f"Invalid zone: {rectangle}")
+        if not 0 <= left < right <= 1 or not 0 <= top < bottom <= 1:
+            raise ValueError(f"Invalid zone: {rectangle}")
+        zones.append((left, top, right, bottom))
+    return zones
+
+
+def decimate_luma(array, width=ANALYSIS_WIDTH):
+    """
+    Small luma frame for the analysis, taken by striding without filtering.
+
+    :param array - Y plane (2D) or RGB(X) frame, green stands in for luma
+    :param width - approximate width of the result
+
+    :return contiguous uint8 2D array
+    """
+    step = max(array.shape[1] // width, 1)
+    if array.ndim == 3:
+        return np.ascontiguousarray(array[::step, ::step, 1])
+    return np.ascontiguousarray(array[::step, ::step])
+
+
+class MotionDetector:
+    """
+    Frame differencing against a running average background.
+
+    A pixel has changed when it differs from the background by more than
+    threshold, after the mean difference (a cloud, the exposure adjusting) is
+    subtracted. Motion is more than area of the unmasked pixels changing. The
+    background follows the scene with the weight alpha, changed pixels more
+    slowly, so something that stops moving blends in after a while.
+
+    :param threshold - luma difference of a changed pixel (0-255)
+    :param area - fraction of the unmasked pixels that must change
+    :param mask_zones - rectangles that are ignored, see parse_zones()
+    :param alpha - background update weight per frame
+    """
+    def __init__(self, threshold=25, area=0.01, mask_zones=(), alpha=0.05):
+        self.threshold = threshold
+        self.area = area
+        self.mask_zones = list(mask_zones)
+        self.alpha = alpha
+        self.background = None
+        self.mask = None
+        self.difference = None
+        self.changed = None
+        self.pixels = 0
+        self.last_score = 0.0
+
+    def _reset(self, frame):
+        height, width = frame.shape
+        self.background = frame.astype(np.float32)
+        self.difference = np.empty((height, width), dtype=np.float32)
+        self.changed = np.empty((height, width), dtype=bool)
+        self.mask = np.ones((height, width), dtype=bool)
+        for left, top, right, bottom in self.mask_zones:
+            self.mask[round(top * height):round(bottom * height), round(left * width):round(right * width)] = False
+        self.pixels = max(int(self.mask.sum()), 1)
+
+    def update(self, frame):
+        """
+        :param frame - 2D uint8 luma frame, see decimate_luma()
+
+        :return True if there's motion
+        """
+        if self.background is None or self.background.shape != frame.shape:
+            self._reset(frame)
+            return False
+        difference = self.difference
+        np.subtract(frame, self.background, out=difference)
+        difference -= difference[self.mask].mean() if self.mask_zones else difference.mean()
+        np.abs(difference, out=difference)
+        changed = np.greater(difference, self.threshold, out=self.changed)
+        changed &= self.mask
+        self.last_score = int(np.count_nonzero(changed)) / self.pixels
+
+        # background += alpha * (frame - background), a tenth of that where it changed
+        np.subtract(frame, self.background, out=difference)
+        difference *= self.alpha
+        np.multiply(difference, 0.1, out=difference, where=changed)
+        self.background += difference
+        return self.last_score > self.area
+
+
+class MotionTrigger:
+    """
+    Calls capture when a MotionDetector sees motion.
+
+    Luma frames are submitted from the camera thread at up to fps and analysed
+    on the trigger's own thread, only the newest frame is kept. Captures are at
+    least min_interval apart, and without motion one is taken every max_interval
+    anyway.
+
+    :param detector - MotionDetector
+    :param capture - callable taking the reason, 'motion' or 'interval'
+    :param min_interval - seconds between motion captures
+    :param max_interval - seconds without a capture before one is taken, 0 for never
+    :param fps - frames analysed per second
+    :param clock - monotonic time source
+    """
+    def __init__(self, detector, capture, min_interval=5.0, max_interval=600.0, fps=15, clock=time.monotonic):
+        self.detector = detector
+        self.capture = capture
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.frame_interval = 1.0 / fps
+        self.clock = clock
+        self.pending = None
+        self.ready = Event()
+        self.next_frame = 0.0
+        self.last_capture = clock()
+        self.analysed = 0
+        self.skipped = 0
+        self.analysis_time = 0.0
+        self.motion_captures = 0
+        self.interval_captures = 0
+        self.thread = None
+
+    def due(self):
+        """True if the next frame is wanted, checked before the camera frame is read."""
+        return self.clock() >= self.next_frame
+
+    def submit(self, frame):
+        """:param frame - 2D uint8 luma frame, not modified"""
+        self.next_frame = max(self.next_frame + self.frame_interval, self.clock())
+        if self.pending is not None:
+            self.skipped += 1
+        self.pending = frame
+        self.ready.set()
+
+    def process(self, frame=None):
+        """
+        Analyse one frame and capture if needed, on the calling thread.
+
+        :param frame - luma frame, None only checks max_interval
+        """
+        if frame is not None:
+            start = time.perf_counter()
+            motion = self.detector.update(frame)
+            self.analysis_time += time.perf_counter() - start
+            self.analysed += 1
+            if motion and self.clock() - self.last_capture >= self.min_interval:
+                logging.info(f"Motion: {self.detector.last_score * 100:.1f}% of the frame changed")
+                self._capture('motion')
+        if self.max_interval > 0 and self.clock() - self.last_capture >= self.max_interval:
+            self._capture('interval')
+
+    def _capture(self, reason):
+        self.last_capture = self.clock()
+        if reason == 'motion':
+            self.motion_captures += 1
+        else:
+            self.interval_captures += 1
+        try:
+            self.capture(reason)
+        except Exception as ex:
+            print(f"Error in {reason} capture.")
+            print(ex)
+
+    def start(self):
+        self.thread = Thread(target=self._run, name='motion', daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self.max_interval > 0:
+                timeout = max(self.last_capture + self.max_interval - self.clock(), 0)
+            frame = None
+            if self.ready.wait(timeout):
+                self.ready.clear()
+                frame, self.pending = self.pending, None
+            self.process(frame)
+
+    def stats(self):
+        return {'analysed': self.analysed, 'skipped': self.skipped,
+                'average_ms': round(self.analysis_time / self.analysed * 1000, 3) if self.analysed else None,
+                'last_score': round(self.detector.last_score, 4),
+                'motion_captures': self.motion_captures, 'interval_captures': self.interval_captures}
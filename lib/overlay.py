@@ -0,0 +1,215 @@
+import math
+import time
+from functools import lru_cache
+from threading import Lock
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+# Characters of a cam_time() timestamp rendered when the renderer is created,
+# anything else (day and month names) is added to the atlas the first time it's used.
+ATLAS_CHARACTERS = '0123456789 ,:-/'
+PADDING = 5
+
+
+@lru_cache(maxsize=16)
+def load_font(font_path, size):
+    """Each (font, size) is only loaded from disk once."""
+    return ImageFont.truetype(font=font_path, size=size)
+
+
+def parse_color(value, fallback):
+    """RGB tuple of a PIL color name or #hex value, fallback if the value isn't a color."""
+    try:
+        return ImageColor.getrgb(value)
+    except ValueError:
+        return ImageColor.getrgb(fallback)
+
+
+@lru_cache(maxsize=8)
+def get_renderer(font_path, size, color, background, camera_name, timestamp=True):
+    """
+    Shared OverlayRenderer for a configuration, a new renderer is only built when
+    the configuration changes.
+    """
+    return OverlayRenderer(font_path, size, color, background, camera_name, timestamp)
+
+
+def encode_with_overlay(array, renderer, text, encoder, max_bytes=0, quality=100):
+    """
+    Draw the overlay into a raw frame in place and JPEG encode it once, the same
+    bytes serve the response, the local file and every upload.
+
+    :param array - height x width x 3 or 4 uint8 RGB(X) frame, e.g. capture_array()
+    :param renderer - OverlayRenderer
+    :param text - timestamp text, e.g. cam_time()
+    :param encoder - lib.target_size.TargetSizeEncoder
+    :param max_bytes - size budget of the JPEG, 0 for none
+    :param quality - JPEG quality, the highest one tried with a budget
+
+    :return lib.target_size.TargetResult
+    """
+    renderer.blit(array, text, (0, 0))
+    return encoder.encode(array, max_bytes, quality)
+
+
+class OverlayRenderer:
+    """
+    Renders the "camera_name - timestamp" text that is embedded into the images.
+
+    The camera name is rasterized once. Every character of the timestamp is
+    rendered once into a glyph atlas and the digits share one cell width, so when
+    the timestamp changes only the cells of the characters that changed are
+    blitted from the atlas onto the canvas, which is kept between captures.
+
+    :param font_path - TrueType/OpenType font
+    :param size - font size
+    :param color - text color, silver if it isn't a valid color
+    :param background - background color, black if it isn't a valid color
+    :param camera_name - static part of the text
+    :param timestamp - if False only the camera name is rendered
+    """
+    def __init__(self, font_path, size, color, background, camera_name, timestamp=True):
+        self.font = load_font(font_path, size)
+        self.color = parse_color(color, 'silver')
+        self.background = parse_color(background, 'black')
+        self.lock = Lock()
+
+        prefix = camera_name + (' - ' if timestamp else '')
+        # One line height for every glyph so cells line up
+        self.line_height = self.font.getbbox(prefix + ATLAS_CHARACTERS + 'ABCDEFGHIJKLMNOPQRSTUVWXYZgjpqy')[3]
+        self.prefix = self._render_text(prefix, math.ceil(self.font.getlength(prefix)))
+
+        # Tabular digits, a changing digit never moves the characters after it
+        self.digit_width = math.ceil(max(self.font.getlength(digit) for digit in '0123456789'))
+        self.glyphs = {}
+        for character in ATLAS_CHARACTERS:
+            self._glyph(character)
+
+        self.canvas = None
+        self.pixels = None
+        self.cells = []
+        self.text = None
+        self.blitted = 0
+
+    def _render_text(self, text, width):
+        image = Image.new('RGB', (max(width, 1), self.line_height), self.background)
+        ImageDraw.Draw(image).text((0, 0), text, self.color, self.font)
+        return image
+
+    def _glyph(self, character):
+        glyph = self.glyphs.get(character)
+        if glyph is None:
+            if character.isdigit():
+                width = self.digit_width
+            else:
+                width = math.ceil(self.font.getlength(character))
+            glyph = self._render_text(character, width)
+            self.glyphs[character] = glyph
+        return glyph
+
+    def _layout(self, text):
+        """(character, x) of every cell, x relative to the canvas."""
+        cells = []
+        x = PADDING + self.prefix.width
+        for character in text:
+            cells.append((character, x))
+            x += self._glyph(character).width
+        return cells, x + PADDING
+
+    def _update(self, text):
+        if text == self.text:
+            return
+        cells, width = self._layout(text)
+        if self.canvas is None or self.canvas.width != width or len(cells) != len(self.cells):
+            self.canvas = Image.new('RGB', (width, self.line_height + 2 * PADDING), self.background)
+            self.canvas.paste(self.prefix, (PADDING, PADDING))
+            self.cells = []
+        for index, (character, x) in enumerate(cells):
+            if index < len(self.cells) and self.cells[index] == (character, x):
+                continue
+            self.canvas.paste(self.glyphs[character], (x, PADDING))
+            self.blitted += 1
+        self.cells = cells
+        self.text = text
+        self.pixels = np.asarray(self.canvas)
+
+    def render(self, text=''):
+        """
+        :param text - timestamp text, e.g. cam_time()
+
+        :return PIL Image of the overlay, a copy the caller may keep
+        """
+        with self.lock:
+            self._update(text)
+            return self.canvas.copy()
+
+    def paste(self, image, text='', offset=(0, 0)):
+        """
+        Draw the overlay onto image without copying the canvas.
+
+        :param image - PIL Image to draw on
+        :param text - timestamp text, e.g. cam_time()
+        :param offset - top left corner of the overlay
+        """
+        with self.lock:
+            self._update(text)
+            image.paste(self.canvas, offset)
+
+    def blit(self, array, text='', offset=(0, 0)):
+        """
+        Draw the overlay into a raw frame in place, no image is decoded or copied.
+
+        :param array - height x width x 3 or 4 uint8 array with RGB(X) channels,
+                       e.g. Picamera2 capture_array() of an XBGR8888 stream
+        :param text - timestamp text, e.g. cam_time()
+        :param offset - top left corner of the overlay, clipped to the frame
+        """
+        with self.lock:
+            self._update(text)
+            x, y = offset
+            height = min(self.pixels.shape[0], array.shape[0] - y)
+            width = min(self.pixels.shape[1], array.shape[1] - x)
+            if height > 0 and width > 0:
+                array[y:y + height, x:x + width, :3] = self.pixels[:height, :width]
+
+
+class StreamOverlay:
+    """
+    Draws the overlay on every frame of a video stream before it's encoded.
+
+    The renderer and the timestamp text are looked up at most once per second,
+    in between every frame only gets the cached overlay pixels copied in.
+
+    :param renderer - callable returning the OverlayRenderer to use, e.g. one
+                      that follows the configuration
+    :param timestamp - callable returning the timestamp text
+    :param offset - top left corner of the overlay
+    :param clock - wall clock, the overlay is refreshed when its second changes
+    """
+    def __init__(self, renderer, timestamp, offset=(0, 0), clock=time.time):
+        self.renderer = renderer
+        self.timestamp = timestamp
+        self.offset = offset
+        self.clock = clock
+        self.second = None
+        self.current = None
+        self.text = ''
+        self.frames = 0
+        self.seconds = 0.0
+
+    def apply(self, array):
+        """:param array - RGB(X) frame, modified in place"""
+        start = time.perf_counter()
+        second = int(self.clock())
+        if second != self.second:
+            self.second = second
+            self.current = self.renderer()
+            self.text = self.timestamp()
+        self.current.blit(array, self.text, self.offset)
+        self.frames += 1
+        self.seconds += time.perf_counter() - start
+
+    def stats(self):
+        return {'frames': self.frames,
+                'average_ms': self.seconds / self.frames * 1000 if self.frames else 0.0}
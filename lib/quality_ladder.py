@@ -0,0 +1,106 @@
+def parse_qualities(spec):
+    """
+    :param spec - comma separated JPEG qualities, e.g. 95,80,60
+
+    :return list of int, highest first
+    """
+    qualities = sorted({int(value) for value in spec.split(',') if value.strip() != ''}, reverse=True)
+    for quality in qualities:
+        if not 1 <= quality <= 100:
+            raise ValueError(f"Invalid quality: {quality}")
+    return qualities
+
+
+class QualityLadder:
+    """
+    Quality rungs of one reduced stream profile.
+
+    The top rung is the profile's own encoder, every lower rung is another
+    ProfileEncoder with the same size and a lower quality. Like the profiles,
+    a rung is encoded at most once per frame and only while a client is on it.
+
+    :param encoder - lib.stream_profiles.ProfileEncoder of the profile
+    :param qualities - rung qualities, the ones that aren't below the profile's
+                       quality are ignored
+    """
+    def __init__(self, encoder, qualities):
+        self.rungs = [encoder]
+        for quality in qualities:
+            if quality < encoder.profile.quality:
+                self.rungs.append(type(encoder)(encoder.profile._replace(quality=quality)))
+        self.switches_down = 0
+        self.switches_up = 0
+
+    @property
+    def outputs(self):
+        return [rung.output for rung in self.rungs]
+
+    def occupancy(self):
+        """Number of viewers per rung quality."""
+        return {rung.profile.quality: rung.output.viewer_count() for rung in self.rungs}
+
+    def controller(self):
+        return AdaptiveController(self)
+
+
+class AdaptiveController:
+    """
+    Moves one client up or down a QualityLadder.
+
+    A frame is congested when sending it took longer than high_latency (or the
+    socket backlog is over the high water mark), it is clear when it went out
+    within low_latency (or nothing was queued). down_after congested frames in a
+    row move the client a rung down, up_after clear frames in a row move it up.
+    """
+    def __init__(self, ladder, high_latency=0.1, low_latency=0.02, down_after=2, up_after=30):
+        self.ladder = ladder
+        self.rung = 0
+        self.high_latency = high_latency
+        self.low_latency = low_latency
+        self.down_after = down_after
+        self.up_after = up_after
+        self.congested = 0
+        self.clear = 0
+
+    @property
+    def output(self):
+        return self.ladder.rungs[self.rung].output
+
+    def _observe(self, congested, clear):
+        if congested:
+            self.congested += 1
+            self.clear = 0
+        elif clear:
+            self.clear += 1
+            self.congested = 0
+        else:
+            self.congested = 0
+            self.clear = 0
+
+        if self.congested >= self.down_after and self.rung < len(self.ladder.rungs) - 1:
+            self.rung += 1
+            self.ladder.switches_down += 1
+            self.congested = 0
+        elif self.clear >= self.up_after and self.rung > 0:
+            self.rung -= 1
+            self.ladder.switches_up += 1
+            self.clear = 0
+        return self.output
+
+    def observe_latency(self, seconds):
+        """
+        :param seconds - time it took to send the last frame
+
+        :return StreamingOutput of the rung the client should be on
+        """
+        return self._observe(seconds > self.high_latency, seconds <= self.low_latency)
+
+    def observe_backlog(self, queued, high_water):
+        """
+        :param queued - bytes still queued on the client's socket
+        :param high_water - queued bytes that count as congested
+
+        :return StreamingOutput of the rung the client should be on
+        """
+        return self._observe(queued > high_water, queued == 0)
+
@@ -0,0 +1,162 @@
+import asyncio
+import hmac
+import logging
+import socket
+import struct
+from threading import Thread, Event
+
+from lib.streaming_output import StreamClient
+
+# The camera opens one connection to the relay and sends HELLO followed by the
+# token and a newline, then one FRAME_HEADER + JPEG per frame.
+HELLO = b'RPWRELAY1 '
+FRAME_MAGIC = b'RPWF'
+# magic, sequence, capture time, length
+FRAME_HEADER = struct.Struct('!4sQdI')
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+def parse_relay_url(url):
+    """
+    :param url - host:port of the relay ingest port
+
+    :return (host, port)
+    """
+    host, _, port = url.strip().rpartition(':')
+    if host == '' or not port.isnumeric():
+        raise ValueError(f"Invalid relay_url: {url}")
+    return host, int(port)
+
+
+class RelayPublisher:
+    """
+    Camera side of the relay: pushes the frames of a StreamingOutput upstream over
+    one persistent TCP connection, whatever the number of viewers on the relay.
+
+    Like any other viewer the publisher skips to the newest frame when the
+    uplink can't keep up. The connection is re-established with an increasing
+    delay when it fails.
+
+    :param output - StreamingOutput to publish
+    :param host - relay host
+    :param port - relay ingest port
+    :param token - shared secret the relay expects
+    """
+    def __init__(self, output, host, port, token='', connect_timeout=10, max_backoff=30):
+        self.output = output
+        self.host = host
+        self.port = port
+        self.token = token
+        self.connect_timeout = connect_timeout
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.connected = False
+        self.stopped = Event()
+        self.thread = Thread(target=self._run, name='relay-publisher', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.settimeout(None)
+        sock.sendall(HELLO + self.token.encode('utf-8') + b'\n')
+        return sock
+
+    def _publish(self, sock):
+        client = self.output.register(StreamClient(self.output))
+        try:
+            while not self.stopped.is_set():
+                frame = client.next_frame(timeout=1)
+                if frame is None:
+                    continue
+                header = FRAME_HEADER.pack(FRAME_MAGIC, frame.sequence, frame.timestamp, len(frame.data))
+                # Gather write, the frame isn't copied into a new buffer
+                pending = [memoryview(header), memoryview(frame.data)]
+                while pending:
+                    sent = sock.sendmsg(pending)
+                    while pending and sent >= len(pending[0]):
+                        sent -= len(pending[0])
+                        pending.pop(0)
+                    if pending:
+                        pending[0] = pending[0][sent:]
+                self.sent += 1
+        finally:
+            client.close()
+
+    def _run(self):
+        backoff = 1
+        while not self.stopped.is_set():
+            try:
+                sock = self._connect()
+            except OSError as ex:
+                print(f"Couldn't connect to relay {self.host}:{self.port}")
+                print(ex)
+                self.stopped.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            print(f"Publishing stream to relay {self.host}:{self.port}")
+            self.connected = True
+            backoff = 1
+            try:
+                self._publish(sock)
+            except OSError as ex:
+                print("Relay connection lost.")
+                print(ex)
+            finally:
+                self.connected = False
+                sock.close()
+
+
+class RelayIngest:
+    """
+    Relay side: accepts the camera's connection and publishes the frames it
+    receives to a local StreamingOutput, which is then served to the viewers.
+
+    :param output - StreamingOutput the received frames are written to
+    :param host - address to listen on
+    :param port - ingest port
+    :param token - shared secret the camera has to send
+    """
+    def __init__(self, output, host='0.0.0.0', port=8100, token=''):
+        self.output = output
+        self.host = host
+        self.port = port
+        self.token = token
+        self.server = None
+        self.received = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        if self.port == 0:
+            self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    async def _handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        try:
+            hello = await reader.readline()
+            token = hello[len(HELLO):].rstrip(b'\n')
+            if not hello.startswith(HELLO) or not hmac.compare_digest(token, self.token.encode('utf-8')):
+                print(f"Rejected relay publisher {peer}")
+                return
+            print(f"Relay publisher connected: {peer}")
+            while True:
+                magic, sequence, timestamp, length = FRAME_HEADER.unpack(
+                    await reader.readexactly(FRAME_HEADER.size))
+                if magic != FRAME_MAGIC or length > MAX_FRAME_BYTES:
+                    print(f"Invalid frame from relay publisher {peer}")
+                    return
+                self.output.publish(await reader.readexactly(length), timestamp)
+                self.received += 1
+        except (asyncio.IncompleteReadError, ConnectionError) as ex:
+            logging.info(f"Relay publisher disconnected: {peer} {ex}")
+        finally:
+            writer.close()
@@ -0,0 +1,289 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import simplejpeg
+from PIL import Image
+
+FITS = ('fill', 'contain', 'cover')
+MAX_SIZE = 8192
+
+
+def parse_resize_args(args):
+    """
+    :param args - request arguments: width and/or height, fit (fill, contain or
+                  cover, default fill: stretched to width x height like liveResize.php)
+
+    :return (width, height, fit) - width or height may be None, then it follows the aspect ratio
+    """
+    sizes = []
+    for key in ('width', 'height'):
+        value = args.get(key)
+        if value is None or value == '':
+            sizes.append(None)
+        elif not value.isnumeric() or not 0 < int(value) <= MAX_SIZE:
+            raise ValueError(f"Invalid {key}: {value}")
+        else:
+            sizes.append(int(value))
+    if sizes == [None, None]:
+        raise ValueError("Missing width or height")
+    fit = args.get('fit', 'fill')
+    if fit not in FITS:
+        raise ValueError(f"Invalid fit: {fit}")
+    return sizes[0], sizes[1], fit
+
+
+def resize_geometry(source_size, width, height, fit):
+    """
+    :return (size, box) - size to resample the source to, box to crop from it afterwards or None
+    """
+    source_width, source_height = source_size
+    if width is None or height is None:
+        scale = width / source_width if height is None else height / source_height
+    elif fit == 'fill':
+        return (width, height), None
+    elif fit == 'contain':
+        scale = min(width / source_width, height / source_height)
+    else:
+        scale = max(width / source_width, height / source_height)
+    size = (max(round(source_width * scale), 1), max(round(source_height * scale), 1))
+    if fit != 'cover' or width is None or height is None:
+        return size, None
+    left = (size[0] - width) // 2
+    top = (size[1] - height) // 2
+    return size, (left, top, left + width, top + height)
+
+
+def resize_jpeg(jpeg, width, height, fit='fill', quality=85, draft=True):
+    """
+    :param jpeg - JPEG bytes
+    :param draft - decode at 1/2, 1/4 or 1/8 scale straight from the DCT
+                   coefficients when that is still at least the resampled size
+
+    :return bytes - the resized JPEG
+    """
+    image = Image.open(io.BytesIO(jpeg))
+    size, box = resize_geometry(image.size, width, height, fit)
+    if draft:
+        image.draft('RGB', size)
+    image = image.convert('RGB')
+    if image.size != size:
+        image = image.resize(size, Image.BILINEAR)
+    if box is not None:
+        image = image.crop(box)
+    return simplejpeg.encode_jpeg(np.asarray(image), quality=quality, colorspace='RGB')
+
+
+class FileSource:
+    """
+    JPEG file as a resize source, versioned by modification time and size.
+
+    :param path - e.g. live.jpg
+    """
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.data = None
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        """:return (version, jpeg)"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            raise LookupError(f"{self.path} does not exist")
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if version != self.version:
+                with open(self.path, 'rb') as f:
+                    self.data = f.read()
+                self.version = version
+            return self.version, self.data
+
+
+class LatestJpeg:
+    """Newest JPEG handed to publish() as a resize source, versioned by a sequence number."""
+    def __init__(self):
+        # Sequence numbers restart with the process, the epoch keeps ETags and spilled entries unique
+        self.epoch = os.urandom(4).hex()
+        self.sequence = 0
+        self.data = None
+        self.lock = threading.Lock()
+
+    def publish(self, jpeg):
+        with self.lock:
+            self.sequence += 1
+            self.data = jpeg
+
+    def __call__(self):
+        """:return (version, jpeg)"""
+        with self.lock:
+            if self.data is None:
+                raise LookupError("No image captured yet")
+            return (self.epoch, self.sequence), self.data
+
+
+class ResizeCache:
+    """
+    LRU cache of resized JPEGs, bounded by the total size of the entries.
+
+    Entries evicted from memory are written to spill_dir (if given), which is
+    bounded by spill_bytes and kept across restarts. Concurrent misses for the
+    same key are coalesced, the first caller computes and the others wait for
+    its result.
+
+    :param max_bytes - memory budget
+    :param spill_dir - folder for evicted entries, None to drop them
+    :param spill_bytes - disk budget
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, spill_dir=None, spill_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_bytes = spill_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.spilled = OrderedDict()
+        self.spilled_bytes = 0
+        self.hits = self.disk_hits = self.misses = self.coalesced = 0
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            # Entries of an earlier run, oldest first
+            names = [name for name in os.listdir(spill_dir) if name.endswith('.jpg')]
+            for name in sorted(names, key=lambda name: os.path.getmtime(os.path.join(spill_dir, name))):
+                self.spilled[name] = os.path.getsize(os.path.join(spill_dir, name))
+                self.spilled_bytes += self.spilled[name]
+
+    @staticmethod
+    def spill_name(key):
+        return hashlib.sha1(repr(key).encode()).hexdigest() + '.jpg'
+
+    def get(self, key, compute):
+        """
+        :param key - hashable, e.g. (source version, width, height, fit)
+        :param compute - callable returning the bytes on a miss
+
+        :return bytes
+        """
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+
+        try:
+            data = self._read_spill(key)
+            if data is None:
+                with self.lock:
+                    self.misses += 1
+                data = compute()
+            evicted = self._put(key, data)
+            future.set_result(data)
+        except Exception as ex:
+            future.set_exception(ex)
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+        self._spill(evicted)
+        return data
+
+    def _put(self, key, data):
+        """Add an entry, :return the evicted (key, data) pairs"""
+        evicted = []
+        with self.lock:
+            self.entries[key] = data
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_data = self.entries.popitem(last=False)
+                self.bytes -= len(old_data)
+                evicted.append((old_key, old_data))
+        return evicted
+
+    def _read_spill(self, key):
+        if self.spill_dir is None:
+            return None
+        name = self.spill_name(key)
+        with self.lock:
+            if name not in self.spilled:
+                return None
+            self.spilled.move_to_end(name)
+        try:
+            with open(os.path.join(self.spill_dir, name), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            self.disk_hits += 1
+        return data
+
+    def _spill(self, evicted):
+        if self.spill_dir is None:
+            return
+        for key, data in evicted:
+            name = self.spill_name(key)
+            path = os.path.join(self.spill_dir, name)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            removed = []
+            with self.lock:
+                self.spilled_bytes += len(data) - self.spilled.pop(name, 0)
+                self.spilled[name] = len(data)
+                while self.spilled_bytes > self.spill_bytes and len(self.spilled) > 1:
+                    old_name, size = self.spilled.popitem(last=False)
+                    self.spilled_bytes -= size
+                    removed.append(old_name)
+            for old_name in removed:
+                try:
+                    os.remove(os.path.join(self.spill_dir, old_name))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.bytes, 'spilled': len(self.spilled),
+                    'spilled_bytes': self.spilled_bytes, 'hits': self.hits, 'disk_hits': self.disk_hits,
+                    'misses': self.misses, 'coalesced': self.coalesced}
+
+
+class ResizeService:
+    """
+    Resized copies of a source JPEG, the replacement of WebPages/liveResize.php.
+
+    :param source - callable returning (version, jpeg), e.g. FileSource or LatestJpeg
+    :param cache - ResizeCache
+    :param quality - JPEG quality of the resized copies
+    """
+    def __init__(self, source, cache=None, quality=85):
+        self.source = source
+        self.cache = cache if cache is not None else ResizeCache()
+        self.quality = quality
+
+    def resize(self, width, height, fit='fill'):
+        """
+        :raise LookupError if the source has no image
+
+        :return (etag, bytes)
+        """
+        version, jpeg = self.source()
+        key = (version, width, height, fit, self.quality)
+        data = self.cache.get(key, lambda: resize_jpeg(jpeg, width, height, fit, self.quality))
+        return '"' + self.cache.spill_name(key)[:16] + '"', data
+
+    def stats(self):
+        return self.cache.stats()
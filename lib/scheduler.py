@@ -0,0 +1,274 @@
+import datetime
+import logging
+import statistics
+import time
+from collections import deque
+from threading import Event, Thread
+
+# Longest wait on the monotonic clock before the deadline is re-anchored on the
+# wall clock, a clock step (NTP, RTC) is picked up within this many seconds
+RESYNC = 60.0
+# Cron fields: second (optional) minute hour day month weekday (0 or 7 = Sunday)
+CRON_FIELDS = ((0, 59), (0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def parse_field(text, low, high):
+    """
+    :param text - *, a value, a range a-b, a step */n, a-b/n or a/n, comma separated
+
+    :return frozenset of the matching values
+    """
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"Invalid step: {text}")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if not low <= start <= end <= high:
+            raise ValueError(f"Out of range {low}-{high}: {text}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronRule:
+    """
+    Cron expression in local time, minute hour day month weekday with an
+    optional seconds field in front, e.g. '*/30 * * * * *' every :00 and :30.
+    Like cron, when both day and weekday are restricted either one matches.
+
+    :param expression - 5 or 6 fields
+    :param name - reported in the statistics, the expression if empty
+    """
+    def __init__(self, expression, name=''):
+        fields = expression.split()
+        if len(fields) == 5:
+            fields.insert(0, '0')
+        if len(fields) != 6:
+            raise ValueError(f"Invalid cron expression: {expression}")
+        try:
+            parsed = [parse_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELDS)]
+        except ValueError as ex:
+            raise ValueError(f"Invalid cron expression: {expression} ({ex})")
+        self.seconds, self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self.any_day = fields[3] == '*'
+        self.any_weekday = fields[5] == '*'
+        self.name = name or expression
+
+    def day_matches(self, moment):
+        day = moment.day in self.days
+        # Python counts from Monday, cron from Sunday
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, after):
+        """:return the first matching instant (epoch seconds) strictly after after"""
+        moment = datetime.datetime.fromtimestamp(int(after) + 1)
+        limit = moment + datetime.timedelta(days=5 * 366)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0, second=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(moment):
+                moment = moment.replace(hour=0, minute=0, second=0) + datetime.timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0, second=0) + datetime.timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment = moment.replace(second=0) + datetime.timedelta(minutes=1)
+            elif moment.second not in self.seconds:
+                later = [second for second in self.seconds if second > moment.second]
+                if later:
+                    moment = moment.replace(second=min(later))
+                else:
+                    moment = moment.replace(second=0) + datetime.timedelta(minutes=1)
+            else:
+                instant = time.mktime(moment.timetuple())
+                # A repeated hour when the clocks go back can map before after
+                if instant > after:
+                    return instant
+                moment += datetime.timedelta(seconds=1)
+        raise ValueError(f"{self.name} never fires")
+
+
+class IntervalRule:
+    """
+    Every period seconds, aligned to local midnight: every 30 fires at :00 and
+    :30 of every minute on every camera with a synchronised clock. A period
+    that doesn't divide a day starts over at midnight. 0 fires again as soon as
+    the previous capture is done.
+
+    :param period - seconds
+    :param name - reported in the statistics, 'every <period>' if empty
+    """
+    def __init__(self, period, name=''):
+        if period < 0:
+            raise ValueError(f"Invalid period: {period}")
+        self.period = period
+        self.name = name or f'every {period}'
+
+    def next_after(self, after):
+        """:return the first aligned instant (epoch seconds) strictly after after, after itself for period 0"""
+        if self.period == 0:
+            return after
+        day = datetime.datetime.fromtimestamp(after).replace(hour=0, minute=0, second=0, microsecond=0)
+        midnight = time.mktime(day.timetuple())
+        next_midnight = time.mktime((day + datetime.timedelta(days=1)).timetuple())
+        instant = midnight + ((after - midnight) // self.period + 1) * self.period
+        return min(instant, next_midnight)
+
+
+def parse_schedule(spec, default_period=0):
+    """
+    :param spec - ; separated rules, each a cron expression or every <seconds>,
+                  optionally named, e.g. day=*/30 * 6-20 * * *; night=0 */10 21-23,0-5 * * *
+    :param default_period - seconds of the IntervalRule used when spec is empty
+
+    :return list of CronRule and IntervalRule
+    """
+    rules = []
+    for item in spec.split(';'):
+        if item.strip() == '':
+            continue
+        name, _, expression = item.rpartition('=')
+        expression = expression.strip()
+        if expression.startswith('every'):
+            period = expression[len('every'):].strip()
+            if not period.isnumeric():
+                raise ValueError(f"Invalid interval: {expression}")
+            rules.append(IntervalRule(int(period), name.strip()))
+        else:
+            rules.append(CronRule(expression, name.strip()))
+    if not rules:
+        rules.append(IntervalRule(default_period))
+    return rules
+
+
+class CaptureScheduler:
+    """
+    Runs job at the instants of a set of rules, on its own thread.
+
+    The next instant is computed on the wall clock and waited for as a
+    monotonic deadline, so the period doesn't grow by the capture and upload
+    time. Jobs run one at a time: a job that runs past the next instants is an
+    overrun, the passed instants are counted as missed and skipped rather than
+    run late back to back.
+
+    :param rules - see parse_schedule()
+    :param job - callable taking the name of the rule that fired
+    :param wall - wall clock
+    :param monotonic - monotonic clock
+    :param wait - callable waiting up to the given seconds, True if stopped; stop() by default
+    :param history - jobs the lateness statistics cover
+    """
+    def __init__(self, rules, job, wall=time.time, monotonic=time.monotonic, wait=None, history=100):
+        self.rules = rules
+        self.job = job
+        self.wall = wall
+        self.monotonic = monotonic
+        self.stopped = Event()
+        self.wait = wait if wait is not None else self.stopped.wait
+        self.thread = None
+        self.next_due = None
+        self.next_rule = None
+        self.lateness = deque(maxlen=history)
+        self.fired = 0
+        self.counts = {rule.name: 0 for rule in rules}
+        self.overruns = 0
+        self.missed = 0
+        self.last_duration = None
+        self.max_duration = 0.0
+
+    def next_instant(self, after):
+        """:return (instant, rule) - the earliest instant of the rules after after"""
+        return min(((rule.next_after(after), rule) for rule in self.rules), key=lambda item: item[0])
+
+    def run_once(self):
+        """
+        Wait for the next instant and run the job, on the calling thread.
+
+        :return False if stop() was called while waiting
+        """
+        if self.next_due is None:
+            self.next_due, self.next_rule = self.next_instant(self.wall())
+        due, rule = self.next_due, self.next_rule
+        deadline = self.monotonic() + (due - self.wall())
+        while True:
+            remaining = deadline - self.monotonic()
+            if remaining <= 0:
+                break
+            if self.wait(min(remaining, RESYNC)):
+                return False
+            if remaining > RESYNC:
+                deadline = self.monotonic() + (due - self.wall())
+
+        start = self.monotonic()
+        self.lateness.append(start - deadline)
+        try:
+            self.job(rule.name)
+        except Exception as ex:
+            print("Error in scheduled capture.")
+            print(ex)
+        self.last_duration = self.monotonic() - start
+        self.max_duration = max(self.max_duration, self.last_duration)
+        self.fired += 1
+        self.counts[rule.name] += 1
+
+        now = self.wall()
+        missed = 0
+        instant = due
+        while missed < 100000:
+            following, _ = self.next_instant(instant)
+            if following <= instant or following > now:
+                break
+            missed += 1
+            instant = following
+        if missed:
+            self.overruns += 1
+            self.missed += missed
+            logging.warning(f"Scheduled capture took {self.last_duration:.1f} s, {missed} instants skipped")
+        self.next_due, self.next_rule = self.next_instant(now)
+        return True
+
+    def _run(self):
+        while self.run_once():
+            pass
+
+    def start(self):
+        self.thread = Thread(target=self._run, name='scheduler', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def stats(self):
+        lateness = list(self.lateness)
+        return {
+            'fired': self.fired,
+            'counts': dict(self.counts),
+            'overruns': self.overruns,
+            'missed': self.missed,
+            'lateness_ms': {
+                'last': round(lateness[-1] * 1000, 3) if lateness else None,
+                'mean': round(statistics.fmean(lateness) * 1000, 3) if lateness else None,
+                'max': round(max(lateness) * 1000, 3) if lateness else None,
+            },
+            'jitter_ms': round(statistics.pstdev(lateness) * 1000, 3) if len(lateness) > 1 else None,
+            'last_duration': round(self.last_duration, 3) if self.last_duration is not None else None,
+            'max_duration': round(self.max_duration, 3),
+            'next_due': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.next_due)) if self.next_due else None,
+            'next_rule': self.next_rule.name if self.next_rule else None,
+        }
@@ -0,0 +1,198 @@
+import time
+from threading import Event, Lock, Thread
+
+from paramiko import AutoAddPolicy, SSHClient
+
+
+def connect_sftp(server, port, username, password, timeout=10):
+    """:return (SSHClient, SFTPClient) - a new authenticated connection"""
+    ssh = SSHClient()
+    ssh.set_missing_host_key_policy(AutoAddPolicy())
+    try:
+        ssh.connect(hostname=server, port=port, username=username, password=password, timeout=timeout,
+                    banner_timeout=timeout, auth_timeout=timeout, look_for_keys=False, allow_agent=False)
+        return ssh, ssh.open_sftp()
+    except Exception:
+        ssh.close()
+        raise
+
+
+class PooledConnection:
+    def __init__(self, key, ssh, sftp, now):
+        self.key = key
+        self.ssh = ssh
+        self.sftp = sftp
+        self.created = now
+        self.last_used = now
+        self.uses = 0
+
+    def active(self):
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        try:
+            self.sftp.close()
+        finally:
+            self.ssh.close()
+
+
+class SftpPool:
+    """
+    Open SFTP connections kept per (server, port, username) and reused across
+    uploads, so an upload doesn't pay for the TCP connect, key exchange and
+    authentication every time.
+
+    The transport sends a keepalive every keepalive seconds so NAT and
+    firewalls don't drop an idle connection. A connection idle for more than
+    keepalive seconds is checked with a round trip before it's handed out, and
+    one that failed during use is discarded and the operation tried once more
+    on a new connection. Connections idle for idle_timeout seconds are closed.
+
+    :param keepalive - seconds between keepalives, and idle seconds before the check
+    :param idle_timeout - seconds an unused connection stays open
+    :param max_idle - open connections kept per key, one per upload worker is enough
+    :param connect - callable (server, port, username, password) -> (SSHClient, SFTPClient)
+    :param clock - monotonic clock
+    """
+    def __init__(self, keepalive=30, idle_timeout=300, max_idle=4, connect=connect_sftp, clock=time.monotonic):
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.connect = connect
+        self.clock = clock
+        self.idle = {}
+        self.lock = Lock()
+        self.closing = Event()
+        self.reaper = None
+        self.in_use = 0
+        self.connects = 0
+        self.reuses = 0
+        self.reconnects = 0
+        self.failed_checks = 0
+        self.idle_closed = 0
+        self.connect_time = 0.0
+
+    def _open(self, key, password):
+        start = self.clock()
+        ssh, sftp = self.connect(*key, password)
+        now = self.clock()
+        if self.keepalive:
+            ssh.get_transport().set_keepalive(self.keepalive)
+        with self.lock:
+            self.connects += 1
+            self.connect_time += now - start
+            if self.reaper is None and self.idle_timeout and not self.closing.is_set():
+                self.reaper = Thread(target=self._reap, name='sftp-pool', daemon=True)
+                self.reaper.start()
+        return PooledConnection(key, ssh, sftp, now)
+
+    def _acquire(self, key, password):
+        """:return (connection, True if it was reused)"""
+        while True:
+            with self.lock:
+                connections = self.idle.get(key)
+                connection = connections.pop() if connections else None
+            if connection is None:
+                return self._open(key, password), False
+            healthy = connection.active()
+            if healthy and self.clock() - connection.last_used > self.keepalive:
+                try:
+                    connection.sftp.normalize('.')
+                except Exception:
+                    healthy = False
+            if healthy:
+                with self.lock:
+                    self.reuses += 1
+                return connection, True
+            with self.lock:
+                self.failed_checks += 1
+            connection.close()
+
+    def _release(self, connection):
+        connection.last_used = self.clock()
+        connection.uses += 1
+        with self.lock:
+            connections = self.idle.setdefault(connection.key, [])
+            if not self.closing.is_set() and len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def call(self, server, port, username, password, operation):
+        """
+        Run operation on a pooled connection, it starts in the login directory.
+
+        :param operation - callable taking the SFTPClient, raises on failure
+
+        :return what operation returned
+        """
+        key = (server, int(port), username)
+        connection, reused = self._acquire(key, password)
+        with self.lock:
+            self.in_use += 1
+        try:
+            try:
+                connection.sftp.chdir(None)
+                result = operation(connection.sftp)
+            except Exception:
+                # A server side error (missing permission, full disk) leaves the connection usable
+                if connection.active():
+                    self._release(connection)
+                    raise
+                connection.close()
+                if not reused:
+                    raise
+                # Dropped while idle in a way the check didn't catch, once more on a new one
+                with self.lock:
+                    self.reconnects += 1
+                connection = self._open(key, password)
+                try:
+                    connection.sftp.chdir(None)
+                    result = operation(connection.sftp)
+                except Exception:
+                    connection.close()
+                    raise
+            self._release(connection)
+            return result
+        finally:
+            with self.lock:
+                self.in_use -= 1
+
+    def reap(self):
+        """Close the connections idle for more than idle_timeout, :return how many"""
+        expired = []
+        now = self.clock()
+        with self.lock:
+            for key, connections in self.idle.items():
+                keep = [connection for connection in connections if now - connection.last_used <= self.idle_timeout]
+                expired.extend(connection for connection in connections if connection not in keep)
+                self.idle[key] = keep
+            self.idle_closed += len(expired)
+        for connection in expired:
+            connection.close()
+        return len(expired)
+
+    def _reap(self):
+        while not self.closing.wait(max(min(self.idle_timeout, self.keepalive or self.idle_timeout) / 2, 0.05)):
+            self.reap()
+
+    def close(self):
+        """Close every idle connection, the ones in use are closed when they're released."""
+        self.closing.set()
+        with self.lock:
+            connections = [connection for idle in self.idle.values() for connection in idle]
+            self.idle.clear()
+        for connection in connections:
+            connection.close()
+        if self.reaper is not None:
+            self.reaper.join()
+
+    def stats(self):
+        with self.lock:
+            return {'open': sum(len(connections) for connections in self.idle.values()) + self.in_use,
+                    'idle': sum(len(connections) for connections in self.idle.values()),
+                    'in_use': self.in_use, 'connects': self.connects, 'reuses': self.reuses,
+                    'reconnects': self.reconnects, 'failed_checks': self.failed_checks,
+                    'idle_closed': self.idle_closed,
+                    'average_connect': round(self.connect_time / self.connects, 3) if self.connects else None}
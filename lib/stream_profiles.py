@@ -0,0 +1,195 @@
+import logging
+from collections import namedtuple
+from threading import Thread, Event
+
+import numpy as np
+import simplejpeg
+from PIL import Image
+
+from lib.quality_ladder import QualityLadder
+from lib.streaming_output import StreamingOutput
+
+# A stream the server offers, size is None for the full sensor resolution.
+StreamProfile = namedtuple('StreamProfile', ['name', 'size', 'quality'])
+
+FULL_PROFILE = 'full'
+
+
+def parse_stream_profiles(spec):
+    """
+    Parse the stream_profiles config value.
+
+    Example: full:full:100,high:1280x720:85,low:640x360:70
+
+    :param spec - comma separated name:size:quality entries, size is WIDTHxHEIGHT
+                  or full for the full resolution stream
+
+    :return list of StreamProfile, the full profile first
+    """
+    profiles = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if entry == '':
+            continue
+        name, size, quality = entry.split(':')
+        if size == 'full':
+            size = None
+        else:
+            width, height = size.lower().split('x')
+            # YUV420 planes need even dimensions
+            size = (int(width) // 2 * 2, int(height) // 2 * 2)
+        profiles.append(StreamProfile(name, size, int(quality)))
+    if not any(profile.size is None for profile in profiles):
+        profiles.insert(0, StreamProfile(FULL_PROFILE, None, 100))
+    profiles.sort(key=lambda profile: profile.size is not None)
+    return profiles
+
+
+def split_yuv420(array, width, height):
+    """
+    Split a YUV420 array as returned by Picamera2 (height * 3 / 2 rows of stride
+    bytes) into its Y, U and V planes without copying.
+    """
+    stride = array.shape[1]
+    y = array[:height, :width]
+    u = array[height:height + height // 4].reshape(height // 2, stride // 2)[:, :width // 2]
+    v = array[height + height // 4:height + height // 2].reshape(height // 2, stride // 2)[:, :width // 2]
+    return y, u, v
+
+
+def resize_plane(plane, size):
+    if (plane.shape[1], plane.shape[0]) == size:
+        return np.ascontiguousarray(plane)
+    return np.asarray(Image.fromarray(plane).resize(size, Image.BILINEAR))
+
+
+class ProfileEncoder:
+    """
+    Software JPEG encoder for one reduced resolution profile.
+
+    Frames are submitted from the camera thread and encoded on the encoder's own
+    thread. Only the newest submitted frame is kept, if the encoder is still busy
+    the older frame is replaced rather than queued.
+
+    :param profile - StreamProfile with a size
+    :param output - StreamingOutput the encoded frames are written to
+    """
+    def __init__(self, profile, output=None):
+        self.profile = profile
+        self.output = output if output is not None else StreamingOutput()
+        self.pending = None
+        self.ready = Event()
+        self.encoded = 0
+        self.skipped = 0
+        self.thread = Thread(target=self._run, name=f'profile-{profile.name}', daemon=True)
+        self.thread.start()
+
+    def active(self):
+        """The profile is only encoded while somebody is watching it."""
+        return self.output.viewer_count() > 0
+
+    def submit(self, planes, timestamp=None):
+        """
+        :param planes - (Y, U, V) planes of a YUV420 frame, not modified
+        :param timestamp - capture time of the frame
+        """
+        if self.pending is not None:
+            self.skipped += 1
+        self.pending = (planes, timestamp)
+        self.ready.set()
+
+    def encode(self, y, u, v):
+        width, height = self.profile.size
+        y = resize_plane(y, (width, height))
+        u = resize_plane(u, (width // 2, height // 2))
+        v = resize_plane(v, (width // 2, height // 2))
+        return simplejpeg.encode_jpeg_yuv_planes(y, u, v, quality=self.profile.quality)
+
+    def _run(self):
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            pending, self.pending = self.pending, None
+            if pending is None:
+                continue
+            planes, timestamp = pending
+            try:
+                self.output.publish(self.encode(*planes), timestamp)
+                self.encoded += 1
+            except Exception as ex:
+                print(f"Error encoding stream profile {self.profile.name}")
+                print(ex)
+
+
+class Simulcast:
+    """
+    Serves a set of stream profiles from a single camera.
+
+    The full profile is encoded by the Picamera2 encoder from the main stream.
+    The reduced profiles are scaled from the lores stream, which is configured at
+    the largest reduced size, and encoded in software, each profile only while it
+    has viewers.
+
+    :param profiles - list of StreamProfile, see parse_stream_profiles()
+    :param adaptive_qualities - qualities of the lib.quality_ladder.QualityLadder
+                                built for every reduced profile, none if empty
+    """
+    def __init__(self, profiles, adaptive_qualities=()):
+        self.profiles = {profile.name: profile for profile in profiles}
+        self.outputs = {}
+        self.encoders = []
+        self.ladders = {}
+        for profile in profiles:
+            if profile.size is None:
+                self.full = profile
+                self.outputs[profile.name] = StreamingOutput()
+            else:
+                encoder = ProfileEncoder(profile)
+                self.encoders.append(encoder)
+                self.outputs[profile.name] = encoder.output
+                if adaptive_qualities:
+                    ladder = QualityLadder(encoder, adaptive_qualities)
+                    self.ladders[profile.name] = ladder
+                    self.encoders.extend(ladder.rungs[1:])
+
+    @property
+    def full_output(self):
+        return self.outputs[self.full.name]
+
+    def stats(self):
+        """Viewers and encoder counters of every profile, rung occupancy of the ladders."""
+        stats = {}
+        for name, output in self.outputs.items():
+            stats[name] = {'viewers': output.viewer_count(), 'sequence': output.sequence}
+        for encoder in self.encoders:
+            if encoder.output is self.outputs.get(encoder.profile.name):
+                stats[encoder.profile.name].update(encoded=encoder.encoded, skipped=encoder.skipped)
+        for name, ladder in self.ladders.items():
+            stats[name]['ladder'] = {
+                'occupancy': ladder.occupancy(),
+                'encoded': {rung.profile.quality: rung.encoded for rung in ladder.rungs},
+                'switches_down': ladder.switches_down,
+                'switches_up': ladder.switches_up,
+            }
+        return stats
+
+    def lores_size(self):
+        """Size of the lores stream, None when there are no reduced profiles."""
+        if not self.encoders:
+            return None
+        return max((encoder.profile.size for encoder in self.encoders), key=lambda size: size[0] * size[1])
+
+    def on_request(self, request):
+        """Picamera2 post_callback, hands the lores frame to the profiles that have viewers."""
+        active = [encoder for encoder in self.encoders if encoder.active()]
+        if not active:
+            return
+        try:
+            width, height = self.lores_size()
+            # make_array() copies, the request buffer is recycled after the callback
+            planes = split_yuv420(request.make_array('lores'), width, height)
+        except Exception as ex:
+            logging.debug(f"Couldn't read lores frame: {ex}")
+            return
+        for encoder in active:
+            encoder.submit(planes)
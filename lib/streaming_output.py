@@ -0,0 +1,304 @@
+import io
+import logging
+import os
+import time
+from collections import namedtuple
+from threading import Event, Lock
+
+# One published (encoded) frame. The sequence number increases by one for every
+# frame written to a StreamingOutput and is never reused. header holds the
+# multipart/x-mixed-replace part header for data, it is built once per frame and
+# shared by every client.
+Frame = namedtuple('Frame', ['sequence', 'timestamp', 'data', 'header'])
+
+BOUNDARY = 'FRAME'
+FRAME_TRAILER = b'\r\n'
+
+# Longest time a /latest.jpg?after=<seq> request waits for a newer frame
+LONG_POLL_TIMEOUT = 30
+
+
+def multipart_header(length, content_type='image/jpeg'):
+    """Part header that precedes a frame of the given length in the MJPEG stream."""
+    return (f'--{BOUNDARY}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {length}\r\n\r\n').encode('ascii')
+
+
+class StreamingOutput(io.BufferedIOBase):
+    """
+    Keeps a small ring of the most recently encoded frames.
+
+    The encoder thread calls write() for every frame, the frame is stored in the
+    next slot of the ring and the clients that are waiting are woken through
+    their own Event, so the encoder never contends with the viewers on a
+    shared lock.
+
+    :param size - number of recent frames that are kept in the ring
+    """
+    def __init__(self, size=8):
+        self.size = size
+        # Sequence numbers restart with the process, the epoch keeps ETags unique
+        self.epoch = os.urandom(4).hex()
+        self.slots = [None] * size
+        self.sequence = 0
+        self.frame = None
+        self.clients = ()
+        self.clients_lock = Lock()
+
+    def write(self, buf):
+        self.publish(buf)
+        return len(buf)
+
+    def publish(self, buf, timestamp=None):
+        """
+        Store a new frame in the ring and wake the waiting clients.
+
+        :param buf - encoded frame
+        :param timestamp - capture time of the frame, defaults to now
+
+        :return Frame
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        if not isinstance(buf, bytes):
+            # Encoders may hand over a view of a buffer that they reuse
+            buf = bytes(buf)
+        sequence = self.sequence + 1
+        frame = Frame(sequence, timestamp, buf, multipart_header(len(buf)))
+        # The slot is filled before the sequence is advanced so that a reader
+        # never sees a sequence number whose frame isn't stored yet.
+        self.slots[sequence % self.size] = frame
+        self.frame = buf
+        self.sequence = sequence
+        logging.debug(f"New frame written: {sequence} {len(buf)} bytes")
+        for client in self.clients:
+            client.notify(frame)
+        return frame
+
+    def get(self, sequence):
+        """Return the frame with the given sequence number or None if it left the ring."""
+        frame = self.slots[sequence % self.size]
+        if frame is not None and frame.sequence == sequence:
+            return frame
+        return None
+
+    def latest(self):
+        """Return the newest frame or None if nothing has been written yet."""
+        sequence = self.sequence
+        if sequence == 0:
+            return None
+        return self.get(sequence)
+
+    def etag(self, frame):
+        """Strong ETag of a frame of this output."""
+        return f'"{self.epoch}-{frame.sequence}"'
+
+    def wait_for_frame(self, after, timeout=LONG_POLL_TIMEOUT):
+        """
+        Wait for a frame newer than the given sequence number.
+
+        :param after - sequence number the caller already has
+        :param timeout - seconds to wait
+
+        :return Frame or None if no newer frame was written in time
+        """
+        if after > self.sequence:
+            # A sequence number from before a restart, anything we have is newer
+            after = 0
+        client = StreamClient(self)
+        client.cursor = after
+        self.register(client)
+        try:
+            return client.next_frame(timeout)
+        finally:
+            client.close()
+
+    def viewer_count(self):
+        """Number of viewers that are currently watching this output."""
+        return sum(client.viewers for client in self.clients)
+
+    def register(self, client=None):
+        """
+        Add a client that is notified of every frame written.
+
+        :param client - object with a notify(frame) method and a viewers count,
+                        a new StreamClient that starts at the next frame
+                        written if not given
+
+        :return the registered client
+        """
+        if client is None:
+            client = StreamClient(self)
+        with self.clients_lock:
+            # Copy on write, publish() iterates the tuple without taking the lock
+            self.clients = self.clients + (client,)
+        return client
+
+    def unregister(self, client):
+        with self.clients_lock:
+            self.clients = tuple(c for c in self.clients if c is not client)
+
+
+def etag_matches(if_none_match, etag):
+    """True if the If-None-Match header value matches the ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def parse_after(args):
+    """
+    Read the after query parameter of a /latest.jpg request.
+
+    :return int or None if not given
+
+    :raises ValueError if it isn't a sequence number
+    """
+    value = args.get('after')
+    if value is None or value == '':
+        return None
+    if not value.isnumeric():
+        raise ValueError(f"Invalid after: {value}")
+    return int(value)
+
+
+def snapshot_headers(output, frame):
+    """Response headers of a /latest.jpg reply."""
+    return {'ETag': output.etag(frame),
+            'Cache-Control': 'no-cache',
+            'X-Frame-Sequence': str(frame.sequence)}
+
+
+class FramePacer:
+    """
+    Limits the frame rate and bandwidth of a single viewer.
+
+    :param fps - maximum frames per second, None for every frame
+    :param max_kbps - maximum kilobits per second, None for no limit
+    """
+    def __init__(self, fps=None, max_kbps=None):
+        self.min_interval = 1.0 / fps if fps else 0.0
+        self.max_kbps = max_kbps
+        self.next_due = 0.0
+
+    @property
+    def limited(self):
+        return self.min_interval > 0 or bool(self.max_kbps)
+
+    def due(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return now >= self.next_due
+
+    def sent(self, size, now=None):
+        """Schedule the next frame after a frame of size bytes was sent."""
+        if now is None:
+            now = time.monotonic()
+        interval = self.min_interval
+        if self.max_kbps:
+            interval = max(interval, size * 8 / (self.max_kbps * 1000))
+        self.next_due = now + interval
+
+
+def parse_rate_args(args):
+    """
+    Read the fps and max_kbps query parameters of a stream request.
+
+    :param args - mapping of query parameters
+
+    :return FramePacer
+
+    :raises ValueError if a value isn't a positive number
+    """
+    limits = {}
+    for key in ('fps', 'max_kbps'):
+        value = args.get(key)
+        if value is None or value == '':
+            limits[key] = None
+            continue
+        limits[key] = float(value)
+        if limits[key] <= 0:
+            raise ValueError(f"Invalid {key}: {value}")
+    return FramePacer(limits['fps'], limits['max_kbps'])
+
+
+class StreamClient:
+    """
+    Cursor of a single viewer into a StreamingOutput.
+
+    A client that falls behind skips straight to the newest frame, the frames it
+    skipped are counted in dropped. With a pacer the client is only woken for
+    frames it is due to send, the frames in between are counted in decimated.
+
+    :param output - StreamingOutput to read from
+    :param pacer - optional FramePacer limiting the frame rate
+    """
+    viewers = 1
+
+    def __init__(self, output, pacer=None):
+        self.output = output
+        self.pacer = pacer if pacer is not None else FramePacer()
+        self.cursor = output.sequence
+        self.event = Event()
+        self.sent = 0
+        self.dropped = 0
+        self.decimated = 0
+        self._decimated = 0
+
+    def notify(self, frame):
+        if self.pacer.due():
+            self.event.set()
+        else:
+            self._decimated += 1
+
+    def next_frame(self, timeout=None):
+        """
+        Wait for a frame newer than the last one returned.
+
+        :param timeout - seconds to wait, None waits forever
+
+        :return Frame or None on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.event.clear()
+            now = time.monotonic()
+            wait = None if deadline is None else deadline - now
+            if not self.pacer.due(now):
+                # Sleep until the frame is due, notify() doesn't wake us before
+                wait = self.pacer.next_due - now if wait is None else min(wait, self.pacer.next_due - now)
+                if self.event.wait(wait) or deadline is None or time.monotonic() < deadline:
+                    continue
+                return None
+            sequence = self.output.sequence
+            if sequence > self.cursor:
+                frame = self.output.get(sequence)
+                if frame is None:
+                    # Overwritten while we were reading it, try the newer one
+                    continue
+                skipped = sequence - self.cursor - 1
+                decimated = min(self._decimated, skipped)
+                self.decimated += decimated
+                self.dropped += skipped - decimated
+                self._decimated = 0
+                self.cursor = sequence
+                self.sent += 1
+                if self.pacer.limited:
+                    self.pacer.sent(len(frame.data), now)
+                return frame
+            if wait is not None and wait <= 0:
+                return None
+            if not self.event.wait(wait):
+                return None
+
+    def close(self):
+        self.output.unregister(self)
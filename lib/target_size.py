@@ -0,0 +1,142 @@
+import io
+import logging
+import math
+from collections import deque, namedtuple
+from statistics import median
+
+import numpy as np
+import simplejpeg
+from PIL import Image
+
+# fits is False when not even the lowest quality at the smallest scale met the budget
+TargetResult = namedtuple('TargetResult', ['data', 'quality', 'scale', 'encodes', 'fits'])
+
+
+def encode_jpeg(image, quality):
+    """
+    :param image - PIL Image or RGB/RGBX uint8 array
+    :param quality - JPEG quality
+
+    :return bytes
+    """
+    if isinstance(image, np.ndarray):
+        colorspace = 'RGBX' if image.shape[2] == 4 else 'RGB'
+        return simplejpeg.encode_jpeg(image, quality=quality, colorspace=colorspace)
+    buffer = io.BytesIO()
+    image.save(buffer, format='jpeg', quality=quality)
+    return buffer.getvalue()
+
+
+def scale_image(image, scale):
+    """Downscaled copy of a PIL Image or array, the array type is kept."""
+    if isinstance(image, np.ndarray):
+        height, width = image.shape[:2]
+        size = (max(int(width * scale), 1), max(int(height * scale), 1))
+        return np.asarray(Image.fromarray(np.ascontiguousarray(image[:, :, :3])).resize(size, Image.BILINEAR))
+    size = (max(int(image.width * scale), 1), max(int(image.height * scale), 1))
+    return image.resize(size, Image.BILINEAR)
+
+
+class TargetSizeEncoder:
+    """
+    Encodes JPEGs to a file size budget.
+
+    The highest quality that fits is found by bisection, in memory. The first
+    quality tried is the median of the qualities chosen for the last frames at
+    the same scale and its neighbour is probed next, so a steady scene takes two
+    encodes. Only when min_quality doesn't fit the image is downscaled, by as
+    many scale_step steps as the size at min_quality suggests (size ~ pixel
+    count), down to min_scale. After a downscaled frame the next search starts
+    by checking min_quality at full size instead of bisecting down to it.
+
+    :param min_quality - lowest quality the search goes to
+    :param max_quality - highest quality, also used when there's no budget
+    :param min_scale - smallest downscale factor, 1 disables resizing
+    :param scale_step - factor applied per resize step
+    :param history - number of recent (scale, quality) results the search is seeded from
+    """
+    def __init__(self, min_quality=10, max_quality=100, min_scale=0.5, scale_step=0.75, history=8):
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_scale = min_scale
+        self.scale_step = scale_step
+        self.recent = deque(maxlen=history)
+        self.encodes = 0
+
+    def seed(self, scale):
+        qualities = [quality for recent_scale, quality in self.recent if recent_scale == scale]
+        if not qualities:
+            return None
+        return int(median(qualities))
+
+    def _search(self, image, max_bytes, seed, high):
+        """
+        :return (quality, data) of the highest quality up to high that fits or None,
+                encode count, the smallest encode
+        """
+        low = self.min_quality
+        best = None
+        encodes = 0
+        smallest = None
+        quality = seed
+        while low <= high:
+            if quality is None or not low <= quality <= high:
+                quality = (low + high + 1) // 2
+            data = encode_jpeg(image, quality)
+            encodes += 1
+            if smallest is None or len(data) < len(smallest):
+                smallest = data
+            probe = quality == seed
+            if len(data) <= max_bytes:
+                best = (quality, data)
+                low = quality + 1
+                # The seed fits, if the next quality doesn't we're done
+                quality = quality + 1 if probe else None
+            else:
+                high = quality - 1
+                quality = quality - 1 if probe else None
+        return best, encodes, smallest
+
+    def encode(self, image, max_bytes=0, quality=None):
+        """
+        :param image - PIL Image or RGB/RGBX uint8 array
+        :param max_bytes - size budget, 0 for no budget
+        :param quality - quality cap, max_quality if None
+
+        :return TargetResult
+        """
+        max_quality = self.max_quality if quality is None else min(int(quality), self.max_quality)
+        if max_bytes <= 0:
+            self.encodes += 1
+            return TargetResult(encode_jpeg(image, max_quality), max_quality, 1.0, 1, True)
+
+        scale = 1.0
+        scaled = image
+        total = 0
+        best = None
+        if self.recent and self.recent[-1][0] < 1.0:
+            # The last frame had to be downscaled, check whether this one does too
+            smallest = encode_jpeg(image, self.min_quality)
+            total += 1
+            if len(smallest) <= max_bytes:
+                best, encodes, smallest = self._search(image, max_bytes, self.seed(scale), max_quality)
+                total += encodes
+        else:
+            best, encodes, smallest = self._search(image, max_bytes, self.seed(scale), max_quality)
+            total += encodes
+        while best is None and scale > self.min_scale:
+            # Enough steps for the min_quality size to fit if it scales with the pixel count
+            steps = max(math.ceil(math.log(max_bytes / len(smallest)) / (2 * math.log(self.scale_step))), 1)
+            scale = max(scale * self.scale_step ** steps, self.min_scale)
+            scaled = scale_image(image, scale)
+            best, encodes, smallest = self._search(scaled, max_bytes, self.seed(scale), max_quality)
+            total += encodes
+        self.encodes += total
+
+        if best is None:
+            logging.warning(f"JPEG doesn't fit {max_bytes // 1024} KB, {len(smallest) // 1024} KB at quality "
+                            f"{self.min_quality} and scale {scale:.2f}")
+            return TargetResult(smallest, self.min_quality, scale, total, False)
+        quality, data = best
+        self.recent.append((scale, quality))
+        return TargetResult(data, quality, scale, total, True)
@@ -0,0 +1,219 @@
+import io
+import json
+import logging
+import os
+import queue
+import time
+from fractions import Fraction
+from threading import Thread
+
+import av
+from PIL import Image
+
+
+def decode_scaled(jpeg, size):
+    """
+    Decode a JPEG straight to (about) size with the decoder's DCT scaling
+    (draft mode), then resize the remainder.
+
+    :param jpeg - JPEG bytes or file name
+    :param size - (width, height)
+
+    :return RGB PIL Image of size
+    """
+    image = Image.open(io.BytesIO(jpeg) if isinstance(jpeg, (bytes, bytearray)) else jpeg)
+    # Decodes at 1/2, 1/4 or 1/8 scale, the smallest that is still at least size
+    image.draft('RGB', size)
+    image = image.convert('RGB')
+    if image.size != size:
+        image = image.resize(size, Image.BILINEAR)
+    return image
+
+
+def timelapse_size(source_size, width):
+    """Output size for a source size at width, even dimensions for YUV420."""
+    source_width, source_height = source_size
+    width = min(width, source_width) // 2 * 2
+    return width, max(round(source_height * width / source_width) // 2 * 2, 2)
+
+
+class DailyTimelapse:
+    """
+    Appends captures to today's timelapse video as they are taken.
+
+    Every day gets one MPEG-TS file, written in segments of segment_frames
+    frames. A segment is a complete transport stream appended to the file, TS
+    streams can simply be concatenated, so earlier frames are never re-encoded.
+    After every segment the file length, the frame count and the capture time of
+    the last frame are written to a JSON sidecar. On restart the file is cut back
+    to the last committed length and the captures since the last committed frame
+    can be added again with catch_up().
+
+    Frames are decoded (draft mode) and encoded on the timelapse's own thread,
+    submit() only queues the JPEG.
+
+    :param folder - folder of the videos
+    :param name - file name prefix, the date is appended
+    :param width - video width, the height follows the first frame's aspect ratio
+    :param fps - playback frame rate
+    :param codec - PyAV/FFmpeg encoder
+    :param segment_frames - frames per committed segment
+    :param options - encoder options
+    """
+    def __init__(self, folder, name='timelapse', width=1280, fps=30, codec='libx264', segment_frames=30,
+                 options=None):
+        self.folder = folder
+        self.name = name
+        self.width = width
+        self.fps = fps
+        self.codec = codec
+        self.segment_frames = segment_frames
+        self.options = options if options is not None else {'preset': 'veryfast', 'bf': '0'}
+        self.day = None
+        self.state = None
+        self.file = None
+        self.container = None
+        self.stream = None
+        self.segment = 0
+        self.appended = 0
+        self.queue = queue.Queue(maxsize=256)
+        self.thread = None
+        os.makedirs(folder, exist_ok=True)
+
+    def paths(self, day):
+        base = os.path.join(self.folder, f'{self.name}_{day}')
+        return base + '.ts', base + '.json'
+
+    def _open_day(self, day):
+        """Load the day's sidecar and cut the video back to its last committed segment."""
+        self._commit()
+        video, sidecar = self.paths(day)
+        state = {'bytes': 0, 'frames': 0, 'size': None, 'last_timestamp': None}
+        if os.path.exists(sidecar):
+            with open(sidecar) as f:
+                state.update(json.load(f))
+        if os.path.exists(video) and os.path.getsize(video) != state['bytes']:
+            logging.info(f"Timelapse {video}: dropping {os.path.getsize(video) - state['bytes']} uncommitted bytes")
+            with open(video, 'r+b') as f:
+                f.truncate(state['bytes'])
+        self.day = day
+        self.state = state
+
+    def _save_state(self):
+        video, sidecar = self.paths(self.day)
+        self.state['bytes'] = os.path.getsize(video)
+        with open(sidecar + '.tmp', 'w') as f:
+            json.dump(self.state, f)
+        os.replace(sidecar + '.tmp', sidecar)
+
+    def _start_segment(self):
+        video, _ = self.paths(self.day)
+        self.file = open(video, 'ab')
+        self.container = av.open(self.file, 'w', format='mpegts')
+        self.stream = self.container.add_stream(self.codec, rate=self.fps)
+        self.stream.width, self.stream.height = self.state['size']
+        self.stream.pix_fmt = 'yuv420p'
+        self.stream.codec_context.time_base = Fraction(1, self.fps)
+        self.stream.codec_context.options = self.options
+        self.segment = 0
+
+    def _commit(self):
+        """Finish the open segment and record it in the sidecar."""
+        if self.container is None:
+            return
+        for packet in self.stream.encode(None):
+            self.container.mux(packet)
+        self.container.close()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.container = self.stream = self.file = None
+        self._save_state()
+
+    def append(self, jpeg, timestamp=None):
+        """
+        Encode one capture into the video of its day, on the calling thread.
+
+        :param jpeg - JPEG bytes or file name
+        :param timestamp - capture time, now if None
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        day = time.strftime('%Y%m%d', time.localtime(timestamp))
+        if day != self.day:
+            self._open_day(day)
+        if self.state['size'] is None:
+            with Image.open(io.BytesIO(jpeg) if isinstance(jpeg, (bytes, bytearray)) else jpeg) as image:
+                self.state['size'] = timelapse_size(image.size, self.width)
+        image = decode_scaled(jpeg, tuple(self.state['size']))
+
+        if self.container is None:
+            self._start_segment()
+        frame = av.VideoFrame.from_image(image)
+        # PTS continue from the earlier segments of the day
+        frame.pts = self.state['frames']
+        for packet in self.stream.encode(frame):
+            self.container.mux(packet)
+        self.state['frames'] += 1
+        self.state['last_timestamp'] = timestamp
+        self.appended += 1
+        self.segment += 1
+        if self.segment >= self.segment_frames:
+            self._commit()
+
+    def catch_up(self, paths):
+        """
+        Append the captures taken since the last committed frame, e.g. after a
+        restart. Only files of the current day are considered, by modification time.
+        Runs on the calling thread, see submit_catch_up() for the timelapse thread.
+
+        :param paths - JPEG file names
+
+        :return number of captures appended
+        """
+        today = time.strftime('%Y%m%d')
+        if self.day != today:
+            self._open_day(today)
+        last = self.state['last_timestamp'] or 0
+        pending = sorted((os.path.getmtime(path), path) for path in paths)
+        count = 0
+        for mtime, path in pending:
+            if mtime > last and time.strftime('%Y%m%d', time.localtime(mtime)) == today:
+                self.append(path, mtime)
+                count += 1
+        return count
+
+    def start(self):
+        self.thread = Thread(target=self._run, name='timelapse', daemon=True)
+        self.thread.start()
+        return self
+
+    def submit(self, jpeg, timestamp=None):
+        """Queue a capture for the timelapse thread, dropped if the queue is full."""
+        try:
+            self.queue.put_nowait((self.append, (jpeg, time.time() if timestamp is None else timestamp)))
+        except queue.Full:
+            logging.warning("Timelapse queue full, capture not added")
+
+    def submit_catch_up(self, paths):
+        """catch_up() on the timelapse thread, ahead of the captures submitted later."""
+        self.queue.put((self.catch_up, (list(paths),)))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            function, args = item
+            try:
+                function(*args)
+            except Exception as ex:
+                print("Error adding capture to the timelapse")
+                print(ex)
+
+    def close(self):
+        """Finish the open segment, queued captures are added first."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self._commit()
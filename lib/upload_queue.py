@@ -0,0 +1,128 @@
+import logging
+import time
+from collections import deque, namedtuple
+from threading import Condition, Event, Thread
+
+POLICIES = ('drop_oldest', 'newest_per_destination')
+
+# key - what the newest_per_destination policy compares, the remote file so only fixed names are replaced
+# name - local file name, for the logs
+UploadJob = namedtuple('UploadJob', ['key', 'destination', 'name', 'data', 'queued'])
+
+
+class UploadQueue:
+    """
+    Bounded queue of finished images uploaded by a pool of worker threads, so a
+    capture returns as soon as it's encoded and a slow or unreachable server
+    doesn't hold up the next capture.
+
+    When max_jobs uploads are waiting, drop_oldest drops the oldest one.
+    newest_per_destination replaces a waiting upload with the same key by the
+    new one (a live.jpg only needs the newest image), and drops the oldest if
+    it's still full. Uploads with their own key, like timestamped archive
+    files, are only ever dropped. A failed upload is tried attempts times, retry_delay
+    seconds apart.
+
+    :param upload - callable taking an UploadJob, True if the upload succeeded
+    :param workers - upload threads
+    :param max_jobs - uploads waiting at most
+    :param policy - drop_oldest or newest_per_destination
+    :param attempts - tries per upload
+    :param retry_delay - seconds before the next try, times the number of tries so far
+    """
+    def __init__(self, upload, workers=2, max_jobs=32, policy='drop_oldest', attempts=3, retry_delay=5.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid policy: {policy}")
+        self.upload = upload
+        self.max_jobs = max_jobs
+        self.policy = policy
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self.jobs = deque()
+        self.condition = Condition()
+        self.closing = Event()
+        self.active = 0
+        self.submitted = 0
+        self.uploaded = 0
+        self.failed = 0
+        self.dropped = 0
+        self.replaced = 0
+        self.retries = 0
+        self.bytes_uploaded = 0
+        self.max_depth = 0
+        self.wait_time = 0.0
+        self.threads = [Thread(target=self._run, name=f'upload-{index}', daemon=True) for index in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key, destination, name, data):
+        """Queue an upload, never blocks."""
+        with self.condition:
+            if self.policy == 'newest_per_destination':
+                for index, job in enumerate(self.jobs):
+                    if job.key == key:
+                        del self.jobs[index]
+                        self.replaced += 1
+                        break
+            if len(self.jobs) >= self.max_jobs:
+                dropped = self.jobs.popleft()
+                self.dropped += 1
+                logging.warning(f"Upload queue full, dropped {dropped.name} -> {dropped.destination}")
+            self.jobs.append(UploadJob(key, destination, name, data, time.monotonic()))
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, len(self.jobs))
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.jobs and not self.closing.is_set():
+                    self.condition.wait()
+                if not self.jobs:
+                    return
+                job = self.jobs.popleft()
+                self.active += 1
+                self.wait_time += time.monotonic() - job.queued
+            success = False
+            for attempt in range(1, self.attempts + 1):
+                try:
+                    success = self.upload(job)
+                except Exception as ex:
+                    print(f"Error uploading {job.name} to {job.destination}")
+                    print(ex)
+                if success or attempt == self.attempts:
+                    break
+                self.retries += 1
+                # Stops waiting on close(), the last try is made right away
+                self.closing.wait(self.retry_delay * attempt)
+            with self.condition:
+                self.active -= 1
+                if success:
+                    self.uploaded += 1
+                    self.bytes_uploaded += len(job.data)
+                else:
+                    self.failed += 1
+                self.condition.notify_all()
+
+    def join(self, timeout=None):
+        """Wait until every queued upload is done, :return False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.jobs and self.active == 0, timeout)
+
+    def close(self, timeout=None):
+        """Upload what's queued and stop the workers."""
+        self.closing.set()
+        with self.condition:
+            self.condition.notify_all()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def stats(self):
+        with self.condition:
+            done = self.uploaded + self.failed
+            return {'queued': len(self.jobs), 'active': self.active, 'submitted': self.submitted,
+                    'uploaded': self.uploaded, 'failed': self.failed, 'dropped': self.dropped,
+                    'replaced': self.replaced, 'retries': self.retries, 'bytes_uploaded': self.bytes_uploaded,
+                    'max_depth': self.max_depth,
+                    'average_wait': round(self.wait_time / done, 3) if done else None}
@@ -0,0 +1,108 @@
+import base64
+import hashlib
+import os
+import struct
+
+# RFC 6455 opcodes
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Header in front of every JPEG pushed on /ws/stream: frame sequence number and
+# capture time (seconds since the epoch), both big endian.
+STREAM_HEADER = struct.Struct('!Qd')
+
+MAX_CONTROL_PAYLOAD = 125
+
+
+def accept_key(key):
+    """Sec-WebSocket-Accept value for a Sec-WebSocket-Key."""
+    digest = hashlib.sha1((key + GUID).encode('ascii')).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def handshake_response(key):
+    return ('HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n').encode('ascii')
+
+
+def is_upgrade(headers):
+    """True if the (lower case) request headers ask for a WebSocket upgrade."""
+    return (headers.get('upgrade', '').lower() == 'websocket'
+            and 'upgrade' in headers.get('connection', '').lower()
+            and 'sec-websocket-key' in headers)
+
+
+def frame_header(length, opcode=OP_BINARY, mask=None):
+    """
+    Header of a single (final) WebSocket frame, the payload is sent separately so
+    it never has to be copied.
+
+    :param length - payload length
+    :param opcode - frame opcode
+    :param mask - 4 byte masking key, clients must mask, servers must not
+    """
+    first = 0x80 | opcode
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header = struct.pack('!BB', first, mask_bit | length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', first, mask_bit | 126, length)
+    else:
+        header = struct.pack('!BBQ', first, mask_bit | 127, length)
+    if mask:
+        header += mask
+    return header
+
+
+def apply_mask(payload, mask):
+    if not payload:
+        return payload
+    repeated = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(len(payload), 'big')
+
+
+def client_frame(payload, opcode=OP_BINARY):
+    """A masked frame as sent by a client."""
+    mask = os.urandom(4)
+    return frame_header(len(payload), opcode, mask) + apply_mask(payload, mask)
+
+
+def close_payload(code=1000, reason=''):
+    return struct.pack('!H', code) + reason.encode('utf-8')
+
+
+async def read_frame(reader, max_payload=1024 * 1024):
+    """
+    Read one frame from an asyncio StreamReader.
+
+    :return (opcode, payload), payload is unmasked
+
+    :raises ValueError if the frame is larger than max_payload
+    """
+    first, second = await reader.readexactly(2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if length > max_payload:
+        raise ValueError(f"WebSocket frame too large: {length}")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = apply_mask(payload, mask)
+    return opcode, payload
+
+
+def stream_message_header(frame):
+    """STREAM_HEADER for a lib.streaming_output.Frame."""
+    return STREAM_HEADER.pack(frame.sequence, frame.timestamp)
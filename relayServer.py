@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+
+# Relay for the camera stream, runs on any Linux box (no camera or picamera2 needed).
+# flaskServer.py with relay_url = <relay host>:<ingest port> pushes its frames over
+# one connection to this process, which serves them to any number of viewers with
+# the same API: /index.html, /stream.mjpg, /latest.jpg and /ws/stream.
+# Usage: python3 relayServer.py [--port 8000] [--ingest-port 8100] [--token secret]
+
+import argparse
+import asyncio
+
+from lib.async_server import AsyncStreamServer, Reply, redirect
+from lib.relay import RelayIngest
+from lib.streaming_output import StreamingOutput
+
+PAGE = """\
+<html>
+<head>
+<title>Camera relay</title>
+</head>
+<body>
+<h1>Camera relay</h1>
+<img src="/stream.mjpg" style="max-width: 100%;" />
+</body>
+</html>
+"""
+
+
+async def serve(args):
+    output = StreamingOutput()
+    ingest = RelayIngest(output, host=args.host, port=args.ingest_port, token=args.token)
+    routes = {
+        '/': (lambda request: redirect('/index.html', 301), False),
+        '/index.html': (lambda request: Reply(200, 'text/html', PAGE), False),
+    }
+    server = AsyncStreamServer(output, routes, host=args.host, port=args.port)
+    await ingest.start()
+    await server.start()
+    print(f"Relay ingest on {args.host}:{ingest.port}, viewers on http://{args.host}:{server.port}")
+    async with ingest.server, server.server:
+        await asyncio.gather(ingest.server.serve_forever(), server.server.serve_forever())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--ingest-port', type=int, default=8100)
+    parser.add_argument('--token', default='')
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
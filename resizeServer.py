@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+
+# Resize service for the web host, the Python alternative of WebPages/liveResize.php
+# (no camera or picamera2 needed). Serves /resize.jpg?width=&height=&fit=fill|contain|cover
+# of one JPEG file (e.g. the uploaded live.jpg) from a lib/resize_service.py LRU
+# cache, evicted entries spill to --spill-dir. /resize_stats.json reports the cache.
+# Usage: python3 resizeServer.py /var/www/live.jpg [--port 8080] [--cache-mb 32] [--spill-dir cache]
+
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from lib.resize_service import FileSource, ResizeCache, ResizeService, parse_resize_args
+from lib.streaming_output import etag_matches
+
+
+def handler_class(service):
+    class ResizeHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == '/resize_stats.json':
+                self.reply(200, 'application/json', json.dumps(service.stats()).encode())
+                return
+            if url.path != '/resize.jpg':
+                self.reply(404, 'text/plain', b'Not Found')
+                return
+            try:
+                width, height, fit = parse_resize_args(dict(parse_qsl(url.query)))
+                etag, data = service.resize(width, height, fit)
+            except ValueError as ex:
+                self.reply(400, 'text/plain', str(ex).encode())
+                return
+            except LookupError as ex:
+                self.reply(503, 'text/plain', str(ex).encode())
+                return
+            headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+            if etag_matches(self.headers.get('If-None-Match'), etag):
+                self.reply(304, None, b'', headers)
+            else:
+                self.reply(200, 'image/jpeg', data, headers)
+
+        def reply(self, status, content_type, body, headers=None):
+            self.send_response(status)
+            if content_type is not None:
+                self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+    return ResizeHandler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('image', help='JPEG to resize, re-read when it changes')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--quality', type=int, default=85)
+    parser.add_argument('--cache-mb', type=int, default=32)
+    parser.add_argument('--spill-dir', default=None)
+    parser.add_argument('--spill-mb', type=int, default=256)
+    args = parser.parse_args()
+
+    cache = ResizeCache(args.cache_mb * 1024 * 1024, args.spill_dir, args.spill_mb * 1024 * 1024)
+    service = ResizeService(FileSource(args.image), cache, args.quality)
+    server = ThreadingHTTPServer((args.host, args.port), handler_class(service))
+    print(f"Resizing {args.image} on http://{args.host}:{args.port}/resize.jpg?width=800&height=600")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
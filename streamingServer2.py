@@ -1,38 +1,39 @@
 from picamera2 import Picamera2
 from picamera2.encoders import JpegEncoder  # Changed from MJPEGEncoder
 from picamera2.outputs import Output
-import io
 from flask import Flask, Response, render_template_string
 from threading import Thread
 from time import sleep
 import libcamera  # Optional: for transform
+from lib.streaming_output import StreamingOutput, BOUNDARY, FRAME_TRAILER
 
 app = Flask(__name__)
 
 # Global camera instance
 picam2 = None
 encoder = None
-stream_buffer = None
+# Frames published by the encoder, every viewer waits on it for the next new frame
+stream_output = StreamingOutput()
 
 
 class MjpegOutput(Output):
-    """Custom Output that writes MJPEG frames to a BytesIO buffer."""
+    """Custom Output that publishes every encoded JPEG frame to a StreamingOutput."""
 
-    def __init__(self, buffer):
+    def __init__(self, frames):
         super().__init__()
-        self.buffer = buffer
+        self.frames = frames
 
-    def output(self, request):
-        """Called when a frame is ready; appends JPG to buffer."""
-        if request.completed_requests:
-            # Get the encoded buffer (bytes) from the request
-            encoded_data = request.completed_requests[0].buffers()[0].planes()[0].readable().tobytes()
-            self.buffer.write(encoded_data)
-            self.buffer.seek(0)  # Reset for reading
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        """
+        Called by the encoder when a frame is ready. The encoded frame is handed
+        over by reference, StreamingOutput only copies it if it isn't bytes
+        already, and the waiting viewers are woken.
+        """
+        self.frames.write(frame)
 
 
 def start_camera():
-    global picam2, encoder, stream_buffer
+    global picam2, encoder
     picam2 = Picamera2()
 
     # Video config for streaming (720p example; adjust as needed)
@@ -45,9 +46,8 @@ def start_camera():
     picam2.configure(config)
     picam2.framerate = 10  # Adjust for smoothness vs. CPU load
 
-    # Create BytesIO buffer and custom output
-    stream_buffer = io.BytesIO()
-    mjpeg_out = MjpegOutput(stream_buffer)
+    # Custom output publishing to the shared frame ring
+    mjpeg_out = MjpegOutput(stream_output)
 
     # Use JpegEncoder with direct quality (1-100); no 'quality' kwarg needed later
     encoder = JpegEncoder(q=85, num_threads=4)  # q=85 for your desired quality; threads for speed
@@ -57,20 +57,26 @@ def start_camera():
 
 
 def generate_frames():
-    while True:
-        if picam2 and picam2.started and stream_buffer:
-            stream_buffer.seek(0)
-            data = stream_buffer.read()  # Read current frame
-            if data:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + data + b'\r\n')
-        sleep(0.1)  # Frame rate control
+    """
+    Yields every new frame as soon as it is published. The sequence number of
+    the frame ring makes sure a frame is never sent twice, a viewer that falls
+    behind skips to the newest frame.
+    """
+    client = stream_output.register()
+    try:
+        while True:
+            frame = client.next_frame()
+            yield frame.header
+            yield frame.data
+            yield FRAME_TRAILER
+    finally:
+        client.close()
 
 
 @app.route('/stream.mjpg')
 def stream_mjpg():
     return Response(generate_frames(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
+                    mimetype=f'multipart/x-mixed-replace; boundary={BOUNDARY}')
 
 
 @app.route('/')
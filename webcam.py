@@ -1,8 +1,10 @@
+import atexit
 import os
 import time
+from contextlib import contextmanager
 import configparser
 from configparser import ConfigParser
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 import netifaces as ni
 import requests
 import getrpimodel as grpm
@@ -10,6 +12,11 @@ from PIL.BlpImagePlugin import Format
 
 from PIL.ImageFont import FreeTypeFont
 
+from lib.camera_session import CameraSession
+from lib.overlay import get_renderer
+from lib.target_size import TargetSizeEncoder
+from lib.dedup import CaptureDeduplicator
+
 
 class webcam:
     def __init__(self):
@@ -37,7 +44,24 @@ class webcam:
         self.script_dir = os.path.join(os.getcwd())
         # if not self.testing:
         self.output_file = None
+        self.session = None
+        # Images passed between the capture stages, only the final file is written
+        self.image = None
+        self.text_image = None
+        self.timings = {}
+        # Remembers recent qualities so steady scenes meet output_max_filesize_kb in one or two encodes
+        self.size_encoder = TargetSizeEncoder()
+        # debug_intermediates = true in the config also writes camera_image and text files
+        self.debug_intermediates = False
+        # dedup = true in the config skips captures that look like a recent one,
+        # the hashes are kept in image_dir/dedup.json between runs
+        self.dedup = False
+        self.dedup_distance = 4
         self._load_config()
+        self.deduplicator = None
+        if self.dedup:
+            self.deduplicator = CaptureDeduplicator(int(self.dedup_distance),
+                                                    path=os.path.join(self.output_dir, 'dedup.json'))
         return
 
     def _load_config(self):
@@ -140,87 +164,83 @@ class webcam:
     #     # # print(ret)
     #     # return ret
     
+    @contextmanager
+    def stage(self, name):
+        """Records the duration of a capture stage in self.timings."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def report_timings(self):
+        for name, seconds in self.timings.items():
+            print(f"{name:16s} {seconds * 1000:8.1f} ms")
+        print(f"{'total':16s} {sum(self.timings.values()) * 1000:8.1f} ms")
+
+    def dump_intermediate(self, image, name):
+        """With debug_intermediates the stage's image is written to the output folder."""
+        if self.debug_intermediates:
+            image.save(f'{self.output_dir}/{name}.{self.output_ext}')
+
     def capture_image(self):
         """
-        This method captures the image using the raspberry pi camera module
-
-        :param output_dir - location that the file is going to be stored.
-        :param output_ext - type of image tat is going to be created.
+        This method captures the image using the raspberry pi camera module, the
+        image is kept in memory (self.image) for the next stages.
 
         :return binary - True if everything went accordingt to plan, else False
         """
-        if not self.testing:
-            try:
-                print("Capturing image")
-                from picamera2 import Picamera2
-                camera = Picamera2()
-                # camera.framerate = 30
-                if 1==2:
-                    try:
-                        camera.resolution = (3280, 2464)
-                    except:
-                        print("Review readme for change in memory split to full support Camera v2")
-                        print("Resolution kept at 2592x1944")
-                        camera.resolution = (2592, 1944)
-                    camera.resolution = (cam_x, cam_y)
-                    camera.start_preview()
-                config = camera.create_still_configuration(main={"size": (4608, 2592)})
-                camera.configure(config)
-                camera.start()
-                time.sleep(2)
-                # baseExposure = camera.exposure_speed
-                # print("base exposure found: ", str(baseExposure))
-                # camera.capture(f'{self.output_dir}/camera_image.{self.output_ext}')
-                camera.capture_file(f'{self.output_dir}/camera_image.{self.output_ext}')
-                # print("Camera Revision:" + camera.revision)
-                # camera.close()
-                camera.stop()
-                return True
-            except Exception as ex:
-                print("Error in capture_image")
-                print(ex)
-                return False
-        else:
-            print("Testing mode, not capturing image")
+        with self.stage('capture'):
+            if not self.testing:
+                try:
+                    print("Capturing image")
+                    # The session stays configured and converged between captures
+                    self.image = self.camera_session().capture_image()
+                except Exception as ex:
+                    print("Error in capture_image")
+                    print(ex)
+                    return False
+            else:
+                print("Testing mode, using the fallback image")
+                fallback_path = os.path.join(self.script_dir,'image_dir','mountain-stream-in-forest.jpg')
+                self.image = Image.open(fallback_path)
+                self.image.load()
+            self.dump_intermediate(self.image, 'camera_image')
+            return True
+
+    def camera_session(self):
+        """
+        Camera session used by capture_image(), opened on first use and released
+        by close() or when the interpreter exits.
+        """
+        if self.session is None:
+            self.session = CameraSession(
+                config=lambda camera: camera.create_still_configuration(main={"size": (4608, 2592)}))
+            atexit.register(self.session.close)
+        return self.session
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
         
     def create_embed_text(self):
         """
         This method is going to create the text that is going to be put onto the
         photo ONLY. When the text is created it will then be embedded into the image.
 
-        Enhance with the path that the file should be saved to so that images aren't in the
-        root folder.
+        The text image is kept in memory (self.text_image).
         """
-        font_dir = '/'.join(self.output_dir.split('/')[:-1])
-        if len(self.embed_time) > 2:
-            self.camera_name = self.camera_name + ' - ' + self.cam_time()
-
-        # sample text and font
-        unicode_text = self.camera_name
-        # font_path = f'{self.script_dir}/fonts/AmazeFont.otf'
-        font_path = f'{self.script_dir}/fonts/AmazeFont.otf'
-        if self.testing == True:
-            print(font_path)
-
-        font = ImageFont.truetype(font=font_path, size=18)
-        left, top, right, bottom = font.getbbox(text=unicode_text, mode='string')
-        text_width = right - left
-        text_height = bottom - top
-
-        # create a blank canvas with extra space between lines
-        canvas = Image.new('RGB', (text_width + 10, text_height + 10), self.text_bg)
-
-        # draw the text onto the text canvas, and use black as the text color
-        draw = ImageDraw.Draw(canvas)
-        draw.text((5,5), self.camera_name, self.text_color, font)
-
-        # save the blank canvas to a file
-        output_dir = f"{self.output_dir}/text.{self.output_ext}"
-        try:
-            os.remove(output_dir)
-        except Exception as ex:
-            pass
-        canvas.save(output_dir)
+        with self.stage('embed_text'):
+            timestamp = len(self.embed_time) > 2
+            font_path = f'{self.script_dir}/fonts/AmazeFont.otf'
+            if self.testing == True:
+                print(font_path)
+
+            # The renderer is cached, the font and camera name are only rendered once
+            renderer = get_renderer(font_path, 18, self.text_color, self.text_bg, self.camera_name, timestamp)
+            self.text_image = renderer.render(self.cam_time() if timestamp else '')
+            self.dump_intermediate(self.text_image, 'text')
 
         return True
 
@@ -229,109 +249,64 @@ class webcam:
         """
         Creates the output file with the camera name and time embedded (text)
 
-        Should be updated to include the path for the text file so that the function doesn't
-        have to derive that on it's own.
+        The captured image and the text image are taken from memory, the output
+        file is the only file written.
 
         :param output_dir - output location of the created file
         :param filename - filename for the output file
         :param output_ext - Extension used for the output files
 
+        With dedup a capture that looks like a recent one isn't encoded or
+        written, last_unchanged.txt gets the time and '' is returned.
+
         :output image file
         """
-        global cam_x, cam_y
-
-        output_file = ''
-        try:
-            if self.testing:
-                fallback_path = os.path.join(self.script_dir,'image_dir','mountain-stream-in-forest.jpg')
-                background = Image.open(fallback_path)
-            else:
-                background = Image.open(f'{self.output_dir}/camera_image.{self.output_ext}')
-
-            try:
-                img = Image.open(f'{self.output_dir}/text.{self.output_ext}')
-            except Exception as ex:
-                print(f"Error creating img: {img}")
-
+        with self.stage('layer_and_save'):
+            if self.image is None or self.text_image is None:
+                print("Error create_image: capture_image() and create_embed_text() have to run first")
+                return ''
+            # Hashed before the text is pasted, the timestamp always differs
+            if self.deduplicator is not None and self.deduplicator.check(self.image):
+                print(f"Capture unchanged ({self.deduplicator.last_distance} bits differ), not written")
+                with open(f'{self.output_dir}/last_unchanged.txt', 'w') as f:
+                    f.write(self.file_date_string())
+                return ''
             try:
-                # output_file = f'{self.output_dir}/{filename}{file_date_code}.{output_ext}'
-                print(self.output_ext)
                 self.output_file = f'{self.output_dir}/{self.filename}{self.file_date_string()}.{self.output_ext}'
-                # self.output_file = f'{self.output_dir}\\{self.filename}{self.file_date_string()}.png'
                 print(self.output_file)
                 offset = (0, 0)
-                background.paste(img, offset)
-                # print(f"Saving {output_file}...")
-                background.save(self.output_file,format='JPEG')
-                # print(f"Resizing {output_file}")
-                # try:
-                #     self.image_file_size()
-                #     # pass
-                # except Exception as ex:
-                #     print ("Error create_image.image_file_size")
-                #     print(ex)
+                self.image.paste(self.text_image, offset)
+                # Encoded once in memory to the size budget, then written once
+                data = self.image_file_size().data
+                with open(self.output_file, 'wb') as f:
+                    f.write(data)
+                if self.deduplicator is not None:
+                    self.deduplicator.kept(1, len(data))
             except Exception as ex:
                 print("Error layering text on the background")
                 print(ex)
-        except Exception as ex:
-            print("Error create_image")
-            print(ex)
-        return output_file
+                return ''
+        return self.output_file
 
     def image_file_size(self):
         """
         This function is used to ensure consistent file size output if needed by the application.
 
         This will ensure that the time to transfer an image is theoretically the same on a daily/upload basis.
-        :param file_name - name of file to resize
-        :param w - desired width
-        :param h - desired height
-        :param kb - desired file size in kb
+        self.image is encoded in memory at the highest quality that fits
+        output_max_filesize_kb (lib/target_size.py), downscaled if even the lowest
+        quality doesn't fit. Without a budget it's encoded once at output_quality
+        (75, the PIL default, if it isn't configured).
+
+        :return TargetResult - JPEG bytes, quality, scale and number of encodes
         """
-        # print(file_name)
-        image = Image.open(self.output_file)
-        # print(image)
-        kb = kb * 1024
-        o_w, o_h = image.size
-        # image_size = image.shape
-        # print(f"image_size: {img_size}")
-        # o_w = img_size[0]
-        # o_h = img_size[1]
-        if o_w > o_h:
-            resize_percent = self.width / o_w
-        else:
-            resize_percent = self.height / o_h
-        n_w = w * resize_percent
-        n_h = h * resize_percent
-        image.resize((n_w, n_h))
-
-        quality_num = 100
-        image.save("resized.jpg", optimize=True, quality=quality_num)
-        # get file size
-        try:
-            file_size = os.path.getsize("resized.jpg")
-        except Exception as ex:
-            print("Couldn't get file size")
-            print(ex)
-        print(f"testing kb {file_size}")
-        # print(type(file_size))
-        # print(type(kb))
-        while os.path.getsize("resized.jpg") > kb:
-            quality_num -= 1
-            print(quality_num)
-            image.save("resized.jpg", optimize=True, quality=quality_num)
-            # file_size = os.path.getsize("resized.jpg")
-            if quality_num <= 0:
+        max_kb = int(getattr(self, 'output_max_filesize_kb', 0) or 0)
+        result = self.size_encoder.encode(self.image, max_kb * 1024, int(getattr(self, 'output_quality', 75)))
+        if max_kb > 0:
+            print(f"Quality {result.quality} scale {result.scale:.2f} for {max_kb} KB, {result.encodes} encodes")
+            if not result.fits:
                 print("COULDN'T RESIZE TO DESTINATION")
-                exit(0)
-        print("End testing kb")
-        # Now that the image is resized it needs to be saved to the same file
-        # that is going to be uploaded
-
-        os.remove(self.output_file)
-        os.rename("resized.jpg", self.output_file)
-
-        return quality_num
+        return result
 
     def connection_check(self, interface):
         """
@@ -414,6 +389,7 @@ class webcam:
         self.capture_image()
         self.create_embed_text()
         self.layer_text_img()
+        self.report_timings()
         if not self.m == None:
             self.update_rtc_time()
             self.connection_check("eth0")
@@ -428,6 +404,7 @@ def main():
     # piCam.create_embed_text()
     # piCam.layer_text_img()
     piCam.class_test()
+    piCam.close()
     return
 
 if __name__ == "__main__":